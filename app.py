@@ -1,55 +1,99 @@
 import os
 import json
+import hmac
+import math
 import uuid
 import phonenumbers
-import resend
+import click
 from dotenv import load_dotenv
-from flask import Flask, jsonify, json, make_response, request
+from flask import Flask, Response, jsonify, json, make_response, request, stream_with_context
 from flask_cors import CORS
-from phonenumbers import carrier, geocoder
 from pydantic import ValidationError
-from vonage import Auth, Vonage
-from vonage_sms import SmsMessage, SmsResponse
-from models import CreateUserInput, CreateUserOut, LocationResponse, LoginInput, LoginOut, PhoneNumberInput, PhoneNumberOut, ResetPsw, SendSmsInput, SendSmsOut, SaveLocationInput, SaveLocationOut, AccountVerificationInput, AccountVerificationOut, ChatBot, ChatBotOut, Unsubscribe, resResetPsw, resUnsubscribe
+from models import CreateUserInput, CreateUserOut, LocationResponse, LoginInput, LoginOut, PhoneNumberInput, PhoneNumberOut, PhoneNumberBatchInput, PhoneNumberBatchOut, ResetPsw, SendSmsInput, SendSmsOut, SaveLocationInput, SaveLocationOut, AccountVerificationInput, AccountVerificationOut, ChatBot, ChatBotOut, Unsubscribe, resResetPsw, resUnsubscribe
 from datetime import datetime, timedelta
-import smtplib
-from flask_jwt_extended import (create_access_token, get_jwt_identity, jwt_required, JWTManager)
-from google import genai
-from google.genai import types
-import stripe
+from flask_jwt_extended import (create_access_token, get_jwt_identity, jwt_required, verify_jwt_in_request, JWTManager)
 from service import (
-    create_user,
     unsubscribe_exists_by_email,
-    insert_pending_order,
-    mark_order_as_paid,
     exist_user,
+    decode_cursor,
     get_locations_request,
+    iter_locations_request,
     insert_location_request,
-    update_credits,
     get_credits,
+    consume_credit,
+    refund_credits,
+    credits_cache,
     insert_unsubscribe,
     user_exists_by_email,
     update_psw,
-    update_locations
+    upsert_location
 )
 import config
-from db import get_client, supabase, refresh_if_needed
+from db import release_request_client, pool, supabase_context
+from clients import get_stripe
+import payments
+from chatbot import answer, chat_cache, stream_answer
+from startup import import_time_report, warmup
+import outbox
+import webhook_events
+import sms
+import metrics
+import ratelimit
+from responses import FastJSONProvider, dumps, json_response
+from concurrency import branch, run_parallel
+from unsubscribes import unsubscribe_index
+from bulkhead import BulkheadRejected, CallTimeout, states as bulkhead_states
+from phone_info import lookup_phone_info, lookup_phone_info_batch, phone_cache
+import logger
+
+log = logger.get_logger(__name__)
 
 load_dotenv()
 
 
 app = Flask(__name__)
+# jsonify y request.json con orjson (responses.py)
+app.json = FastJSONProvider(app)
 app.config["JWT_SECRET_KEY"] = os.environ.get("SECRET_JWT")
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=2)
 jwt = JWTManager(app)
-
-#Stripe
-stripe.api_key = os.environ.get("SECRET_KEY_STRIPE")
-#resend
-resend.api_key =os.environ.get("RESEND_API_KEY")
-
-client = genai.Client(api_key=os.environ.get("GEMINI_KEY"))
-
+# Latencia por ruta para /metrics (se registra primero para medir también los demás hooks)
+metrics.init_app(app)
+# Id de petición (X-Request-ID) y muestreo de logs por ruta
+logger.init_app(app)
+# Rate limiting por API key, IP y usuario (429 antes de llamar a Supabase, Gemini o Resend)
+ratelimit.init_app(app)
+# Devuelve al pool el cliente Supabase tomado durante la petición
+app.teardown_appcontext(release_request_client)
+
+# Dependencia saturada o con el circuito abierto: 503 inmediato sin hacer trabajo
+@app.errorhandler(BulkheadRejected)
+def bulkhead_rejected(e):
+    response = jsonify({"error": "Servicio saturado, inténtalo de nuevo en unos segundos", "dependency": e.name})
+    response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+    return response, 503
+
+@app.errorhandler(CallTimeout)
+def dependency_timeout(e):
+    return jsonify({"error": str(e)}), 504
+
+if not config.VONAGE_DLR_TOKEN:
+    log.warning("VONAGE_DLR_TOKEN no está definido: /webhook/vonage-dlr rechaza todos los recibos")
+
+# El despachador del outbox, el procesador de eventos de Stripe y las colas de pedidos pendientes
+# y de SMS corren en cada proceso que atiende peticiones (comprobación por pid, barata) para
+# drenar también el correo, los eventos, los pedidos y los SMS que quedaron en disco antes de un reinicio.
+# El guardado periódico de métricas recoge también lo que cuentan esos hilos.
+@app.before_request
+def start_background_workers():
+    metrics.ensure_started()
+    outbox.ensure_started()
+    webhook_events.ensure_started()
+    payments.ensure_started()
+    sms.ensure_started()
+    unsubscribe_index.ensure_started()
+
+# Stripe, Resend, Gemini y Vonage se inicializan en el primer uso (clients.py)
 
 # Habilitar CORS para todas las rutas
 # Configuración de CORS
@@ -62,50 +106,31 @@ CORS(app, origins=["http://localhost:4200","https://www.quickgeo.mobi"],
 
 @app.route("/webhook", methods=["POST"])
 def stripe_webhook():
+    stripe = get_stripe()
     payload = request.data
     sig_header = request.headers.get("stripe-signature")
 
-    print("🔔 Webhook recibido")
+    log.info("Webhook de Stripe recibido")
     try:
         # ✅ Verifica la firma del webhook
         event = stripe.Webhook.construct_event(
             payload, sig_header, os.environ.get("WEBHOOK_SECRET_STRIPE")
         )
     except ValueError as e:
-        print("❌ Error en el cuerpo del evento:", e)
+        log.warning("Webhook de Stripe con cuerpo inválido", extra={"error": str(e)})
         return jsonify({"error": "Invalid payload"}), 400
     except stripe.SignatureVerificationError as e:
-        print("❌ Error de firma:", e)
+        log.warning("Webhook de Stripe con firma inválida", extra={"error": str(e)})
         return jsonify({"error": "Invalid signature"}), 400
 
-    # 🎯 Procesar evento
-    if event["type"] == "payment_intent.succeeded":
-        payment_intent = event["data"]["object"]
-        payment_id = payment_intent["id"]
-        customer_id = payment_intent.get("customer")
-
-        print(f"✅ Pago exitoso: {payment_id} para el cliente {customer_id}")
-
-        # 🔑 Crear suscripción automáticamente tras el pago exitoso
-        try:
-            price_id = os.environ.get("PRICE_ID_STRIPE")
-            subscription = stripe.Subscription.create(
-                customer=customer_id,
-                items=[{"price": price_id}],
-                trial_period_days=1,
-                expand=["latest_invoice.payment_intent"]
-            )
-
-            print(f"📦 Suscripción creada: {subscription.id}")
-            jwt_token = refresh_if_needed()
-            order = mark_order_as_paid(payment_id,jwt_token)
-            name = order["name"]
-            email = order["email"]
-            # (Opcional) Actualizar tu base de datos o lógica interna
-            create_user(name, email, jwt_token)
-        except Exception as e:
-            print("❌ Error al crear la suscripción o usuario:", e)
-            return jsonify({"error": str(e)}), 400
+    # 🎯 Guardar el evento (deduplicado por event.id); se procesa en segundo plano
+    try:
+        is_new = webhook_events.record(event, payload)
+    except Exception as e:
+        log.exception("No se pudo guardar el evento de Stripe")
+        return jsonify({"error": "No se pudo registrar el evento"}), 500
+    if not is_new:
+        log.info("Evento de Stripe duplicado ignorado", extra={"event_id": event["id"]})
     return jsonify({"success": True}), 200
 
 @app.route('/api/checkout', methods=['POST'])
@@ -114,36 +139,26 @@ def checkout():
     name = request.json.get("name")
     email = request.json.get("email")
 
+    # El checkout admite clientes anónimos; con un JWT válido se pasa el
+    # usuario para poder reutilizar su cliente de Stripe
     try:
-        # 🧾 Crear cliente
-        customer = stripe.Customer.create(
-            name=name,
-            email=email,
-            payment_method=payment_method_id,
-            invoice_settings={"default_payment_method": payment_method_id},
-        )
+        verify_jwt_in_request(optional=True, locations=["headers"])
+        user_id = get_jwt_identity()
+    except Exception:
+        user_id = None
 
-        # 💳 Crear PaymentIntent (solo se confirma en frontend)
-        payment_intent = stripe.PaymentIntent.create(
-            amount=50,  # 💰 Pago inicial (por ejemplo, verificación)
-            currency="eur",
-            customer=customer.id,
-            payment_method=payment_method_id,
-            confirmation_method="automatic",
-        )
-
-        jwt_token = refresh_if_needed()
-        # Guardar pedido pendiente en tu BD
-        insert_pending_order(name, email, 'es', payment_intent.id, jwt_token)
+    try:
+        # Cliente de Stripe reutilizado solo para el email de la sesión e idempotencia por Idempotency-Key (payments.py)
+        result = payments.start_checkout(name, email, payment_method_id, request.headers.get("Idempotency-Key"),
+                                         user_id=user_id)
 
         # 🔄 Ya no se crea la suscripción aquí — se hace en el webhook
-        return jsonify({
-            "clientSecret": payment_intent.client_secret,
-            "customerId": customer.id
-        }), 200
+        return jsonify(result), 200
 
+    except (BulkheadRejected, CallTimeout):
+        raise
     except Exception as e:
-        print("❌ Error en checkout:", e)
+        log.exception("Error en checkout")
         return jsonify(error=str(e)), 400
 
 @app.route('/api/phone-info', methods=['POST'])
@@ -159,28 +174,81 @@ def get_phone_info():
 
         # Validamos los datos de entrada con Pydantic
         data = PhoneNumberInput.model_validate(request.json)
-        code = data.code
-        phone_number = data.phone_number
-        code_lang = data.code_lang
-
-        # Procesamos el número telefónico con phonenumbers
-        parsed_number = phonenumbers.parse(f"{code}{phone_number}")
-        
-        # Obtenemos el país y operador
-        country = geocoder.description_for_number(parsed_number, code_lang)  # País en inglés
-        operator = carrier.name_for_number(parsed_number, code_lang)  # Operador en inglés
-        # Modelo de salida
-        response = PhoneNumberOut(status=True,description="Exitoso",country=country, operator=operator)
-        return jsonify(response.model_dump()), 200
+
+        # País y operador (cacheados por número normalizado e idioma)
+        response = lookup_phone_info(data.code, data.phone_number, data.code_lang)
+        return json_response(response)
     except ValidationError as e:
         response = PhoneNumberOut(status=False,description=str(e),country="", operator="")
-        return jsonify(response.model_dump()), 400
+        return json_response(response, 400)
     except phonenumbers.phonenumberutil.NumberParseException as e:
         response = PhoneNumberOut(status=False,description=str(e),country="", operator="")
-        return jsonify(response.model_dump()), 400
+        return json_response(response, 400)
     except Exception as e:
         response = PhoneNumberOut(status=False,description=str(e),country="", operator="")
-        return jsonify(response.model_dump()), 500
+        return json_response(response, 500)
+
+@app.route('/api/phone-info/batch', methods=['POST'])
+def get_phone_info_batch():
+    api_key = request.headers.get("X-API-KEY")
+    API_SECRET = os.environ.get("SECRET_API")
+
+    if api_key != API_SECRET:
+        return jsonify({"error": "No autorizado"}), 403
+
+    try:
+        # Acepta una lista directa o {"items": [...]}
+        body = request.json
+        data = PhoneNumberBatchInput.model_validate({"items": body} if isinstance(body, list) else body)
+        if len(data.items) > config.PHONE_BATCH_MAX_ITEMS:
+            return jsonify({"error": f"Máximo {config.PHONE_BATCH_MAX_ITEMS} números por solicitud"}), 400
+
+        # Validamos cada elemento por separado: un error no invalida el lote
+        results = [None] * len(data.items)
+        valid_indexes = []
+        valid_items = []
+        for index, item in enumerate(data.items):
+            try:
+                phone = PhoneNumberInput.model_validate(item)
+                valid_indexes.append(index)
+                valid_items.append((phone.code, phone.phone_number, phone.code_lang))
+            except ValidationError as e:
+                results[index] = PhoneNumberOut(status=False, description=str(e), country="", operator="")
+
+        for index, result in zip(valid_indexes, lookup_phone_info_batch(valid_items)):
+            results[index] = result
+
+        response = PhoneNumberBatchOut(results=results)
+        return json_response(response, 200)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    api_key = request.headers.get("X-API-KEY")
+    API_SECRET = os.environ.get("SECRET_API")
+
+    if api_key != API_SECRET:
+        return jsonify({"error": "No autorizado"}), 403
+    return jsonify({"phone_cache": phone_cache.stats(), "supabase_pool": pool.stats(),
+                    "credits_cache": credits_cache.stats(),
+                    "chat_cache": chat_cache.stats(),
+                    "bulkheads": bulkhead_states(), "outbox": outbox.stats(),
+                    "unsubscribes": unsubscribe_index.stats(),
+                    "stripe_events": webhook_events.stats(),
+                    "sms": sms.stats(),
+                    "rate_limits": ratelimit.limiter.stats(),
+                    "checkout": payments.stats(),
+                    "logging": logger.stats()}), 200
+
+# Métricas en formato de texto de Prometheus (suma de todos los workers del nodo)
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if config.METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {config.METRICS_TOKEN}":
+        return jsonify({"error": "No autorizado"}), 403
+    return Response(metrics.exposition(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/api/login", methods=["POST"])
 def login():
@@ -188,17 +256,15 @@ def login():
     email = data.email
     password = data.password
 
-    jwt_token = refresh_if_needed()
-    userData = exist_user(jwt_token,email.lower(),password)
+    userData = exist_user(email.lower(),password)
     if len(userData.data)<=0:
             response = LoginOut(message='Unauthorized',token='')
-            return jsonify(response.model_dump()), 401
+            return json_response(response, 401)
     
-    userData = json.loads(userData.model_dump_json())
-    userId = userData['data'][0]['id']
+    userId = userData.data[0]['id']
     access_token = create_access_token(identity=str(userId))
     response = LoginOut(message="Success", token=access_token)
-    return jsonify(response.model_dump()), 200
+    return json_response(response, 200)
 
 @app.route("/api/unsubscribe", methods=["POST"])
 def unsubscribe():
@@ -208,27 +274,30 @@ def unsubscribe():
         return jsonify({"error": "No autorizado"}), 403
     data = Unsubscribe.model_validate(request.json)
     email = data.email
-    jwt_token = refresh_if_needed()
-    client_supabase = get_client(jwt_token)
     statuscode =200
     try:
-        if user_exists_by_email(client_supabase,email):
-            if unsubscribe_exists_by_email(client_supabase,email):
+        # Ambas comprobaciones se lanzan a la vez; cada rama toma su cliente del pool
+        user_exists, unsubscribed = run_parallel(
+            branch(lambda: user_exists_by_email(supabase_context().client, email)),
+            branch(lambda: unsubscribe_exists_by_email(supabase_context().client, email)),
+        )
+        if user_exists:
+            if unsubscribed:
                 statuscode=404
                 response = resUnsubscribe(message="Email no cuenta con subscripción activa")
             else:
                 statuscode=200
-                insert_unsubscribe(jwt_token,email.lower())
+                insert_unsubscribe(email.lower())
                 response = resUnsubscribe(message="Suscripcion eliminada con exito")   
         else:
             statuscode=404
             response = resUnsubscribe(message="Email no cuenta con subscripción activa")
-        return jsonify(response.model_dump()), statuscode
+        return json_response(response, statuscode)
     except Exception as e:
-        print(f"[unsubscribe]: {e}")
+        log.exception("Error en unsubscribe")
         statuscode=500
         response = resUnsubscribe(message="Ocurrió un error")
-        return jsonify(response.model_dump()), statuscode
+        return json_response(response, statuscode)
 
 @app.route("/api/reset-psw", methods=["POST"])
 def reset_psw():
@@ -245,8 +314,7 @@ def reset_psw():
         email = data.email
 
         # Obtener token y cliente
-        jwt_token = refresh_if_needed()
-        client_supabase = get_client(jwt_token)
+        client_supabase = supabase_context().client
 
         # Valor por defecto
         statuscode = 200
@@ -259,96 +327,79 @@ def reset_psw():
             statuscode = 404
             response = resResetPsw(message="Usuario no encontrado")
 
-        return jsonify(response.model_dump()), statuscode
+        return json_response(response, statuscode)
 
     except ValidationError as e:
-        print(f"[reset-psw] Error de validación: {e}")
+        log.info("reset-psw con datos inválidos", extra={"error": str(e)})
         response = resResetPsw(message=str(e))
-        return jsonify(response.model_dump()), 400
+        return json_response(response, 400)
 
     except Exception as e:
-        print(f"[reset-psw] Error interno: {e}")
+        log.exception("Error en reset-psw")
         response = resResetPsw(message="Ocurrió un error interno")
-        return jsonify(response.model_dump()), 500
+        return json_response(response, 500)
 
 @app.route('/api/send-sms', methods=['POST'])
 @jwt_required(locations=["headers"])
 def send_sms():
     id_user = get_jwt_identity()
-    jwt_token = refresh_if_needed()
+    reserved = False
 
     try:
         # Validar entrada con Pydantic
         data = SendSmsInput.model_validate(request.json)
-        credits = data.credits
 
-        # Si no hay créditos suficientes
-        if credits <= 0:
+        # Los créditos se validan en el servidor, no con el valor que envía el cliente:
+        # se reserva un crédito de forma atómica antes de enviar y se devuelve si falla.
+        if consume_credit(id_user) is None:
             response = SendSmsOut(status=False, description="No tienes créditos suficientes")
-            return jsonify(response.model_dump()), 400
-
-        # Configuración de entorno
-        API_KEY = os.environ.get("API_KEY_VONAGE")
-        API_SECRET = os.environ.get("API_SECRET_VONAGE")
-        BRAND_NAME = os.environ.get("BRAND_NAME_VONAGE")
-        DOMAIN_LOCALIZE = os.environ.get("DOMAIN_LOCALIZATION")
-
-        # Inicializar cliente SMS
-        client = Vonage(Auth(api_key=API_KEY, api_secret=API_SECRET))
+            return json_response(response, 400)
+        reserved = True
 
-        # Preparar datos
+        # Registrar la solicitud antes de enviar; el SMS sale en segundo plano
         message_uuid = str(uuid.uuid4())
-        code_number = data.code.replace("+", "")
-        parsed_number = f"{code_number}{data.phone_number}"
-        linkApp = f"{DOMAIN_LOCALIZE}?uuid={message_uuid}"
-
-        # Crear mensaje
-        message = SmsMessage(
-            to=parsed_number,
-            from_=BRAND_NAME or ".",
-            text=f"Localiza tu teléfono aquí: {linkApp}"
-        )
-
-        # Enviar SMS
-        response_sms: SmsResponse = client.sms.send(message)
-
-        # Analizar respuesta
-        smsstatus = 2
-        statusCode = 500
-        description = "Ocurrió un error en el envío del mensaje"
-
-        if hasattr(response_sms, "messages") and len(response_sms.messages) > 0:
-            msg = response_sms.messages[0]
-            if msg.status == "0":
-                smsstatus = 1
-                statusCode = 200
-                description = "SMS enviado correctamente"
-            else:
-                smsstatus = 0
-                statusCode = 400
-                description = f"No se pudo enviar el mensaje: {msg.error_text}"
-
-        # Guardar registro del intento
         timestamp = datetime.now().isoformat()
-        insert_location_request(jwt_token, message_uuid, smsstatus, timestamp, data.code, data.phone_number, data.code_country, id_user)
+        if insert_location_request(message_uuid, sms.SMS_QUEUED, timestamp, data.code, data.phone_number, data.code_country, id_user) is None:
+            refund_credits(id_user)
+            reserved = False
+            response = SendSmsOut(status=False, description="Ocurrió un error en el envío del mensaje")
+            return json_response(response, 500)
 
-        # Actualizar créditos si fue exitoso
-        if smsstatus == 1:
-            update_credits(jwt_token, credits - 1, int(id_user))
+        sms.enqueue(message_uuid, data.code, data.phone_number)
 
         # Respuesta final
-        response = SendSmsOut(status=(smsstatus == 1), description=description)
-        return jsonify(response.model_dump()), statusCode
+        response = SendSmsOut(status=True, description="SMS en proceso de envío")
+        return json_response(response, 200)
 
     except ValidationError as e:
-        print(f"[api/send-sms] Validation Error: {e}")
+        log.info("send-sms con datos inválidos", extra={"error": str(e)})
         response = SendSmsOut(status=False, description=str(e))
-        return jsonify(response.model_dump()), 400
+        return json_response(response, 400)
 
     except Exception as e:
-        print(f"[api/send-sms] Unexpected Error: {e}")
+        log.exception("Error en send-sms")
+        if reserved:
+            refund_credits(id_user)
         response = SendSmsOut(status=False, description=str(e))
-        return jsonify(response.model_dump()), 500
+        return json_response(response, 500)
+
+# Recibos de entrega (DLR) de Vonage: actualizan smsstatus de la solicitud
+# (y devuelven el crédito si no se entregó). Vonage puede enviarlos por GET
+# (query) o POST (JSON o formulario); se responde siempre 204 para que no
+# reintente recibos que no reconocemos. El token es obligatorio: sin
+# VONAGE_DLR_TOKEN configurado se rechazan todos.
+@app.route('/webhook/vonage-dlr', methods=['GET', 'POST'])
+def vonage_delivery_receipt():
+    token = config.VONAGE_DLR_TOKEN
+    if not token or not hmac.compare_digest(request.args.get("token", ""), token):
+        return jsonify({"error": "No autorizado"}), 403
+    params = {**request.args.to_dict(), **request.form.to_dict(), **(request.get_json(silent=True) or {})}
+    try:
+        if not sms.handle_delivery_receipt(params):
+            log.info("Recibo de Vonage ignorado", extra={"message_id": params.get("messageId"), "status": params.get("status")})
+    except Exception as e:
+        log.exception("Error aplicando el recibo de Vonage")
+    return "", 204
 
 @app.route('/api/save-location', methods=['POST'])
 def save_location():
@@ -360,37 +411,52 @@ def save_location():
          longitude = data.longitude
          timestamp = data.timestamp
          country = data.city
-         jwt_token = refresh_if_needed()
-         client_supabase = get_client(jwt_token)
-         rldata_response = client_supabase.table("LocationRequests").update({"status": True}).eq("message_uuid",message_uuid).execute()
-         rldata_response = json.loads(rldata_response.model_dump_json())
-         if len(rldata_response['data']) != 0:
-             update_locations(client_supabase,message_uuid,latitude,longitude,country,timestamp)
+         client_supabase = supabase_context().client
+         if upsert_location(client_supabase,message_uuid,latitude,longitude,country,timestamp):
              statusCode = 201
              response = SaveLocationOut(message="Success")
          else:
              statusCode = 404
              response = SaveLocationOut(message="Bad Request location")
-         return jsonify(response.model_dump()), statusCode
+         return json_response(response, statusCode)
      except ValidationError as e:
          statusCode = 400
          response = SaveLocationOut(message=str(e))
-         return jsonify(response.model_dump()), statusCode
+         return json_response(response, statusCode)
      except Exception as e:
          statusCode = 500
          response = SaveLocationOut(message=str(e))
-         return jsonify(response.model_dump()), statusCode
+         return json_response(response, statusCode)
 
 @app.route("/api/location-requests", methods=["GET"])
 @jwt_required(locations=["headers"])  # Ahora busca el token en el encabezado
 def location_requests():
     try:
         id_user = get_jwt_identity()
-        jwt_token = refresh_if_needed()
-        location_requests = get_locations_request(id_user, jwt_token)
-        credits=get_credits(jwt_token,id_user)
-        location_requests = json.loads(location_requests.model_dump_json())
-        return jsonify(details={"credits":credits,"history":location_requests['data']}), 200
+        limit = min(max(request.args.get("limit", config.HISTORY_PAGE_SIZE, type=int), 1), config.HISTORY_MAX_PAGE_SIZE)
+        cursor = request.args.get("cursor")
+
+        # Modo streaming: una línea JSON por solicitud, leyendo página a página
+        if request.args.get("format") == "ndjson":
+            # El cursor se valida antes de empezar a responder (400, no un stream cortado)
+            if cursor:
+                decode_cursor(cursor)
+            credits = get_credits(id_user)
+            def generate():
+                yield dumps({"credits": credits}) + b"\n"
+                for row in iter_locations_request(id_user, limit, cursor):
+                    yield dumps(row) + b"\n"
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson"), 200
+
+        # Historial y créditos no dependen entre sí: se consultan en paralelo
+        (history, next_cursor), credits = run_parallel(
+            branch(get_locations_request, id_user, limit, cursor),
+            branch(get_credits, id_user),
+        )
+        return json_response({"details": {"credits": credits, "history": history, "next_cursor": next_cursor}})
+    except ValueError as e:
+        # Cursor inválido
+        return jsonify(details={}), 400
     except Exception as e:
         return jsonify(details={}), 500
 
@@ -406,50 +472,105 @@ def chat():
     
     data = ChatBot.model_validate(request.json)
     user_message = data.message
+
+    # Modo streaming (SSE) para clientes que lo piden; el modo JSON se mantiene
+    if request.args.get("stream") == "1" or "text/event-stream" in request.headers.get("Accept", ""):
+        return chat_stream(user_message)
+
     try:
-        response = client.models.generate_content(
-                    model="gemini-2.0-flash",
-                    config=types.GenerateContentConfig(
-                        system_instruction="""
-                                    Eres un asistente virtual de la Web QuickGeo.
-
-                                    Tu función es ayudar a los usuarios respondiendo sobre:
-                                    - Información general sobre QuickGeo
-                                    - Horarios de atención (lunes a viernes de 9:00 a 18:00).
-                                    - Disponibilidad de servicios (24/7)
-                                    - Precios de nuestros planes (0.50€/prueba 24hrs luego 50€/mes).
-                                    - Métodos de contacto oficiales (contact@quickgeo.mobi).
-                                    - Funciones principales de nuestra App QuickGeo y cómo utilizarlas.
-
-                                    Las caracteristicas de QuickGeo son las siguientes:
-
-                                    - Soporte Universal: Accede desde cualquier dispositivo sin importar la marca o el sistema que uses, la plataforma se adapta para ofrecerte la mejor experiencia.
-                                    - Localización precisa: Encuentra cualquier número con exactitud en segundos desde cualquier lugar. Funciona con todas las redes móviles sin importar la operadora.
-                                    - No se requiere instalación: Usa el servicio al instante sin descargar nada ni configurar tu dispositivo. Solo ingresa el número y obtén la información al momento
-                                    - Privacidad garantizada: Tu seguridad es nuestra prioridad navegás de forma completamente anónima sin rastreos para que disfrutes del servicio con total confianza.
-
-                                    Como funciona:
-
-                                    - Realizar una búsqueda en un número: Nuestra tecnología comienza a localizar e identificar el teléfono asociado.
-                                    - Solicitar una ubicación precisa: Enviamos un mensaje de texto al teléfono objetivo para localizarlo. Este mensaje es anónimo por defecto, pero puede ser personalizado para aumentar las posibilidades de éxito.
-                                    - Obtén tus resultados: Serás informado automáticamente con la dirección tan pronto como el destinatario confirme su ubicación.
-
-                                    Siempre debes mantener un tono cordial, profesional y enfocado en resolver las necesidades del cliente. 
-                                    Si alguna información solicitada no está disponible, invítalos amablemente a comunicarse directamente a través de nuestros canales oficiales.
-                                    Recuerda: No inventes información. Si no sabes la respuesta exacta, deriva al contacto oficial.
-                                    """),
-                    contents=user_message
-                )
-        response = ChatBotOut(response=response.text)
-        return jsonify(response.model_dump()), 200
+        response = ChatBotOut(response=answer(user_message))
+        return json_response(response, 200)
+    except (BulkheadRejected, CallTimeout):
+        raise
     except ValidationError as e:
         statusCode = 400
         response = ChatBotOut(response=str(e))
-        return jsonify(response.model_dump()), statusCode
+        return json_response(response, statusCode)
     except Exception as e:
         statusCode = 500
         response = ChatBotOut(response=str(e))
-        return jsonify(response.model_dump()), statusCode
+        return json_response(response, statusCode)
+
+def chat_stream(user_message: str) -> Response:
+    def sse(event: str, payload: dict) -> str:
+        return f"event: {event}\ndata: {dumps(payload).decode()}\n\n"
+
+    # Puede lanzar BulkheadRejected antes de empezar a responder (503)
+    chunks = stream_answer(user_message)
+
+    def generate():
+        try:
+            for text in chunks:
+                yield sse("message", {"text": text})
+            yield sse("done", {})
+        except Exception as e:
+            log.exception("Error en el streaming del chat")
+            yield sse("error", {"error": str(e)})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(generate(), mimetype="text/event-stream", headers=headers)
+    # Se ejecuta al terminar o si el cliente se desconecta: cancela Gemini y libera el bulkhead
+    response.call_on_close(chunks.close)
+    return response
+
+@app.cli.command("startup-report")
+@click.option("--module", default="app", help="Módulo a importar en frío.")
+@click.option("--top", default=20, help="Cantidad de módulos a mostrar.")
+def startup_report(module, top):
+    """Muestra el desglose de `-X importtime` del arranque en frío."""
+    report = import_time_report(module, top)
+    if report["error"]:
+        click.echo(f"Error importando {module}: {report['error']}")
+    click.echo(f"{module}: {report['wall_ms']:.1f} ms de proceso, {report['import_ms']:.1f} ms importando")
+    click.echo(f"{'acumulado ms':>13} {'propio ms':>10}  módulo")
+    for entry in report["top"]:
+        click.echo(f"{entry['cumulative_ms']:>13.1f} {entry['self_ms']:>10.1f}  {'  ' * entry['depth']}{entry['module']}")
+
+@app.cli.command("warmup")
+def warmup_command():
+    """Inicia sesión en Supabase y crea los clientes SDK, mostrando lo que tarda cada uno."""
+    for name, ms in warmup().items():
+        click.echo(f"{name}: {ms:.1f} ms")
+
+@app.cli.group("webhook-events")
+def webhook_events_cli():
+    """Inspecciona y reprocesa eventos del webhook de Stripe."""
+
+@webhook_events_cli.command("list")
+@click.option("--status", default=None, help="pending, processing, done, failed o ignored.")
+@click.option("--limit", default=50)
+def webhook_events_list(status, limit):
+    for event in webhook_events.list_events(status, limit):
+        received = datetime.fromtimestamp(event["received_at"]).isoformat(timespec="seconds")
+        click.echo(f"{event['id']}  {event['type']:<28} {event['status']:<10} intentos={event['attempts']}  {received}  {event['last_error'] or ''}")
+
+@webhook_events_cli.command("show")
+@click.argument("event_id")
+def webhook_events_show(event_id):
+    event = webhook_events.get_event(event_id)
+    if event is None:
+        raise click.ClickException(f"Evento no encontrado: {event_id}")
+    event["payload"] = json.loads(event["payload"])
+    event["steps"] = json.loads(event["steps"])
+    click.echo(json.dumps(event, indent=2, ensure_ascii=False))
+
+@webhook_events_cli.command("replay")
+@click.argument("event_ids", nargs=-1)
+@click.option("--failed", is_flag=True, help="Reprocesa todos los eventos fallidos.")
+@click.option("--reset-steps", is_flag=True, help="Repite también los pasos ya completados.")
+@click.option("--now", is_flag=True, help="Procesa en este proceso en lugar de esperar al worker.")
+def webhook_events_replay(event_ids, failed, reset_steps, now):
+    ids = list(event_ids)
+    if failed:
+        ids += [event["id"] for event in webhook_events.list_events("failed", limit=1000)]
+    for event_id in ids:
+        if not webhook_events.replay(event_id, reset_steps, claim=now):
+            click.echo(f"{event_id}: no encontrado")
+            continue
+        if now:
+            click.echo(f"{event_id}: {webhook_events.process(webhook_events.get_event(event_id))}")
+        else:
+            click.echo(f"{event_id}: en cola")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,101 @@
+"""Serialización de un historial de ubicaciones grande: camino anterior
+(APIResponse -> json.loads(model_dump_json()) -> jsonify) frente a
+json_response (una sola pasada a bytes con orjson) y gzip opcional.
+
+Mide tiempo de CPU por respuesta y memoria asignada (pico de tracemalloc).
+
+Uso: python benchmarks/bench_json.py [--rows 5000] [--iterations 50]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify  # noqa: E402
+from postgrest import APIResponse  # noqa: E402
+import responses  # noqa: E402
+from responses import FastJSONProvider, json_response  # noqa: E402
+
+
+def history(rows: int) -> list:
+    return [
+        {
+            "id": i,
+            "status": i % 3 == 0,
+            "smsstatus": i % 4,
+            "codephone": "+34",
+            "phonenumber": f"6{i:08d}",
+            "codecountry": "ES",
+            "created_at": f"2024-05-{1 + i % 28:02d}T10:{i % 60:02d}:00.123456+00:00",
+            "Locations": [{"latitude": 40.4168 + i / 1e5, "longitude": -3.7038 - i / 1e5,
+                           "captured_at": "2024-05-01T10:00:00+00:00", "city": "Madrid"}] if i % 3 == 0 else [],
+        }
+        for i in range(rows)
+    ]
+
+
+def legacy(app, api_response):
+    # Antes: el modelo de PostgREST se serializaba a texto, se volvía a parsear y jsonify lo serializaba otra vez
+    data = json.loads(api_response.model_dump_json())
+    return jsonify(details={"credits": 10, "history": data["data"], "next_cursor": None}).get_data()
+
+
+def default_jsonify(app, api_response):
+    return jsonify(details={"credits": 10, "history": api_response.data, "next_cursor": None}).get_data()
+
+
+def fast(app, api_response):
+    return json_response({"details": {"credits": 10, "history": api_response.data, "next_cursor": None}}).get_data()
+
+
+def measure(fn, app, api_response, iterations: int) -> dict:
+    fn(app, api_response)
+    start = time.process_time()
+    for _ in range(iterations):
+        body = fn(app, api_response)
+    cpu_ms = (time.process_time() - start) / iterations * 1000
+    tracemalloc.start()
+    fn(app, api_response)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_ms": cpu_ms, "peak_kib": peak / 1024, "bytes": len(body)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    api_response = APIResponse(data=history(args.rows), count=None)
+    legacy_app = Flask("legacy")
+    fast_app = Flask("fast")
+    fast_app.json = FastJSONProvider(fast_app)
+
+    print(f"{args.rows} filas, {args.iterations} iteraciones, orjson={'sí' if responses.orjson else 'no'}")
+    cases = [
+        ("json.loads(model_dump_json()) + jsonify", legacy_app, legacy),
+        ("jsonify (proveedor estándar)", legacy_app, default_jsonify),
+        ("json_response", fast_app, fast),
+    ]
+    results = {}
+    for name, app, fn in cases:
+        with app.test_request_context():
+            results[name] = r = measure(fn, app, api_response, args.iterations)
+        print(f"{name:<42} {r['cpu_ms']:8.2f} ms  pico {r['peak_kib']:9.0f} KiB  {r['bytes']:>9} bytes")
+
+    with fast_app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        r = measure(fast, fast_app, api_response, args.iterations)
+    print(f"{'json_response + gzip':<42} {r['cpu_ms']:8.2f} ms  pico {r['peak_kib']:9.0f} KiB  {r['bytes']:>9} bytes")
+
+    base = results["json.loads(model_dump_json()) + jsonify"]
+    new = results["json_response"]
+    print(f"CPU: {base['cpu_ms'] / new['cpu_ms']:.1f}x menos; memoria pico: {base['peak_kib'] / new['peak_kib']:.1f}x menos")
+
+
+if __name__ == "__main__":
+    main()
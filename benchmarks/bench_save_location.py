@@ -0,0 +1,91 @@
+"""Viajes a la BD de /api/save-location: flujo anterior (update de la
+solicitud + exist_location + update/insert) frente a la función
+save_location en una sola llamada RPC.
+
+Usa un cliente falso que cuenta cada .execute() y simula la latencia de
+red, así que no necesita Supabase.
+
+Uso: python benchmarks/bench_save_location.py [--rtt-ms 40] [--iterations 50]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class CountingClient:
+    """Imita la API encadenada de supabase-py; cada execute() es un viaje."""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.round_trips = 0
+        self._result = None
+
+    def _chain(self, result):
+        self._result = result
+        return self
+
+    def table(self, name):
+        self._table = name
+        return self
+
+    def rpc(self, name, params):
+        return self._chain(True)
+
+    def update(self, values):
+        return self._chain([values])
+
+    def insert(self, values):
+        return self._chain([values])
+
+    def select(self, *args):
+        return self._chain([])
+
+    def eq(self, *args):
+        return self
+
+    def execute(self):
+        self.round_trips += 1
+        time.sleep(self.rtt)
+        return _Response(self._result)
+
+
+def legacy_save(client, message_uuid, latitude, longitude, city, timestamp):
+    # Flujo anterior a save_location (app.save_location + service.update_locations)
+    updated = client.table("LocationRequests").update({"status": True}).eq("message_uuid", message_uuid).execute()
+    if updated.data:
+        exists = client.table("Locations").select("id").eq("location_request_id", message_uuid).execute()
+        if exists.data:
+            client.table("Locations").update({"latitude": latitude}).eq("location_message_uuid", message_uuid).execute()
+        else:
+            client.table("Locations").insert({"location_message_uuid": message_uuid}).execute()
+
+
+def run(label, fn, rtt, iterations):
+    client = CountingClient(rtt)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(client, "00000000-0000-0000-0000-000000000000", 40.4, -3.7, "Madrid", "2025-01-01T00:00:00")
+    elapsed = (time.perf_counter() - start) / iterations * 1000
+    print(f"{label:<22} {client.round_trips / iterations:5.1f} viajes/petición  {elapsed:8.1f} ms/petición")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rtt-ms", type=float, default=40.0)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    from service import upsert_location
+
+    legacy = run("Flujo anterior", legacy_save, args.rtt_ms / 1000, args.iterations)
+    rpc = run("RPC save_location", upsert_location, args.rtt_ms / 1000, args.iterations)
+    print(f"Ahorro: {legacy - rpc:.1f} ms/petición con RTT de {args.rtt_ms:.0f} ms")
@@ -0,0 +1,174 @@
+"""Peticiones concurrentes sostenidas por worker: modo sync (gthread) frente
+a modo async (gevent, SERVER_MODE=async).
+
+Levanta gunicorn con un solo worker sobre la app real, con Gemini sustituido
+por un cliente falso que tarda --upstream-ms en responder, y dispara
+/api/chat desde --concurrency clientes con keep-alive durante --duration
+segundos. Cada mensaje es distinto para no acertar en la cache del chat.
+
+Uso: python benchmarks/bench_serving.py [--concurrency 200] [--duration 10]
+     [--upstream-ms 100] [--threads 8]
+
+Este mismo archivo es la app que carga gunicorn (bench_serving:app).
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeModels:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_content(self, model, config, contents):
+        # Con gevent time.sleep está parcheado y cede el control, igual que un socket
+        time.sleep(self.latency)
+        return _FakeResponse(f"eco: {contents}")
+
+
+class FakeGenai:
+    def __init__(self, latency: float):
+        self.models = _FakeModels(latency)
+
+
+def _load_app():
+    import chatbot
+    from app import app as flask_app
+
+    fake = FakeGenai(float(os.environ.get("BENCH_UPSTREAM_MS", "100")) / 1000)
+    chatbot.get_genai = lambda: fake
+    return flask_app
+
+
+if __name__ != "__main__":
+    app = _load_app()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                break
+        except OSError:
+            time.sleep(0.2)
+    else:
+        raise RuntimeError(f"gunicorn no arrancó en el puerto {port}")
+    # Primera petición fuera de la medición: importaciones perezosas de los SDK
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    conn.request("POST", "/api/chat", body=json.dumps({"message": "warmup"}), headers={"Content-Type": "application/json"})
+    conn.getresponse().read()
+    conn.close()
+
+
+def _client(port: int, counter, stop: threading.Event, latencies: list, errors: list) -> None:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    headers = {"Content-Type": "application/json"}
+    while not stop.is_set():
+        body = json.dumps({"message": f"hola {next(counter)}"})
+        start = time.perf_counter()
+        try:
+            conn.request("POST", "/api/chat", body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run_mode(mode: str, args) -> dict:
+    port = _free_port()
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        BENCH_UPSTREAM_MS=str(args.upstream_ms),
+        # El bulkhead de Gemini limitaría ambos modos por igual; aquí se mide el servidor
+        BULKHEAD_GEMINI_CONCURRENCY="100000",
+        BULKHEAD_GEMINI_TIMEOUT="0",
+        # Todas las peticiones salen de la misma IP y API key
+        RATE_LIMIT_ENABLED="false",
+    )
+    command = [sys.executable, "-m", "gunicorn", "--pythonpath", os.path.join(ROOT, "benchmarks"),
+               "-b", f"127.0.0.1:{port}", "-w", "1", "--log-level", "warning"]
+    if mode == "sync":
+        command += ["-k", "gthread", "--threads", str(args.threads)]
+    command.append("bench_serving:app")
+    server = subprocess.Popen(command, cwd=ROOT, env=env)
+    try:
+        _wait_ready(port)
+        counter = itertools.count()
+        stop = threading.Event()
+        latencies, errors = [], []
+        clients = [threading.Thread(target=_client, args=(port, counter, stop, latencies, errors), daemon=True)
+                   for _ in range(args.concurrency)]
+        start = time.perf_counter()
+        for t in clients:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in clients:
+            t.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50": pct(0.50),
+        "p99": pct(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--upstream-ms", type=float, default=100)
+    parser.add_argument("--threads", type=int, default=8, help="hilos del worker gthread en modo sync")
+    args = parser.parse_args()
+
+    print(f"1 worker, {args.concurrency} clientes, Gemini falso de {args.upstream_ms:.0f} ms, {args.duration:.0f} s")
+    results = {}
+    for mode in ("sync", "async"):
+        results[mode] = r = run_mode(mode, args)
+        print(f"{mode:>5}: {r['rps']:8.1f} req/s  p50 {r['p50']:7.1f} ms  p99 {r['p99']:7.1f} ms  "
+              f"({r['requests']} ok, {r['errors']} errores)")
+    if results["sync"]["rps"]:
+        print(f"async/sync: {results['async']['rps'] / results['sync']['rps']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Compara el render del correo de bienvenida: Environment nuevo por correo
+(comportamiento anterior) frente al motor precompilado de email_templates.
+
+Uso: python benchmarks/bench_templates.py [--iterations N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import Environment, FileSystemLoader  # noqa: E402
+
+import email_templates  # noqa: E402
+
+
+def render_per_call(lang: str) -> str:
+    env = Environment(loader=FileSystemLoader(email_templates.TEMPLATES_DIR))
+    template_name = email_templates.templates.get(lang, email_templates.DEFAULT_TEMPLATE)
+    return env.get_template(template_name).render({"name": "ana", "email": "ana@example.com", "password": "x" * 12})
+
+
+def render_precompiled(lang: str) -> str:
+    return email_templates.render_email("ana", "ana@example.com", "x" * 12, lang)
+
+
+def bench(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn("es")
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    assert render_per_call("es") == render_precompiled("es")
+    per_call = bench(render_per_call, args.iterations)
+    precompiled = bench(render_precompiled, args.iterations)
+    print(f"Environment por correo : {per_call:10.1f} µs/render")
+    print(f"Motor precompilado     : {precompiled:10.1f} µs/render")
+    print(f"Mejora                 : {per_call / precompiled:10.1f}x")
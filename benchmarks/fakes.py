@@ -0,0 +1,434 @@
+"""Sustitutos locales de Supabase, Stripe, Vonage, Resend y Gemini.
+
+Imitan la parte de cada SDK que usa la app (mismos métodos y formas de
+respuesta) sobre datos en memoria, con latencia y errores configurables por
+servicio. install() los conecta a db.py y a los getters de clients.py, así
+la app corre completa sin cuentas reales:
+
+    import fakes
+    fakes.configure(latency={"supabase": 20, "gemini": 400}, errors={"vonage": 0.05})
+    database = fakes.install()
+    database.seed(users=100, requests_per_user=30)
+"""
+import base64
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+SERVICES = ("supabase", "stripe", "vonage", "resend", "gemini")
+
+# Latencia media (ms) de cada servicio si no se configura otra
+DEFAULT_LATENCY_MS = {"supabase": 15, "stripe": 120, "vonage": 80, "resend": 60, "gemini": 300}
+
+
+class FakeServiceError(Exception):
+    """Error inyectado; status_code 503 hace que el bulkhead lo cuente como fallo."""
+
+    status_code = 503
+    http_status = 503
+
+
+class Behaviour:
+    """Latencia (media ± jitter, en ms) y tasa de error de un servicio falso."""
+
+    def __init__(self, name: str, latency_ms: float, jitter_ms: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(f"{seed}-{name}")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def __call__(self, operation: str) -> None:
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        time.sleep(delay)
+        if fail:
+            raise FakeServiceError(f"{self.name}: error inyectado en {operation}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors, "latency_ms": self.latency_ms,
+                    "error_rate": self.error_rate}
+
+
+behaviours = {name: Behaviour(name, DEFAULT_LATENCY_MS[name]) for name in SERVICES}
+
+
+def configure(latency: dict = None, errors: dict = None, jitter: dict = None, seed: int = 0) -> None:
+    """Fija latencia media (ms), jitter (ms) y tasa de error (0-1) por servicio."""
+    latency, errors, jitter = latency or {}, errors or {}, jitter or {}
+    for name in SERVICES:
+        behaviours[name] = Behaviour(
+            name,
+            latency_ms=float(latency.get(name, DEFAULT_LATENCY_MS[name])),
+            jitter_ms=float(jitter.get(name, 0.0)),
+            error_rate=float(errors.get(name, 0.0)),
+            seed=seed,
+        )
+
+
+def stats() -> dict:
+    return {name: behaviour.stats() for name, behaviour in behaviours.items()}
+
+
+# --- Supabase (PostgREST + auth) -------------------------------------------
+
+class FakeDatabase:
+    """Tablas en memoria con las columnas que usa service.py."""
+
+    def __init__(self):
+        self.tables = {name: [] for name in ("Users", "LocationRequests", "Locations", "Pending_orders", "Unsubscribe")}
+        self._ids = {name: itertools.count(1) for name in self.tables}
+        self.lock = threading.Lock()
+
+    def insert(self, table: str, row: dict) -> dict:
+        # Debe llamarse con self.lock tomado
+        row = dict(row)
+        row.setdefault("id", next(self._ids[table]))
+        self.tables[table].append(row)
+        return row
+
+    def seed(self, users: int = 50, requests_per_user: int = 20, credits: int = 1_000_000, orders: int = 200) -> dict:
+        """Carga usuarios, historial de solicitudes y pedidos pendientes. Devuelve lo creado."""
+        created = {"users": [], "message_uuids": [], "payment_intents": []}
+        with self.lock:
+            for i in range(users):
+                user = self.insert("Users", {
+                    "name": f"Usuario {i}", "email": f"user{i}@loadtest.local", "password": f"pw{i}",
+                    "credits": credits, "verification_email": True, "created_at": "2024-01-01T00:00:00",
+                })
+                created["users"].append(user)
+                for j in range(requests_per_user):
+                    message_uuid = str(uuid.UUID(int=i * 1_000_003 + j))
+                    self.insert("LocationRequests", {
+                        "message_uuid": message_uuid, "status": False, "smsstatus": 1,
+                        "created_at": f"2024-{1 + j % 12:02d}-{1 + j % 28:02d}T10:{j % 60:02d}:00",
+                        "codephone": "+34", "phonenumber": f"6{i:04d}{j:04d}", "codecountry": "ES",
+                        "user_id": str(user["id"]),
+                    })
+                    created["message_uuids"].append(message_uuid)
+            for i in range(orders):
+                payment_intent = f"pi_seed_{i}"
+                self.insert("Pending_orders", {
+                    "name": f"Cliente {i}", "email": f"order{i}@loadtest.local", "locale": "es",
+                    "payment_intent": payment_intent, "success": False,
+                })
+                created["payment_intents"].append(payment_intent)
+        return created
+
+
+class _APIResponse:
+    """Respuesta con la interfaz de postgrest.APIResponse que usa la app."""
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+    def model_dump_json(self) -> str:
+        return json.dumps({"data": self.data, "count": self.count})
+
+
+# Filtro keyset de get_locations_request: created_at.lt."X",and(created_at.eq."X",id.lt.N)
+_KEYSET = re.compile(r'^(\w+)\.lt\."([^"]*)",and\(\1\.eq\."\2",(\w+)\.lt\.(-?\d+)\)$')
+_EMBED = re.compile(r"(\w+)\(([^)]*)\)")
+
+
+def _columns(spec: str):
+    # "id, status, Locations(latitude, city)" -> (["id", "status"], {"Locations": ["latitude", "city"]})
+    embeds = {name: [c.strip() for c in cols.split(",")] for name, cols in _EMBED.findall(spec)}
+    plain = [c.strip() for c in _EMBED.sub("", spec).split(",") if c.strip()]
+    return plain, embeds
+
+
+def _same(a, b) -> bool:
+    return str(a) == str(b) if a is not None and b is not None else a is b
+
+
+class FakeQuery:
+    def __init__(self, database: FakeDatabase, table: str):
+        self.database = database
+        self.table = table
+        self.operation = "select"
+        self.values = None
+        self.spec = "*"
+        self.filters = []
+        self.ordering = []
+        self.row_limit = None
+
+    def select(self, spec: str = "*", **kwargs):
+        self.operation, self.spec = "select", spec
+        return self
+
+    def insert(self, values, **kwargs):
+        self.operation, self.values = "insert", values
+        return self
+
+    def upsert(self, values, on_conflict: str = "", ignore_duplicates: bool = False, **kwargs):
+        self.operation, self.values = "upsert", values
+        self.conflict, self.ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, values, **kwargs):
+        self.operation, self.values = "update", values
+        return self
+
+    def delete(self, **kwargs):
+        self.operation = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: _same(row.get(column), value))
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] > value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] < value)
+        return self
+
+    def or_(self, expression: str):
+        match = _KEYSET.match(expression)
+        if not match:
+            raise NotImplementedError(f"Filtro or_ no soportado por el fake: {expression}")
+        column, value, tie_column, tie_value = match.group(1), match.group(2), match.group(3), int(match.group(4))
+        self.filters.append(lambda row: row[column] < value or (row[column] == value and row[tie_column] < tie_value))
+        return self
+
+    def order(self, column, desc=False, **kwargs):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, size, **kwargs):
+        self.row_limit = size
+        return self
+
+    def _project(self, row: dict) -> dict:
+        plain, embeds = _columns(self.spec)
+        result = dict(row) if not plain or "*" in plain else {c: row.get(c) for c in plain}
+        for name, cols in embeds.items():
+            children = [child for child in self.database.tables[name] if child.get("request_id") == row["id"]]
+            result[name] = [{c: child.get(c) for c in cols} for child in children]
+        return result
+
+    def execute(self) -> _APIResponse:
+        behaviours["supabase"](f"{self.operation} {self.table}")
+        database = self.database
+        with database.lock:
+            if self.operation == "insert":
+                rows = self.values if isinstance(self.values, list) else [self.values]
+                return _APIResponse([dict(database.insert(self.table, row)) for row in rows])
+            if self.operation == "upsert":
+                written = []
+                for row in self.values if isinstance(self.values, list) else [self.values]:
+                    existing = next((old for old in database.tables[self.table]
+                                     if _same(old.get(self.conflict), row.get(self.conflict))), None)
+                    if existing is None:
+                        written.append(dict(database.insert(self.table, row)))
+                    elif not self.ignore_duplicates:
+                        existing.update(row)
+                        written.append(dict(existing))
+                return _APIResponse(written)
+            matches = [row for row in database.tables[self.table] if all(f(row) for f in self.filters)]
+            if self.operation == "update":
+                for row in matches:
+                    row.update(self.values)
+                return _APIResponse([dict(row) for row in matches])
+            if self.operation == "delete":
+                database.tables[self.table] = [row for row in database.tables[self.table] if row not in matches]
+                return _APIResponse([dict(row) for row in matches])
+            for column, desc in reversed(self.ordering):
+                matches.sort(key=lambda row: row.get(column), reverse=desc)
+            if self.row_limit is not None:
+                matches = matches[:self.row_limit]
+            return _APIResponse([self._project(row) for row in matches])
+
+
+class FakeRpc:
+    def __init__(self, database: FakeDatabase, name: str, params: dict):
+        self.database = database
+        self.name = name
+        self.params = params
+
+    def _user(self):
+        return next((u for u in self.database.tables["Users"] if u["id"] == self.params["p_user_id"]), None)
+
+    def execute(self) -> _APIResponse:
+        behaviours["supabase"](f"rpc {self.name}")
+        params = self.params
+        with self.database.lock:
+            if self.name == "consume_credit":
+                user = self._user()
+                if not user or user.get("credits", 0) <= 0:
+                    return _APIResponse(None)
+                user["credits"] -= 1
+                return _APIResponse(user["credits"])
+            if self.name == "add_credits":
+                user = self._user()
+                if not user:
+                    return _APIResponse(None)
+                user["credits"] = user.get("credits", 0) + params["p_amount"]
+                return _APIResponse(user["credits"])
+            if self.name == "save_location":
+                request = next((r for r in self.database.tables["LocationRequests"]
+                                if r["message_uuid"] == params["p_message_uuid"]), None)
+                if request is None:
+                    return _APIResponse(False)
+                request["status"] = True
+                values = {"latitude": params["p_latitude"], "longitude": params["p_longitude"],
+                          "city": params["p_city"], "captured_at": params["p_captured_at"]}
+                location = next((l for l in self.database.tables["Locations"] if l["request_id"] == request["id"]), None)
+                if location:
+                    location.update(values)
+                else:
+                    self.database.insert("Locations", {"request_id": request["id"], **values})
+                return _APIResponse(True)
+        raise NotImplementedError(f"Función RPC no soportada por el fake: {self.name}")
+
+
+def _fake_jwt(ttl: int = 3600) -> str:
+    encode = lambda data: base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+    claims = {"sub": str(uuid.uuid4()), "exp": int(time.time()) + ttl, "role": "authenticated"}
+    return f"{encode({'alg': 'none'})}.{encode(claims)}.fake"
+
+
+class FakeAuth:
+    def _session(self):
+        return SimpleNamespace(session=SimpleNamespace(access_token=_fake_jwt(), refresh_token=uuid.uuid4().hex,
+                                                       expires_at=int(time.time()) + 3600))
+
+    def sign_in_with_password(self, credentials: dict):
+        behaviours["supabase"]("auth.sign_in_with_password")
+        return self._session()
+
+    def refresh_session(self, refresh_token: str):
+        behaviours["supabase"]("auth.refresh_session")
+        return self._session()
+
+
+class FakeSupabase:
+    def __init__(self, database: FakeDatabase):
+        self.database = database
+        self.auth = FakeAuth()
+        self.postgrest = SimpleNamespace(auth=lambda token: None)
+        self._rls_token = None
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self.database, name)
+
+    def rpc(self, name: str, params: dict = None) -> FakeRpc:
+        return FakeRpc(self.database, name, params or {})
+
+
+# --- Stripe ------------------------------------------------------------------
+
+class _StripeResource:
+    def __init__(self, prefix: str, **fields):
+        self.prefix = prefix
+        self.fields = fields
+        # Como Stripe: la misma idempotency_key devuelve el mismo objeto
+        self._idempotent = {}
+        self._lock = threading.Lock()
+
+    def create(self, idempotency_key=None, **kwargs):
+        behaviours["stripe"](f"{self.prefix}.create")
+        with self._lock:
+            if idempotency_key in self._idempotent:
+                return self._idempotent[idempotency_key]
+            object_id = f"{self.prefix}_{uuid.uuid4().hex[:24]}"
+            extra = {key: value.format(id=object_id) for key, value in self.fields.items()}
+            created = SimpleNamespace(id=object_id, **extra)
+            if idempotency_key:
+                self._idempotent[idempotency_key] = created
+            return created
+
+
+class FakeStripe:
+    class SignatureVerificationError(Exception):
+        pass
+
+    def __init__(self):
+        self.Customer = _StripeResource("cus")
+        self.PaymentIntent = _StripeResource("pi", client_secret="{id}_secret_fake")
+        self.Subscription = _StripeResource("sub")
+        self.Webhook = SimpleNamespace(construct_event=self._construct_event)
+
+    def _construct_event(self, payload: bytes, sig_header: str, secret: str):
+        # Sin llamada de red (igual que el SDK); json inválido -> ValueError
+        event = json.loads(payload)
+        if not isinstance(event, dict) or "id" not in event:
+            raise ValueError("Evento sin id")
+        return event
+
+
+# --- Vonage, Resend y Gemini ----------------------------------------------------
+
+class FakeVonage:
+    def __init__(self):
+        self.sms = SimpleNamespace(send=self._send)
+
+    def _send(self, message):
+        behaviours["vonage"]("sms.send")
+        return SimpleNamespace(messages=[SimpleNamespace(status="0", error_text="", message_id=uuid.uuid4().hex)])
+
+
+class FakeResend:
+    def __init__(self):
+        self.Emails = SimpleNamespace(send=self._send)
+        self.Batch = SimpleNamespace(send=self._batch)
+
+    def _send(self, params: dict, options: dict = None):
+        behaviours["resend"]("Emails.send")
+        return {"id": uuid.uuid4().hex}
+
+    def _batch(self, payloads: list, options: dict = None):
+        behaviours["resend"]("Batch.send")
+        return {"data": [{"id": uuid.uuid4().hex} for _ in payloads]}
+
+
+class FakeGenai:
+    STREAM_CHUNKS = 5
+
+    def __init__(self):
+        self.models = SimpleNamespace(generate_content=self._generate, generate_content_stream=self._stream)
+
+    def _generate(self, model, config, contents):
+        behaviours["gemini"]("generate_content")
+        return SimpleNamespace(text=f"Respuesta de prueba a: {contents}")
+
+    def _stream(self, model, config, contents):
+        # La latencia configurada es el tiempo hasta el primer fragmento
+        behaviours["gemini"]("generate_content_stream")
+        words = f"Respuesta de prueba a: {contents}".split()
+        step = max(1, len(words) // self.STREAM_CHUNKS)
+        for i in range(0, len(words), step):
+            yield SimpleNamespace(text=" ".join(words[i:i + step]) + " ")
+
+
+def install(database: FakeDatabase = None) -> FakeDatabase:
+    """Conecta los fakes a la app (antes de la primera petición). Devuelve la BD en memoria."""
+    import clients
+    import db
+
+    database = database or FakeDatabase()
+    shared = FakeSupabase(database)
+    db.get_supabase = lambda: shared
+    db._new_client = lambda: FakeSupabase(database)
+    clients.get_stripe.override(FakeStripe())
+    clients.get_resend.override(FakeResend())
+    clients.get_genai.override(FakeGenai())
+    clients.get_vonage.override(FakeVonage())
+    return database
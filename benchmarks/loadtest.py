@@ -0,0 +1,371 @@
+"""Prueba de carga de todos los endpoints con servicios falsos (benchmarks/fakes.py).
+
+Cada usuario virtual elige endpoints según una mezcla ponderada (con semilla
+fija, así dos ejecuciones con los mismos parámetros hacen las mismas
+peticiones) y se informa throughput y p50/p95/p99 por endpoint.
+
+Por defecto la app corre en el mismo proceso (cliente de pruebas de Flask).
+Con --server sync|async se levanta gunicorn (1 worker) con los mismos fakes
+y se prueba por HTTP, como bench_serving.py.
+
+Uso:
+  python benchmarks/loadtest.py --vus 32 --duration 20
+  python benchmarks/loadtest.py --latency supabase=40 --errors gemini=0.1 --only chat,login
+  python benchmarks/loadtest.py --server async --vus 200 --json resultado.json
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+API_KEY = "loadtest-api-key"
+
+# Variables que la app lee al importarse; el almacén local va a un directorio temporal
+os.environ.setdefault("SECRET_API", API_KEY)
+os.environ.setdefault("SECRET_JWT", "loadtest-jwt-secret-not-for-production")
+os.environ.setdefault("LOCAL_DATA_DIR", tempfile.mkdtemp(prefix="loadtest-"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Todo el tráfico sale de una IP y una API key: el rate limit se activa aparte (RATE_LIMIT_ENABLED=true)
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("VONAGE_DLR_TOKEN", "loadtest-dlr-token")
+
+import fakes  # noqa: E402
+
+# Peso relativo de cada endpoint en la mezcla por defecto
+WEIGHTS = {
+    "login": 10,
+    "phone-info": 15,
+    "phone-info-batch": 3,
+    "send-sms": 8,
+    "save-location": 8,
+    "location-requests": 15,
+    "location-requests-ndjson": 2,
+    "webhook": 3,
+    "vonage-dlr": 8,
+    "chat": 8,
+    "chat-stream": 2,
+    "checkout": 3,
+    "unsubscribe": 2,
+    "reset-psw": 2,
+    "stats": 1,
+}
+
+CHAT_QUESTIONS = [f"¿Pregunta frecuente número {i}?" for i in range(40)]
+
+
+class Scenario:
+    """Datos sembrados y construcción de las peticiones de cada endpoint."""
+
+    def __init__(self, seeded: dict, tokens: dict):
+        self.users = seeded["users"]
+        self.message_uuids = seeded["message_uuids"]
+        self.payment_intents = seeded["payment_intents"]
+        self.tokens = tokens
+
+    def build(self, endpoint: str, rng: random.Random) -> tuple:
+        """Devuelve (método, ruta, cabeceras, cuerpo json o bytes)."""
+        api = {"X-API-KEY": API_KEY}
+        user = rng.choice(self.users)
+        auth = {"Authorization": f"Bearer {self.tokens[user['id']]}"}
+        phone = f"6{rng.randrange(500):08d}"
+        if endpoint == "login":
+            return "POST", "/api/login", {}, {"email": user["email"], "password": user["password"]}
+        if endpoint == "phone-info":
+            return "POST", "/api/phone-info", api, {"code": "+34", "phone_number": phone, "code_lang": "es"}
+        if endpoint == "phone-info-batch":
+            items = [{"code": "+34", "phone_number": f"6{rng.randrange(500):08d}", "code_lang": "es"} for _ in range(20)]
+            return "POST", "/api/phone-info/batch", api, {"items": items}
+        if endpoint == "send-sms":
+            return "POST", "/api/send-sms", auth, {"code": "+34", "phone_number": phone, "code_country": "ES", "message": "hola"}
+        if endpoint == "save-location":
+            body = {"message_uuid": rng.choice(self.message_uuids), "latitude": 40.4, "longitude": -3.7,
+                    "timestamp": "2024-06-01T12:00:00", "city": "Madrid"}
+            return "POST", "/api/save-location", {}, body
+        if endpoint == "location-requests":
+            return "GET", "/api/location-requests?limit=20", auth, None
+        if endpoint == "location-requests-ndjson":
+            return "GET", "/api/location-requests?format=ndjson&limit=50", auth, None
+        if endpoint == "webhook":
+            event = {"id": f"evt_{uuid.UUID(int=rng.getrandbits(128)).hex}", "type": "payment_intent.succeeded",
+                     "data": {"object": {"id": rng.choice(self.payment_intents), "customer": "cus_loadtest"}}}
+            return "POST", "/webhook", {"stripe-signature": "t=0,v1=fake"}, json.dumps(event).encode()
+        if endpoint == "vonage-dlr":
+            body = {"client-ref": rng.choice(self.message_uuids), "status": "delivered", "messageId": uuid.uuid4().hex}
+            return "POST", f"/webhook/vonage-dlr?token={os.environ['VONAGE_DLR_TOKEN']}", {}, body
+        if endpoint == "chat":
+            return "POST", "/api/chat", api, {"message": rng.choice(CHAT_QUESTIONS)}
+        if endpoint == "chat-stream":
+            return "POST", "/api/chat?stream=1", api, {"message": rng.choice(CHAT_QUESTIONS)}
+        if endpoint == "checkout":
+            # El frontend crea un método de pago y una idempotency key por envío
+            body = {"paymentMethodId": f"pm_{rng.getrandbits(64):016x}", "name": user["name"], "email": user["email"]}
+            return "POST", "/api/checkout", {"Idempotency-Key": f"{rng.getrandbits(64):016x}"}, body
+        if endpoint == "unsubscribe":
+            return "POST", "/api/unsubscribe", api, {"email": user["email"]}
+        if endpoint == "reset-psw":
+            # Usuarios aparte: cambiar la contraseña de los demás rompería /api/login
+            return "POST", "/api/reset-psw", api, {"email": f"reset{rng.randrange(20)}@loadtest.local"}
+        if endpoint == "stats":
+            return "GET", "/api/stats", api, None
+        raise ValueError(f"Endpoint desconocido: {endpoint}")
+
+
+def prepare(args) -> tuple:
+    """Configura los fakes, siembra la BD y crea un JWT por usuario."""
+    fakes.configure(latency=args.latency, errors=args.errors, jitter=args.jitter, seed=args.seed)
+    database = fakes.install()
+    seeded = database.seed(users=args.users, requests_per_user=args.history, orders=args.orders)
+    with database.lock:
+        for i in range(20):
+            database.insert("Users", {"name": f"Reset {i}", "email": f"reset{i}@loadtest.local", "password": "x", "credits": 0})
+
+    from app import app
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        tokens = {user["id"]: create_access_token(identity=str(user["id"])) for user in seeded["users"]}
+    return app, Scenario(seeded, tokens)
+
+
+# --- Transportes ----------------------------------------------------------------
+
+class InProcessTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers, body) -> int:
+        kwargs = {"data": body} if isinstance(body, bytes) else {"json": body}
+        response = self.client.open(path, method=method, headers=headers, **kwargs)
+        response.get_data()  # consume también las respuestas en streaming
+        response.close()
+        return response.status_code
+
+
+class HttpTransport:
+    def __init__(self, port: int):
+        import http.client
+        self._http = http.client
+        self.port = port
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+
+    def request(self, method, path, headers, body) -> int:
+        headers = dict(headers)
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, self._http.HTTPException):
+            self.conn.close()
+            self.conn = self._http.HTTPConnection("127.0.0.1", self.port, timeout=60)
+            raise
+
+
+# --- Ejecución ------------------------------------------------------------------
+
+def _virtual_user(index: int, args, scenario: Scenario, transport, endpoints: list, weights: list,
+                  deadline: float, samples: dict, lock: threading.Lock) -> None:
+    rng = random.Random(f"{args.seed}-{index}")
+    local = defaultdict(list)
+    while time.monotonic() < deadline:
+        endpoint = rng.choices(endpoints, weights)[0]
+        method, path, headers, body = scenario.build(endpoint, rng)
+        start = time.perf_counter()
+        try:
+            status = transport.request(method, path, headers, body)
+        except Exception as e:
+            status = type(e).__name__
+        local[endpoint].append((time.perf_counter() - start, status))
+    with lock:
+        for endpoint, values in local.items():
+            samples[endpoint].extend(values)
+
+
+def _percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+
+def summarize(samples: dict, elapsed: float) -> dict:
+    report = {}
+    for endpoint in sorted(samples):
+        values = samples[endpoint]
+        latencies = sorted(latency for latency, _ in values)
+        statuses = defaultdict(int)
+        for _, status in values:
+            statuses[str(status)] += 1
+        errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 500)
+        report[endpoint] = {
+            "requests": len(values),
+            "errors": errors,
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(_percentile(latencies, 0.50), 2),
+            "p95_ms": round(_percentile(latencies, 0.95), 2),
+            "p99_ms": round(_percentile(latencies, 0.99), 2),
+            "statuses": dict(statuses),
+        }
+    return report
+
+
+def run(args, transport_factory, scenario: Scenario) -> dict:
+    endpoints = [name for name in WEIGHTS if not args.only or name in args.only]
+    weights = [WEIGHTS[name] for name in endpoints]
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=_virtual_user, daemon=True,
+                         args=(i, args, scenario, transport_factory(), endpoints, weights, deadline, samples, lock))
+        for i in range(args.vus)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(samples, time.perf_counter() - start)
+
+
+def print_report(report: dict, elapsed: float) -> None:
+    print(f"{'endpoint':<26}{'req':>7}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  estados")
+    total = errors = 0
+    for endpoint, r in report.items():
+        total += r["requests"]
+        errors += r["errors"]
+        statuses = " ".join(f"{k}:{v}" for k, v in sorted(r["statuses"].items()))
+        print(f"{endpoint:<26}{r['requests']:>7}{r['errors']:>6}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}"
+              f"{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}  {statuses}")
+    print(f"{'total':<26}{total:>7}{errors:>6}{total / elapsed:>9.1f}")
+
+
+# --- Modo servidor (gunicorn) -----------------------------------------------------
+
+def _server_app():
+    # gunicorn carga loadtest:app; la configuración llega por LOADTEST_ARGS
+    args = argparse.Namespace(**json.loads(os.environ["LOADTEST_ARGS"]))
+    app, scenario = prepare(args)
+    with open(os.environ["LOADTEST_SCENARIO"], "w") as f:
+        json.dump({"users": scenario.users, "message_uuids": scenario.message_uuids,
+                   "payment_intents": scenario.payment_intents,
+                   "tokens": {str(k): v for k, v in scenario.tokens.items()}}, f)
+    return app
+
+
+if __name__ != "__main__" and "LOADTEST_ARGS" in os.environ:
+    app = _server_app()
+
+
+def _start_server(args) -> tuple:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    scenario_file = os.path.join(os.environ["LOCAL_DATA_DIR"], "scenario.json")
+    server_args = {k: v for k, v in vars(args).items() if k not in ("json", "server")}
+    env = dict(os.environ, SERVER_MODE=args.server, LOADTEST_ARGS=json.dumps(server_args),
+               LOADTEST_SCENARIO=scenario_file)
+    command = [sys.executable, "-m", "gunicorn", "--pythonpath", os.path.dirname(os.path.abspath(__file__)),
+               "-b", f"127.0.0.1:{port}", "-w", "1", "--log-level", "warning"]
+    if args.server == "sync":
+        command += ["-k", "gthread", "--threads", str(args.threads)]
+    command.append("loadtest:app")
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while not os.path.exists(scenario_file) or not _port_open(port):
+        if time.monotonic() > deadline or server.poll() is not None:
+            server.terminate()
+            raise RuntimeError("gunicorn no arrancó")
+        time.sleep(0.2)
+    with open(scenario_file) as f:
+        data = json.load(f)
+    tokens = {int(k): v for k, v in data.pop("tokens").items()}
+    return server, port, Scenario(data, tokens)
+
+
+def _port_open(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+def _pairs(values: list) -> dict:
+    # ["supabase=20", "gemini=400"] -> {"supabase": 20.0, "gemini": 400.0}
+    result = {}
+    for value in values or []:
+        name, _, number = value.partition("=")
+        if name not in fakes.SERVICES:
+            raise SystemExit(f"Servicio desconocido: {name} (opciones: {', '.join(fakes.SERVICES)})")
+        result[name] = float(number)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vus", type=int, default=16, help="usuarios virtuales concurrentes")
+    parser.add_argument("--duration", type=float, default=15, help="segundos de carga")
+    parser.add_argument("--warmup", type=float, default=2, help="segundos de carga previa sin medir")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--history", type=int, default=40, help="solicitudes por usuario en la BD falsa")
+    parser.add_argument("--orders", type=int, default=500, help="pedidos pendientes para /webhook")
+    parser.add_argument("--latency", action="append", help="servicio=ms (repetible)")
+    parser.add_argument("--jitter", action="append", help="servicio=ms (repetible)")
+    parser.add_argument("--errors", action="append", help="servicio=tasa 0-1 (repetible)")
+    parser.add_argument("--only", help="endpoints separados por comas")
+    parser.add_argument("--server", choices=("sync", "async"), help="probar por HTTP contra gunicorn")
+    parser.add_argument("--threads", type=int, default=8, help="hilos del worker con --server sync")
+    parser.add_argument("--json", help="guardar el informe en este archivo")
+    args = parser.parse_args()
+    args.latency, args.jitter, args.errors = _pairs(args.latency), _pairs(args.jitter), _pairs(args.errors)
+    args.only = [name.strip() for name in args.only.split(",")] if args.only else None
+    unknown = set(args.only or []) - set(WEIGHTS)
+    if unknown:
+        raise SystemExit(f"Endpoints desconocidos: {', '.join(sorted(unknown))}")
+
+    server = None
+    if args.server:
+        server, port, scenario = _start_server(args)
+        transport_factory = lambda: HttpTransport(port)
+    else:
+        app, scenario = prepare(args)
+        transport_factory = lambda: InProcessTransport(app)
+
+    try:
+        if args.warmup:
+            run(argparse.Namespace(**{**vars(args), "duration": args.warmup}), transport_factory, scenario)
+        start = time.perf_counter()
+        report = run(args, transport_factory, scenario)
+        elapsed = time.perf_counter() - start
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    mode = f"gunicorn {args.server}" if args.server else "en proceso"
+    print(f"{args.vus} usuarios virtuales, {args.duration:.0f} s, {mode}, semilla {args.seed}")
+    print_report(report, elapsed)
+    if not args.server:
+        print("servicios falsos:", json.dumps(fakes.stats()))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "json"}, "elapsed_s": elapsed,
+                       "endpoints": report, "fakes": fakes.stats() if not args.server else None}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError
+from contextlib import contextmanager
+from typing import Callable, Optional
+import config
+import metrics
+from concurrency import per_process_executor
+from logger import get_logger
+
+log = get_logger(__name__)
+
+# Bulkheads por dependencia externa (Gemini, Vonage, Stripe, Resend).
+# Cada uno limita cuántas llamadas pueden estar en curso y cuántas pueden
+# esperar turno; si está lleno se rechaza al instante (503) en lugar de
+# ocupar otro hilo de gunicorn. Incluye timeout por llamada y un circuit
+# breaker que se abre tras varios fallos seguidos, para que una dependencia
+# lenta o caída no arrastre a /api/login o /api/phone-info.
+
+
+class BulkheadRejected(Exception):
+    """La llamada se rechazó sin ejecutarse (responder 503)."""
+
+    def __init__(self, name: str, reason: str, retry_after: float):
+        super().__init__(f"{name}: {reason}")
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class BulkheadFull(BulkheadRejected):
+    pass
+
+
+class CircuitOpen(BulkheadRejected):
+    pass
+
+
+class CallTimeout(Exception):
+    pass
+
+
+class Permit:
+    """Hueco tomado con Bulkhead.acquire; se devuelve una sola vez con Bulkhead.release.
+
+    trial indica si es la llamada de prueba del circuito semiabierto: solo
+    esa llamada decide si el circuito se cierra o vuelve a abrirse.
+    """
+
+    __slots__ = ("trial", "released")
+
+    def __init__(self, trial: bool):
+        self.trial = trial
+        self.released = False
+
+
+def is_dependency_failure(error: Exception) -> bool:
+    """Los errores 4xx son del cliente (tarjeta rechazada, datos inválidos), no de la dependencia."""
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status != 429:
+        return False
+    return True
+
+
+class Bulkhead:
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float,
+                 call_timeout: Optional[float], failure_threshold: int, reset_timeout: float,
+                 is_failure: Callable[[Exception], bool] = is_dependency_failure):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self._permits = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.successes = 0
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._half_open_trial = False
+
+    def _check_circuit(self) -> bool:
+        """Rechaza si el circuito está abierto; devuelve True si la llamada es la de prueba."""
+        with self._lock:
+            if self.state == "open":
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self._reject("circuit_open")
+                    raise CircuitOpen(self.name, "circuito abierto", remaining)
+                self.state = "half_open"
+                self._half_open_trial = False
+            if self.state == "half_open":
+                # Solo una llamada de prueba a la vez mientras está semiabierto
+                if self._half_open_trial:
+                    self._reject("circuit_half_open")
+                    raise CircuitOpen(self.name, "circuito semiabierto", self.reset_timeout)
+                self._half_open_trial = True
+                return True
+            return False
+
+    def acquire(self) -> Permit:
+        """Toma un hueco del bulkhead o lanza BulkheadRejected."""
+        trial = self._check_circuit()
+        if self._permits.acquire(blocking=False):
+            with self._lock:
+                self.in_flight += 1
+            return Permit(trial)
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self._reject("queue_full")
+                self._end_trial(trial)
+                raise BulkheadFull(self.name, "cola llena", self.queue_timeout)
+            self.waiting += 1
+        acquired = self._permits.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self._reject("queue_timeout")
+                self._end_trial(trial)
+                raise BulkheadFull(self.name, "tiempo de espera agotado", self.queue_timeout)
+            self.in_flight += 1
+        return Permit(trial)
+
+    def _reject(self, reason: str) -> None:
+        # Debe llamarse con self._lock tomado
+        self.rejected += 1
+        metrics.registry.add("dependency_rejections_total", (("dependency", self.name), ("reason", reason)))
+
+    def _end_trial(self, trial: bool) -> None:
+        # Debe llamarse con self._lock tomado
+        if trial:
+            self._half_open_trial = False
+
+    def release(self, permit: Permit, error: Optional[BaseException] = None) -> None:
+        """Libera el hueco y registra el resultado para el circuit breaker.
+
+        Un permiso ya devuelto se ignora (p. ej. un stream que expiró y luego se cierra).
+        """
+        failed = error is not None and (isinstance(error, CallTimeout) or
+                                        (isinstance(error, Exception) and self.is_failure(error)))
+        with self._lock:
+            if permit.released:
+                return
+            permit.released = True
+            self.in_flight -= 1
+            if failed:
+                self.failures += 1
+                self.consecutive_failures += 1
+                # Mientras está semiabierto solo cuenta la llamada de prueba;
+                # las que empezaron antes de abrirse no lo reabren.
+                if permit.trial or (self.state != "half_open" and
+                                    self.consecutive_failures >= self.failure_threshold):
+                    if self.state != "open":
+                        log.warning("Circuito abierto", extra={"dependency": self.name, "failures": self.consecutive_failures})
+                    self.state = "open"
+                    self.opened_at = time.monotonic()
+            else:
+                self.successes += 1
+                self.consecutive_failures = 0
+                # Solo la llamada de prueba cierra el circuito; una llamada
+                # lenta que empezó antes de abrirse no lo cierra antes de tiempo.
+                if permit.trial and self.state == "half_open":
+                    self.state = "closed"
+            self._end_trial(permit.trial)
+        self._permits.release()
+
+    def _timed_out(self, operation: str) -> None:
+        with self._lock:
+            self.timeouts += 1
+        metrics.registry.add("dependency_timeouts_total", (("dependency", self.name), ("operation", operation)))
+
+    def expire_after(self, permit: Permit, timeout: float, operation: str) -> threading.Timer:
+        """Devuelve el hueco como CallTimeout si sigue tomado pasados timeout segundos.
+
+        Para huecos que duran más que una llamada (una respuesta en streaming):
+        un stream atascado o un cliente que no lee no retienen el hueco. Quien
+        tiene el permiso debe cancelar el temporizador al terminar.
+        """
+        def expire():
+            if not permit.released:
+                self._timed_out(operation)
+                self.release(permit, CallTimeout(f"{self.name} no terminó en {timeout}s"))
+
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    @contextmanager
+    def slot(self):
+        """Mantiene un hueco mientras dura el bloque."""
+        permit = self.acquire()
+        error = None
+        try:
+            yield permit
+        except BaseException as e:
+            error = e if isinstance(e, Exception) else None
+            raise
+        finally:
+            self.release(permit, error)
+
+    def call(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        """Ejecuta fn dentro del bulkhead con su timeout por llamada."""
+        timeout = self.call_timeout if timeout is None else timeout
+        operation = metrics.operation_name(fn)
+
+        def run():
+            with metrics.track(self.name, operation):
+                return fn(*args, **kwargs)
+
+        permit = self.acquire()
+        if not timeout:
+            error = None
+            try:
+                return run()
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self.release(permit, error)
+
+        # Con timeout la llamada corre en un hilo del bulkhead; si vence, quien
+        # llama recibe CallTimeout y el hueco se libera cuando la llamada termina
+        # de verdad, así el límite de concurrencia sigue siendo real.
+        future = per_process_executor(f"bulkhead-{self.name}", self.max_concurrent).submit(run)
+        timed_out = []
+
+        def done(f):
+            self.release(permit, CallTimeout() if timed_out else f.exception())
+
+        future.add_done_callback(done)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            timed_out.append(True)
+            self._timed_out(operation)
+            raise CallTimeout(f"{self.name} no respondió en {timeout}s")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "call_timeout": self.call_timeout,
+                "successes": self.successes,
+                "failures": self.failures,
+                "consecutive_failures": self.consecutive_failures,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+
+def _from_config(name: str, max_concurrent: int, max_queue: int, call_timeout: float) -> Bulkhead:
+    # Cada valor se puede ajustar con BULKHEAD_<NOMBRE>_<PARÁMETRO>
+    prefix = f"BULKHEAD_{name.upper()}_"
+    env = lambda key, default: os.getenv(prefix + key, default)
+    return Bulkhead(
+        name,
+        max_concurrent=int(env("CONCURRENCY", max_concurrent)),
+        max_queue=int(env("QUEUE", max_queue)),
+        queue_timeout=float(env("QUEUE_TIMEOUT", config.BULKHEAD_QUEUE_TIMEOUT)),
+        call_timeout=float(env("TIMEOUT", call_timeout)) or None,
+        failure_threshold=int(env("FAILURE_THRESHOLD", config.BULKHEAD_FAILURE_THRESHOLD)),
+        reset_timeout=float(env("RESET_TIMEOUT", config.BULKHEAD_RESET_TIMEOUT)),
+    )
+
+
+bulkheads = {
+    "gemini": _from_config("gemini", max_concurrent=4, max_queue=4, call_timeout=30),
+    "vonage": _from_config("vonage", max_concurrent=8, max_queue=32, call_timeout=10),
+    "stripe": _from_config("stripe", max_concurrent=8, max_queue=8, call_timeout=20),
+    "resend": _from_config("resend", max_concurrent=4, max_queue=16, call_timeout=15),
+}
+
+
+def states() -> dict:
+    return {name: bulkhead.snapshot() for name, bulkhead in bulkheads.items()}
@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import local_store
+
+
+# Cache LRU acotada en memoria con expiración (TTL) por entrada.
+# Es segura entre hilos y lleva contadores de aciertos, fallos y desalojos.
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Devuelve el valor cacheado o `default` si no existe o ha expirado."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Guarda un valor, desalojando el menos usado si se supera el tamaño."""
+        if self.maxsize == 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Resumen de uso de la cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Cache con la misma interfaz que TTLCache pero guardada en SQLite local
+# (local_store), compartida por todos los workers de gunicorn del nodo.
+# Los valores se serializan como JSON. El desalojo por tamaño elimina las
+# entradas escritas hace más tiempo y se hace cada cierto número de escrituras.
+class SharedTTLCache:
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires_at REAL,
+        written_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS cache_written_at ON cache (written_at);
+    """
+    _TRIM_EVERY = 64
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.name = name
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _db(self):
+        return local_store.connect(f"cache_{self.name}", self._SCHEMA)
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return key if isinstance(key, str) else json.dumps(key)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        row = self._db().execute("SELECT value, expires_at FROM cache WHERE key = ?", (self._key(key),)).fetchone()
+        hit = row is not None and (row["expires_at"] is None or row["expires_at"] > time.time())
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return json.loads(row["value"]) if hit else default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize == 0:
+            return
+        now = time.time()
+        self._db().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, written_at) VALUES (?, ?, ?, ?)",
+            (self._key(key), json.dumps(value), now + self.ttl if self.ttl else None, now)
+        )
+        with self._lock:
+            self._writes += 1
+            trim = self._writes % self._TRIM_EVERY == 0
+        if trim:
+            self._trim()
+
+    def _trim(self) -> None:
+        conn = self._db()
+        removed = conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)).rowcount
+        removed += conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY written_at LIMIT max(0, (SELECT COUNT(*) FROM cache) - ?))",
+            (self.maxsize,)
+        ).rowcount
+        with self._lock:
+            self.evictions += removed
+
+    def delete(self, key: Hashable) -> None:
+        self._db().execute("DELETE FROM cache WHERE key = ?", (self._key(key),))
+
+    def clear(self) -> None:
+        self._db().execute("DELETE FROM cache")
+
+    def __len__(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> dict:
+        """Resumen de uso; los contadores son del proceso actual, el tamaño es compartido."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            hits, misses, evictions = self.hits, self.misses, self.evictions
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
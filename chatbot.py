@@ -0,0 +1,192 @@
+import hashlib
+import re
+import time
+import unicodedata
+from bulkhead import CallTimeout, bulkheads
+from cache import SharedTTLCache, TTLCache
+from clients import get_genai, lazy
+import config
+import metrics
+from logger import get_logger
+
+log = get_logger(__name__)
+
+# Asistente de /api/chat. Las preguntas frecuentes ("precio", "horario",
+# "cómo funciona") se repiten casi idénticas, así que las respuestas se
+# cachean por mensaje normalizado (minúsculas, sin acentos, sin signos de
+# puntuación y con espacios colapsados) y solo los mensajes nuevos llegan a Gemini.
+
+MODEL = "gemini-2.0-flash"
+
+# Sin la sangría del código: se envía en cada llamada y los espacios cuentan como tokens.
+SYSTEM_INSTRUCTION = """\
+Eres un asistente virtual de la Web QuickGeo.
+
+Tu función es ayudar a los usuarios respondiendo sobre:
+- Información general sobre QuickGeo
+- Horarios de atención (lunes a viernes de 9:00 a 18:00).
+- Disponibilidad de servicios (24/7)
+- Precios de nuestros planes (0.50€/prueba 24hrs luego 50€/mes).
+- Métodos de contacto oficiales (contact@quickgeo.mobi).
+- Funciones principales de nuestra App QuickGeo y cómo utilizarlas.
+
+Las caracteristicas de QuickGeo son las siguientes:
+
+- Soporte Universal: Accede desde cualquier dispositivo sin importar la marca o el sistema que uses, la plataforma se adapta para ofrecerte la mejor experiencia.
+- Localización precisa: Encuentra cualquier número con exactitud en segundos desde cualquier lugar. Funciona con todas las redes móviles sin importar la operadora.
+- No se requiere instalación: Usa el servicio al instante sin descargar nada ni configurar tu dispositivo. Solo ingresa el número y obtén la información al momento
+- Privacidad garantizada: Tu seguridad es nuestra prioridad navegás de forma completamente anónima sin rastreos para que disfrutes del servicio con total confianza.
+
+Como funciona:
+
+- Realizar una búsqueda en un número: Nuestra tecnología comienza a localizar e identificar el teléfono asociado.
+- Solicitar una ubicación precisa: Enviamos un mensaje de texto al teléfono objetivo para localizarlo. Este mensaje es anónimo por defecto, pero puede ser personalizado para aumentar las posibilidades de éxito.
+- Obtén tus resultados: Serás informado automáticamente con la dirección tan pronto como el destinatario confirme su ubicación.
+
+Siempre debes mantener un tono cordial, profesional y enfocado en resolver las necesidades del cliente.
+Si alguna información solicitada no está disponible, invítalos amablemente a comunicarse directamente a través de nuestros canales oficiales.
+Recuerda: No inventes información. Si no sabes la respuesta exacta, deriva al contacto oficial.
+"""
+
+# Cambiar el modelo o las instrucciones invalida las respuestas cacheadas.
+PROMPT_VERSION = hashlib.sha1(f"{MODEL}\n{SYSTEM_INSTRUCTION}".encode()).hexdigest()[:10]
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    """Normaliza un mensaje para usarlo como clave de cache."""
+    text = unicodedata.normalize("NFKD", message.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _build_cache():
+    # "memory": cache por proceso; "shared": SQLite local compartida por los workers.
+    if config.CHAT_CACHE_BACKEND == "shared":
+        return SharedTTLCache("chat", maxsize=config.CHAT_CACHE_SIZE, ttl=config.CHAT_CACHE_TTL)
+    return TTLCache(maxsize=config.CHAT_CACHE_SIZE, ttl=config.CHAT_CACHE_TTL)
+
+
+chat_cache = _build_cache()
+
+
+@lazy
+def generation_config():
+    from google.genai import types
+    # Timeout HTTP (ms): una lectura del stream que se atasca termina en error
+    return types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTION,
+                                       http_options=types.HttpOptions(timeout=int(config.CHAT_STREAM_TIMEOUT * 1000)))
+
+
+def cache_key(message: str) -> str:
+    return f"{PROMPT_VERSION}:{normalize_message(message)}"
+
+
+def answer(message: str) -> str:
+    """Responde un mensaje, desde cache si ya se respondió uno equivalente."""
+    key = cache_key(message)
+    cached = chat_cache.get(key)
+    if cached is not None:
+        return cached
+    response = bulkheads["gemini"].call(
+        get_genai().models.generate_content, model=MODEL, config=generation_config(), contents=message
+    )
+    text = response.text
+    if text:
+        chat_cache.set(key, text)
+    return text
+
+
+class AnswerStream:
+    """Respuesta de Gemini por fragmentos (API de streaming).
+
+    Mide el tiempo hasta el primer fragmento. close() es idempotente y
+    debe llamarse siempre (Response.call_on_close): si el cliente se
+    desconectó cierra el stream de Gemini, libera el hueco del bulkhead y
+    no cachea la respuesta parcial. Si el stream dura más de
+    CHAT_STREAM_TIMEOUT (Gemini atascado o un cliente que no lee) el hueco
+    se devuelve igualmente y el stream se corta en el siguiente fragmento.
+    """
+
+    def __init__(self, key: str, stream=None, cached: str = None, start: float = None, permit=None):
+        self.key = key
+        self.stream = stream
+        self.permit = permit
+        self.watchdog = None
+        if permit is not None:
+            self.watchdog = bulkheads["gemini"].expire_after(permit, config.CHAT_STREAM_TIMEOUT,
+                                                             "generate_content_stream")
+        self.cached = cached
+        self.start = start or time.perf_counter()
+        self.parts = []
+        self.completed = cached is not None
+        self.error = None
+        self.closed = False
+
+    def __iter__(self):
+        if self.cached is not None:
+            yield self.cached
+            return
+        first_token_at = None
+        try:
+            for chunk in self.stream:
+                text = chunk.text
+                if self.permit is not None and self.permit.released:
+                    raise CallTimeout(f"gemini: el stream superó {config.CHAT_STREAM_TIMEOUT}s")
+                if not text:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    ttft = first_token_at - self.start
+                    metrics.registry.observe("chat_time_to_first_token_seconds", (), ttft)
+                    log.info("Primer fragmento del chat", extra={"ttft_ms": round(ttft * 1000)})
+                self.parts.append(text)
+                yield text
+            self.completed = True
+        except Exception as e:
+            self.error = e
+            raise
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.stream is None:
+            return
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+        elapsed = (time.perf_counter() - self.start) * 1000
+        if self.completed:
+            if self.parts:
+                chat_cache.set(self.key, "".join(self.parts))
+            log.info("Stream del chat completo", extra={"elapsed_ms": round(elapsed)})
+        else:
+            close = getattr(self.stream, "close", None)
+            if close:
+                close()
+            log.info("Stream del chat cancelado", extra={"elapsed_ms": round(elapsed)})
+        metrics.end_call("gemini", "generate_content_stream", self.start, self.error)
+        bulkheads["gemini"].release(self.permit, self.error)
+
+
+def stream_answer(message: str) -> AnswerStream:
+    """Abre la respuesta en streaming; el hueco del bulkhead se toma antes
+    de responder, así un bulkhead lleno se rechaza con 503 al instante."""
+    key = cache_key(message)
+    cached = chat_cache.get(key)
+    if cached is not None:
+        return AnswerStream(key, cached=cached)
+
+    gemini = bulkheads["gemini"]
+    permit = gemini.acquire()
+    start = metrics.start_call("gemini")
+    try:
+        stream = get_genai().models.generate_content_stream(model=MODEL, config=generation_config(), contents=message)
+    except Exception as e:
+        metrics.end_call("gemini", "generate_content_stream", start, e)
+        gemini.release(permit, e)
+        raise
+    return AnswerStream(key, stream=stream, start=start, permit=permit)
@@ -0,0 +1,62 @@
+import os
+import threading
+from functools import wraps
+import config
+
+# Los SDK externos (Stripe, Resend, google-genai, Vonage) se importan y
+# configuran en el primer uso, no al importar la app, para que el arranque
+# de cada worker no pague importaciones pesadas ni llamadas de red.
+
+
+def lazy(factory):
+    """Convierte una función sin argumentos en un singleton perezoso y seguro entre hilos."""
+    lock = threading.Lock()
+    instance = []
+
+    @wraps(factory)
+    def wrapper():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    def override(value):
+        """Sustituye la instancia (clientes falsos de benchmarks/fakes.py)."""
+        with lock:
+            instance[:] = [value]
+
+    wrapper.is_loaded = lambda: bool(instance)
+    wrapper.override = override
+    return wrapper
+
+
+@lazy
+def get_stripe():
+    import stripe
+    stripe.api_key = os.environ.get("SECRET_KEY_STRIPE")
+    return stripe
+
+
+@lazy
+def get_resend():
+    import resend
+    resend.api_key = os.environ.get("RESEND_API_KEY")
+    return resend
+
+
+@lazy
+def get_genai():
+    from google import genai
+    return genai.Client(api_key=os.environ.get("GEMINI_KEY"))
+
+
+# Cliente Vonage de larga vida: reutiliza el pool de conexiones HTTP
+# (keep-alive) entre envíos en lugar de crear uno por petición.
+@lazy
+def get_vonage():
+    from vonage import Auth, HttpClientOptions, Vonage
+    return Vonage(
+        Auth(api_key=os.environ.get("API_KEY_VONAGE"), api_secret=os.environ.get("API_SECRET_VONAGE")),
+        HttpClientOptions(pool_connections=1, pool_maxsize=config.VONAGE_POOL_SIZE, timeout=config.VONAGE_TIMEOUT)
+    )
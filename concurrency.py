@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Callable, NamedTuple, Optional
+import config
+
+# Ejecuta en paralelo consultas independientes (p. ej. historial y créditos)
+# sobre un pool de hilos compartido, así la latencia del handler es la de la
+# consulta más lenta y no la suma. Dentro de una petición cada rama corre
+# con una copia de su contexto: toma su propio cliente Supabase del pool de
+# db (nunca el de la petición, que no es seguro entre hilos), lo devuelve al
+# terminar y sus logs llevan el request_id de la petición.
+
+# Pools de hilos y arranques por proceso: los hilos no sobreviven al fork de
+# gunicorn, así que cada worker crea los suyos en el primer uso.
+_executors = {}  # nombre -> (pid, ThreadPoolExecutor)
+_started = {}    # nombre -> pid
+_process_lock = threading.RLock()  # start() puede pedir un pool dentro de once_per_process
+
+
+class Branch(NamedTuple):
+    fn: Callable
+    args: tuple
+    kwargs: dict
+    timeout: Optional[float]
+
+
+def branch(fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Branch:
+    """Describe una rama de run_parallel con su propio timeout (segundos)."""
+    return Branch(fn, args, kwargs, timeout)
+
+
+def per_process_executor(name: str, workers: int) -> ThreadPoolExecutor:
+    """Pool de hilos `name` del proceso actual (se crea de nuevo tras un fork)."""
+    entry = _executors.get(name)
+    if entry is None or entry[0] != os.getpid():
+        with _process_lock:
+            entry = _executors.get(name)
+            if entry is None or entry[0] != os.getpid():
+                executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=name)
+                entry = _executors[name] = (os.getpid(), executor)
+    return entry[1]
+
+
+def once_per_process(name: str, start: Callable[[], None]) -> None:
+    """Ejecuta start() una sola vez por proceso (p. ej. arrancar un hilo en segundo plano)."""
+    if _started.get(name) == os.getpid():
+        return
+    with _process_lock:
+        if _started.get(name) == os.getpid():
+            return
+        start()
+        _started[name] = os.getpid()
+
+
+def is_shutdown_error(error: BaseException) -> bool:
+    """El pool ya no acepta tareas porque el intérprete se está cerrando."""
+    return isinstance(error, RuntimeError) and "shutdown" in str(error)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    return per_process_executor("fanout", config.FANOUT_WORKERS)
+
+
+def _with_request_context(fn: Callable) -> Callable:
+    from flask import copy_current_request_context, g, has_request_context
+    if not has_request_context():
+        return fn
+    request_id = g.get("request_id")
+
+    @copy_current_request_context
+    def run(*args, **kwargs):
+        # La copia tiene su propio g: el cliente del pool se libera en su teardown
+        g.request_id = request_id
+        return fn(*args, **kwargs)
+    return run
+
+
+def run_parallel(*branches: Branch, timeout: Optional[float] = None) -> list:
+    """Ejecuta las ramas a la vez y devuelve sus resultados en el mismo orden.
+
+    Cada rama espera como máximo su propio timeout (o `timeout`, o
+    FANOUT_TIMEOUT) contado desde el inicio. Si una rama falla o vence, se
+    cancelan las que aún no empezaron y se propaga su excepción
+    (concurrent.futures.TimeoutError en el caso del timeout).
+    """
+    executor = get_executor()
+    start = time.monotonic()
+    futures = [executor.submit(_with_request_context(b.fn), *b.args, **b.kwargs) for b in branches]
+    results = []
+    try:
+        for b, future in zip(branches, futures):
+            limit = b.timeout if b.timeout is not None else (timeout if timeout is not None else config.FANOUT_TIMEOUT)
+            remaining = max(0.0, start + limit - time.monotonic())
+            try:
+                results.append(future.result(timeout=remaining))
+            except TimeoutError:
+                raise TimeoutError(f"{getattr(b.fn, '__name__', b.fn)} superó {limit}s")
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return results
@@ -8,4 +8,131 @@ environment = os.getenv("ENV", "local")
 env_file = f".env.{environment}"
 
 # Carga variables
-load_dotenv(env_file)
\ No newline at end of file
+load_dotenv(env_file)
+
+# Cache de metadatos de números telefónicos (/api/phone-info)
+PHONE_CACHE_SIZE = int(os.getenv("PHONE_CACHE_SIZE", "2048"))
+PHONE_CACHE_TTL = float(os.getenv("PHONE_CACHE_TTL", "86400"))
+PHONE_BATCH_MAX_ITEMS = int(os.getenv("PHONE_BATCH_MAX_ITEMS", "50"))
+
+# Renovación del token de Supabase (segundos)
+SUPABASE_REFRESH_MARGIN = float(os.getenv("SUPABASE_REFRESH_MARGIN", "300"))
+SUPABASE_TOKEN_LEEWAY = float(os.getenv("SUPABASE_TOKEN_LEEWAY", "30"))
+SUPABASE_REFRESH_RETRY = float(os.getenv("SUPABASE_REFRESH_RETRY", "15"))
+
+# Precalentar clientes en cada worker de gunicorn (post_fork)
+WARMUP_ON_FORK = os.getenv("WARMUP_ON_FORK", "false").lower() in ("1", "true", "yes")
+
+# Modo de servicio: "sync" (workers gthread, uno por hilo) o "async"
+# (workers gevent: cada petición es un greenlet y las esperas de red ceden el
+# control). Con async conviene subir SUPABASE_POOL_SIZE, que pasa a ser el
+# límite real de consultas concurrentes por worker.
+SERVER_MODE = os.getenv("SERVER_MODE", "sync").lower()
+ASYNC_WORKER_CONNECTIONS = int(os.getenv("ASYNC_WORKER_CONNECTIONS", "1000"))
+
+# Pool de clientes Supabase/PostgREST por proceso
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "10"))
+SUPABASE_POOL_TIMEOUT = float(os.getenv("SUPABASE_POOL_TIMEOUT", "10"))
+
+# Directorio de la cache de bytecode de Jinja (vacío = desactivada)
+JINJA_BYTECODE_CACHE_DIR = os.getenv("JINJA_BYTECODE_CACHE_DIR", "")
+
+# Almacenes locales SQLite compartidos entre workers del mismo nodo
+LOCAL_DATA_DIR = os.getenv("LOCAL_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+LOCAL_STORE_TIMEOUT = float(os.getenv("LOCAL_STORE_TIMEOUT", "5"))
+
+# Cola de correos salientes (outbox)
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+# Con base 2 y máximo 300 s, 20 intentos cubren algo más de una hora de caída de Resend
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "300"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+
+# Procesador de eventos del webhook de Stripe
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE", "3"))
+WEBHOOK_BACKOFF_MAX = float(os.getenv("WEBHOOK_BACKOFF_MAX", "900"))
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "5"))
+
+# Paginación del historial (/api/location-requests)
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+
+# Consultas en paralelo dentro de un handler (concurrency.py)
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "16"))
+FANOUT_TIMEOUT = float(os.getenv("FANOUT_TIMEOUT", "10"))
+
+# Cache de créditos por usuario (compartida entre workers)
+CREDITS_CACHE_SIZE = int(os.getenv("CREDITS_CACHE_SIZE", "10000"))
+CREDITS_CACHE_TTL = float(os.getenv("CREDITS_CACHE_TTL", "300"))
+
+# Conjunto local de bajas (Unsubscribe), en segundos
+UNSUBSCRIBE_SYNC_INTERVAL = float(os.getenv("UNSUBSCRIBE_SYNC_INTERVAL", "30"))
+UNSUBSCRIBE_FULL_RESYNC_INTERVAL = float(os.getenv("UNSUBSCRIBE_FULL_RESYNC_INTERVAL", "3600"))
+
+# Envío de SMS (Vonage)
+VONAGE_POOL_SIZE = int(os.getenv("VONAGE_POOL_SIZE", "10"))
+VONAGE_TIMEOUT = int(os.getenv("VONAGE_TIMEOUT", "10"))
+SMS_WORKERS = int(os.getenv("SMS_WORKERS", "4"))
+SMS_POLL_INTERVAL = float(os.getenv("SMS_POLL_INTERVAL", "5"))
+# Reintentos de un envío que falló sin respuesta de Vonage (después se devuelve el crédito)
+SMS_MAX_ATTEMPTS = int(os.getenv("SMS_MAX_ATTEMPTS", "5"))
+SMS_BACKOFF_MAX = float(os.getenv("SMS_BACKOFF_MAX", "60"))
+# Tras un timeout (el SMS pudo salir) se espera el recibo de entrega este
+# tiempo, en segundos, antes de darlo por no enviado y devolver el crédito
+SMS_RECEIPT_TIMEOUT = float(os.getenv("SMS_RECEIPT_TIMEOUT", "86400"))
+# URL pública del webhook de recibos de entrega (vacío = la configurada en la
+# cuenta Vonage). Debe llevar ?token=<VONAGE_DLR_TOKEN>.
+VONAGE_DLR_URL = os.getenv("VONAGE_DLR_URL", "")
+# Secreto obligatorio de /webhook/vonage-dlr: sin él se rechazan todos los recibos
+VONAGE_DLR_TOKEN = os.getenv("VONAGE_DLR_TOKEN", "")
+
+# Cache de respuestas del asistente (/api/chat)
+CHAT_CACHE_BACKEND = os.getenv("CHAT_CACHE_BACKEND", "memory")  # memory | shared
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "1000"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "21600"))
+# Tiempo máximo que una respuesta en streaming retiene su hueco del bulkhead de Gemini
+CHAT_STREAM_TIMEOUT = float(os.getenv("CHAT_STREAM_TIMEOUT", "60"))
+
+# Bulkheads por dependencia (ver bulkhead.py; cada uno se ajusta con BULKHEAD_<NOMBRE>_*)
+BULKHEAD_QUEUE_TIMEOUT = float(os.getenv("BULKHEAD_QUEUE_TIMEOUT", "2"))
+BULKHEAD_FAILURE_THRESHOLD = int(os.getenv("BULKHEAD_FAILURE_THRESHOLD", "5"))
+BULKHEAD_RESET_TIMEOUT = float(os.getenv("BULKHEAD_RESET_TIMEOUT", "30"))
+
+# Métricas Prometheus (/metrics, ver metrics.py)
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_CACHE_TTL = float(os.getenv("METRICS_CACHE_TTL", "1"))
+# Si se define, /metrics exige "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Logs estructurados (ver logger.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Nivel por módulo, p. ej. "sms=WARNING,outbox=DEBUG"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# Fracción de peticiones cuyos logs INFO/DEBUG se emiten, por ruta, p. ej. "/api/phone-info=0.05"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Respuestas JSON (ver responses.py): gzip a partir de este tamaño si el cliente lo acepta
+JSON_GZIP_MIN_BYTES = int(os.getenv("JSON_GZIP_MIN_BYTES", "8192"))
+JSON_GZIP_LEVEL = int(os.getenv("JSON_GZIP_LEVEL", "5"))
+
+# Checkout (ver payments.py): respuestas por idempotency key y clientes de Stripe por email
+CHECKOUT_IDEMPOTENCY_TTL = float(os.getenv("CHECKOUT_IDEMPOTENCY_TTL", "86400"))
+CHECKOUT_CACHE_SIZE = int(os.getenv("CHECKOUT_CACHE_SIZE", "10000"))
+STRIPE_CUSTOMER_CACHE_SIZE = int(os.getenv("STRIPE_CUSTOMER_CACHE_SIZE", "50000"))
+STRIPE_CUSTOMER_CACHE_TTL = float(os.getenv("STRIPE_CUSTOMER_CACHE_TTL", "2592000"))
+# Cola local de pedidos pendientes (se reintenta siempre; a partir de ALERT_ATTEMPTS se registra como error)
+CHECKOUT_ORDER_POLL_INTERVAL = float(os.getenv("CHECKOUT_ORDER_POLL_INTERVAL", "5"))
+CHECKOUT_ORDER_BACKOFF_MAX = float(os.getenv("CHECKOUT_ORDER_BACKOFF_MAX", "300"))
+CHECKOUT_ORDER_ALERT_ATTEMPTS = int(os.getenv("CHECKOUT_ORDER_ALERT_ATTEMPTS", "5"))
+
+# Rate limiting por ruta (ver ratelimit.py; límites con RATE_LIMIT_<RUTA>, p. ej. RATE_LIMIT_LOGIN="ip=20/60,user=5/60")
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# Proxies de confianza delante de gunicorn para los límites "ip": 0 = gunicorn expuesto
+# directamente (remote_addr); N = la IP es la entrada N desde el final de X-Forwarded-For.
+# Detrás de un proxy hay que definirlo: con 0 todos compartirían la IP del proxy.
+RATE_LIMIT_PROXY_HOPS = int(os.getenv("RATE_LIMIT_PROXY_HOPS", "0"))
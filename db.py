@@ -1,55 +1,308 @@
 import os
-from supabase import Client, create_client
+import base64
+import json
+import queue
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, NamedTuple
+from flask import g, has_app_context
 import config
+import metrics
 import time
+from logger import get_logger
+
+log = get_logger(__name__)
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 SUPABASE_EMAIL = os.environ.get("SUPABASE_EMAIL")
 SUPABASE_PASSWORD = os.environ.get("SUPABASE_PASSWORD")
 
-# Crear cliente
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Cliente compartido; se crea en el primer uso (ver get_supabase)
+_supabase = None
+_supabase_lock = threading.Lock()
 
-# Sesión global
+# Sesión global (protegida por _session_lock)
 session = None
-token_expiry = 0  # timestamp de expiración
+token_expiry = 0  # timestamp de expiración (claim `exp` del JWT)
 
-# 🔹 Autenticación con RLS
-auth_res = supabase.auth.sign_in_with_password({
-    "email": SUPABASE_EMAIL,
-    "password": SUPABASE_PASSWORD
-})
+# Solo un hilo por proceso renueva el token; el resto espera al mismo resultado.
+_session_lock = threading.Lock()
+# Despierta al hilo de renovación en segundo plano cuando cambia la sesión.
+_refresh_wakeup = threading.Event()
+_refresher_pid = None
 
-def sign_in() -> str:
-    """Inicia sesión y guarda la sesión y expiración global."""
+
+def get_supabase() -> "Client":
+    """Crea (una sola vez) y devuelve el cliente Supabase sin autenticar."""
+    global _supabase
+    if _supabase is None:
+        with _supabase_lock:
+            if _supabase is None:
+                from supabase import create_client
+                _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
+
+
+def decode_jwt_claims(token: str) -> dict:
+    """Decodifica (sin verificar la firma) los claims de un JWT."""
+    payload = token.split(".")[1]
+    payload += "=" * (-len(payload) % 4)
+    return json.loads(base64.urlsafe_b64decode(payload))
+
+
+def _token_expiry(new_session) -> int:
+    # La expiración real sale del claim `exp`; si no se puede leer se usa
+    # la que reporta Supabase en la sesión.
+    try:
+        return int(decode_jwt_claims(new_session.access_token)["exp"])
+    except Exception:
+        return int(getattr(new_session, "expires_at", None) or time.time() + 3600)
+
+
+def _store_session(new_session) -> str:
     global session, token_expiry
-    auth_res = supabase.auth.sign_in_with_password({
-        "email": SUPABASE_EMAIL,
-        "password": SUPABASE_PASSWORD
-    })
-    session = auth_res.session
-    token_expiry = int(time.time()) + 3600  # el JWT dura ~1 hora
-    supabase.postgrest.auth(session.access_token)
+    session = new_session
+    token_expiry = _token_expiry(new_session)
+    get_supabase().postgrest.auth(session.access_token)
+    _ensure_refresher()
+    _refresh_wakeup.set()
     return session.access_token
 
-def refresh_if_needed() -> str:
-    """Renueva el token si ha expirado y devuelve un JWT válido."""
-    global session, token_expiry
-    now = int(time.time())
-    if not session or now >= token_expiry:
-        if session and session.refresh_token:
+
+def _is_fresh(margin: float) -> bool:
+    return session is not None and time.time() < token_expiry - margin
+
+
+def _refresh_locked() -> str:
+    # Debe llamarse con _session_lock tomado.
+    if session and session.refresh_token:
+        try:
             # Renovar usando refresh_token
-            refreshed = supabase.auth.refresh_session(session.refresh_token)
-            session = refreshed.session
-            token_expiry = int(time.time()) + 3600
-        else:
-            # No hay refresh_token, iniciar sesión de nuevo
-            sign_in()
-    return session.access_token
+            with metrics.track("supabase", "auth.refresh_session"):
+                refreshed = get_supabase().auth.refresh_session(session.refresh_token)
+            return _store_session(refreshed.session)
+        except Exception as e:
+            log.warning("No se pudo renovar la sesión de Supabase, se inicia sesión de nuevo", extra={"error": str(e)})
+    # No hay refresh_token (o falló), iniciar sesión de nuevo
+    with metrics.track("supabase", "auth.sign_in"):
+        auth_res = get_supabase().auth.sign_in_with_password({
+            "email": SUPABASE_EMAIL,
+            "password": SUPABASE_PASSWORD
+        })
+    return _store_session(auth_res.session)
+
+
+def sign_in() -> str:
+    """Inicia sesión y guarda la sesión y expiración global."""
+    with _session_lock:
+        with metrics.track("supabase", "auth.sign_in"):
+            auth_res = get_supabase().auth.sign_in_with_password({
+                "email": SUPABASE_EMAIL,
+                "password": SUPABASE_PASSWORD
+            })
+        return _store_session(auth_res.session)
+
+
+def refresh_if_needed() -> str:
+    """Devuelve un JWT válido; solo renueva (una vez por proceso) si ha expirado."""
+    if _is_fresh(config.SUPABASE_TOKEN_LEEWAY):
+        _ensure_refresher()
+        return session.access_token
+    with _session_lock:
+        # Otro hilo pudo renovarlo mientras esperábamos el lock
+        if not _is_fresh(config.SUPABASE_TOKEN_LEEWAY):
+            _refresh_locked()
+        return session.access_token
+
+
+# Hilo en segundo plano que renueva el token antes de que expire, para que
+# ninguna petición tenga que pagar la renovación.
+def _refresh_loop():
+    while True:
+        delay = token_expiry - config.SUPABASE_REFRESH_MARGIN - time.time()
+        if delay > 0:
+            _refresh_wakeup.wait(delay)
+            _refresh_wakeup.clear()
+            continue
+        try:
+            with _session_lock:
+                if not _is_fresh(config.SUPABASE_REFRESH_MARGIN):
+                    _refresh_locked()
+        except Exception as e:
+            log.exception("Error renovando el token de Supabase")
+            _refresh_wakeup.wait(config.SUPABASE_REFRESH_RETRY)
+            _refresh_wakeup.clear()
+
+
+def _ensure_refresher():
+    # Los hilos no sobreviven a un fork (gunicorn), así que se arranca uno por proceso.
+    global _refresher_pid
+    if _refresher_pid == os.getpid():
+        return
+    _refresher_pid = os.getpid()
+    threading.Thread(target=_refresh_loop, name="supabase-token-refresh", daemon=True).start()
+
+
+def _new_client() -> "Client":
+    # Cada cliente tiene su propia sesión httpx de PostgREST, que mantiene
+    # las conexiones keep-alive abiertas entre peticiones.
+    from supabase import create_client
+    client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    client._rls_token = None
+    return client
+
+
+def _authorize(client: "Client", token: str) -> "Client":
+    # Solo se toca la cabecera Authorization cuando el JWT cambia.
+    if client._rls_token != token:
+        client.postgrest.auth(token)
+        client._rls_token = token
+    return client
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Pool acotado de clientes Supabase. Cada petición toma un cliente en
+# exclusiva y lo devuelve al terminar, así los hilos no comparten (ni
+# reautentican) el mismo objeto. Guarda métricas del tiempo de espera.
+class ClientPool:
+    def __init__(self, size: int, timeout: float):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # LIFO: se reutilizan primero las conexiones más calientes
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waited = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self, token: str) -> "Client":
+        start = time.perf_counter()
+        client = None
+        try:
+            client = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    client = _new_client()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    client = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(f"Sin clientes Supabase libres tras {self.timeout}s")
+        wait = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            if wait > 0.001:
+                self._waited += 1
+        return _authorize(client, token)
+
+    def release(self, client: "Client") -> None:
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(client)
+
+    @contextmanager
+    def client(self, token: str):
+        client = self.acquire(token)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "waited": self._waited,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+            }
+
+
+pool = ClientPool(config.SUPABASE_POOL_SIZE, config.SUPABASE_POOL_TIMEOUT)
+
+# Hilos fuera de una petición Flask (tareas en segundo plano) usan un
+# cliente propio por hilo en lugar de ocupar un hueco del pool.
+_thread_clients = threading.local()
+
+
+def get_client(*args, **kwargs) -> "Client":
+    """Devuelve un cliente Supabase con RLS exclusivo de la petición (o del hilo) actual."""
+    # 🔹 Autenticación con RLS: la primera llamada inicia sesión
+    token = refresh_if_needed()
+    if has_app_context():
+        client = g.get("supabase_client")
+        if client is None:
+            client = g.supabase_client = pool.acquire(token)
+        return _authorize(client, token)
+    client = getattr(_thread_clients, "client", None)
+    if client is None:
+        client = _thread_clients.client = _new_client()
+    return _authorize(client, token)
+
+
+def release_request_client(exc=None) -> None:
+    """Devuelve al pool el cliente de la petición (registrar con teardown_appcontext)."""
+    g.pop("supabase_ctx", None)
+    client = g.pop("supabase_client", None)
+    if client is not None:
+        pool.release(client)
+
+
+def execute(query, operation: str):
+    """Ejecuta una consulta PostgREST (query.execute()) midiendo su latencia en metrics."""
+    with metrics.track("supabase", operation):
+        return query.execute()
+
+
+# Contexto Supabase de una petición: token, cliente y UUID del usuario de
+# servicio se resuelven una sola vez y se reutilizan en todo service.py.
+class SupabaseContext(NamedTuple):
+    token: str
+    client: "Client"
+    user_uuid: str
+
+
+def token_user_uuid(token: str) -> str:
+    """UUID del usuario dueño del JWT (claim `sub`), sin llamar a auth.get_user()."""
+    return decode_jwt_claims(token)["sub"]
+
 
-def get_client(*args, **kwargs) -> Client:
-    """Devuelve el cliente Supabase con RLS usando un JWT válido."""
+def supabase_context() -> SupabaseContext:
+    """Devuelve el contexto Supabase de la petición actual (cacheado en flask.g)."""
+    if has_app_context():
+        ctx = g.get("supabase_ctx")
+        if ctx is not None:
+            return ctx
     token = refresh_if_needed()
-    supabase.postgrest.auth(token)
-    return supabase
\ No newline at end of file
+    ctx = SupabaseContext(token=token, client=get_client(), user_uuid=token_user_uuid(token))
+    if has_app_context():
+        g.supabase_ctx = ctx
+    return ctx
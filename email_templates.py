@@ -0,0 +1,66 @@
+import os
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template, TemplateNotFound
+import config
+from logger import get_logger
+
+log = get_logger(__name__)
+
+# Ruta absoluta: no depende del directorio de trabajo del proceso.
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+DEFAULT_TEMPLATE = "emailtemplate_es.html"
+
+templates = {
+    "en": "emailtemplate_en.html",
+    "es": "emailtemplate_es.html",
+    "fr": "emailtemplate_fr.html",
+    "pt": "emailtemplate_pt.html",
+    "de": "emailtemplate_de.html"
+}
+
+
+def _build_environment() -> Environment:
+    # Con JINJA_BYTECODE_CACHE_DIR el código compilado se guarda en disco y
+    # los workers nuevos lo cargan sin volver a compilar las plantillas.
+    bytecode_cache = None
+    if config.JINJA_BYTECODE_CACHE_DIR:
+        os.makedirs(config.JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(config.JINJA_BYTECODE_CACHE_DIR)
+    # auto_reload=False: una vez compiladas no se vuelve a consultar el disco.
+    return Environment(loader=FileSystemLoader(TEMPLATES_DIR), bytecode_cache=bytecode_cache, auto_reload=False)
+
+
+env = _build_environment()
+_compiled: dict = {}
+
+
+# Compila las plantillas de todos los idiomas disponibles. Los idiomas sin
+# archivo usan la plantilla por defecto en lugar de fallar al enviar.
+def precompile() -> dict:
+    compiled = {}
+    missing = []
+    for name in sorted(set(templates.values()) | {DEFAULT_TEMPLATE}):
+        try:
+            compiled[name] = env.get_template(name)
+        except TemplateNotFound:
+            missing.append(name)
+    if missing:
+        log.warning("Plantillas de email no encontradas", extra={"missing": missing, "fallback": DEFAULT_TEMPLATE})
+    _compiled.clear()
+    _compiled.update(compiled)
+    return compiled
+
+
+def get_template(lang: str) -> Template:
+    template_name = templates.get(lang.lower(), DEFAULT_TEMPLATE)
+    template = _compiled.get(template_name) or _compiled.get(DEFAULT_TEMPLATE)
+    if template is None:
+        # La plantilla por defecto no estaba al precompilar: error explícito de Jinja
+        template = env.get_template(template_name)
+    return template
+
+
+def render_email(name: str, email: str, password: str, lang: str) -> str:
+    return get_template(lang).render({"name": name, "email": email, "password": password})
+
+
+precompile()
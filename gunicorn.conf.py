@@ -0,0 +1,28 @@
+# Configuración de gunicorn (se carga automáticamente desde el directorio de trabajo).
+import threading
+import config as app_config  # "config" es un ajuste de gunicorn
+
+# SERVER_MODE=async sirve con workers gevent: gunicorn parchea la librería
+# estándar antes de cargar app.py, así las llamadas de red de los SDK
+# síncronos (supabase/httpx, stripe, vonage, resend, google-genai) ceden el
+# control y un worker atiende cientos de peticiones en espera a la vez en
+# lugar de tantas como hilos. Las opciones de la línea de comandos
+# (-k, --worker-connections) tienen prioridad sobre estas.
+if app_config.SERVER_MODE == "async":
+    worker_class = "gevent"
+    worker_connections = app_config.ASYNC_WORKER_CONNECTIONS
+
+
+# Con WARMUP_ON_FORK=true cada worker inicia sesión en Supabase y crea los
+# clientes SDK en un hilo aparte justo después del fork. El worker empieza a
+# atender sin esperar: si llega una petición antes, la inicialización perezosa
+# (con lock) se encarga y el precalentamiento reutiliza su resultado.
+def post_fork(server, worker):
+    if not app_config.WARMUP_ON_FORK:
+        return
+
+    def run():
+        from startup import warmup
+        server.log.info("Worker %s precalentado (ms): %s", worker.pid, warmup())
+
+    threading.Thread(target=run, name="warmup", daemon=True).start()
@@ -0,0 +1,58 @@
+import os
+import sqlite3
+import sys
+import threading
+import config
+
+# Almacenes locales en SQLite (modo WAL) compartidos por todos los workers
+# de gunicorn de un mismo nodo. Cada hilo de cada proceso usa su propia
+# conexión, ya que las conexiones sqlite3 no se comparten entre hilos ni
+# sobreviven a un fork.
+
+_local = threading.local()
+_shared = {"pid": None, "connections": {}}
+
+
+def cooperative() -> bool:
+    """True si el worker es gevent (SERVER_MODE=async) y threading está parcheado."""
+    gevent_monkey = sys.modules.get("gevent.monkey")
+    return bool(gevent_monkey and gevent_monkey.is_module_patched("threading"))
+
+
+def _connections() -> dict:
+    # Con gevent cada petición es un greenlet y threading.local sería una
+    # conexión por petición; como los greenlets de un proceso corren en un
+    # solo hilo real y sqlite3 no cede el control a mitad de una sentencia,
+    # comparten una conexión por proceso.
+    if cooperative():
+        if _shared["pid"] != os.getpid():
+            _shared["pid"] = os.getpid()
+            _shared["connections"] = {}
+        return _shared["connections"]
+    connections = getattr(_local, "connections", None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    return connections
+
+
+def path_for(name: str) -> str:
+    """Ruta del archivo SQLite `name` dentro de LOCAL_DATA_DIR."""
+    os.makedirs(config.LOCAL_DATA_DIR, exist_ok=True)
+    return os.path.join(config.LOCAL_DATA_DIR, f"{name}.sqlite3")
+
+
+def connect(name: str, schema: str = "") -> sqlite3.Connection:
+    """Devuelve la conexión del hilo (o del proceso, con gevent) al almacén `name`, creando el esquema si hace falta."""
+    connections = _connections()
+    conn = connections.get(name)
+    if conn is None:
+        conn = sqlite3.connect(path_for(name), timeout=config.LOCAL_STORE_TIMEOUT, isolation_level=None,
+                               check_same_thread=not cooperative())
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if schema:
+            conn.executescript(schema)
+        connections[name] = conn
+    return conn
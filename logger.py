@@ -0,0 +1,170 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+import config
+
+# Logs estructurados (una línea JSON por registro) que no bloquean la
+# petición: el hilo que registra solo encola y un hilo por proceso escribe en
+# stdout. Si la cola se llena (sink lento) se descartan registros y se
+# cuentan, en lugar de frenar las peticiones. Cada registro lleva el id y la
+# ruta de la petición; las rutas de mucho volumen pueden muestrearse
+# (LOG_SAMPLE_RATES) sin perder nunca WARNING ni ERROR.
+#
+# Uso: log = get_logger(__name__); log.info("Mensaje", extra={"campo": valor})
+
+ROOT_LOGGER = "quickgeo"
+
+# Atributos propios de LogRecord; el resto (extra=...) se emite como campos
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "route"}
+
+
+def _parse_pairs(raw: str) -> dict:
+    # "sms=WARNING,outbox=DEBUG" -> {"sms": "WARNING", "outbox": "DEBUG"}
+    pairs = (item.split("=", 1) for item in (raw or "").split(",") if "=" in item)
+    return {key.strip(): value.strip() for key, value in pairs}
+
+
+SAMPLE_RATES = {route: float(rate) for route, rate in _parse_pairs(config.LOG_SAMPLE_RATES).items()}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+            entry["route"] = record.route
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _RequestContextFilter(logging.Filter):
+    """Añade id y ruta de la petición y aplica el muestreo de la ruta."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        from flask import g, has_request_context
+        if not has_request_context():
+            return True
+        record.request_id = g.get("request_id")
+        record.route = g.get("log_route")
+        return record.levelno >= logging.WARNING or g.get("log_sampled", True)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, maxsize: int):
+        super().__init__(queue.Queue(maxsize))
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.addFilter(_RequestContextFilter())
+
+    def _ensure_listener(self) -> None:
+        # El hilo escritor no sobrevive al fork de gunicorn: uno por proceso,
+        # con su propia cola (la heredada puede tener el lock tomado).
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.maxsize)
+            sink = logging.StreamHandler(sys.stdout)
+            sink.setFormatter(JsonFormatter())
+            self._listener = logging.handlers.QueueListener(self.queue, sink)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El formato JSON se hace en el hilo escritor; aquí solo se resuelve
+        # el mensaje y la traza (que no se pueden enviar a otro hilo tal cual).
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        """Espera a que el hilo escritor vacíe la cola (al salir del proceso)."""
+        if self._listener and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+_handler = None
+_configure_lock = threading.Lock()
+
+
+def _configure() -> NonBlockingQueueHandler:
+    global _handler
+    with _configure_lock:
+        if _handler is None:
+            handler = NonBlockingQueueHandler(config.LOG_QUEUE_SIZE)
+            root = logging.getLogger(ROOT_LOGGER)
+            root.setLevel(config.LOG_LEVEL.upper())
+            root.addHandler(handler)
+            root.propagate = False
+            for name, level in _parse_pairs(config.LOG_LEVELS).items():
+                logging.getLogger(f"{ROOT_LOGGER}.{name}").setLevel(level.upper())
+            import atexit
+            atexit.register(handler.flush)
+            _handler = handler
+    return _handler
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger del módulo `name` (p. ej. __name__) dentro de la jerarquía de la app."""
+    if _handler is None:
+        _configure()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def init_app(app) -> None:
+    """Asigna un id a cada petición (o usa X-Request-ID) y decide su muestreo."""
+    from flask import g, request
+
+    @app.before_request
+    def _assign_request_id():
+        g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        g.log_route = request.url_rule.rule if request.url_rule else request.path
+        rate = SAMPLE_RATES.get(g.log_route)
+        g.log_sampled = rate is None or random.random() < rate
+
+    @app.after_request
+    def _return_request_id(response):
+        if "request_id" in g:
+            response.headers["X-Request-ID"] = g.request_id
+        return response
+
+
+def stats() -> dict:
+    handler = _handler
+    if handler is None:
+        return {}
+    return {"queued": handler.queue.qsize(), "maxsize": handler.maxsize, "dropped": handler.dropped}
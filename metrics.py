@@ -0,0 +1,331 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+import config
+import local_store
+from concurrency import once_per_process
+from logger import get_logger
+
+log = get_logger(__name__)
+
+# Métricas de latencia por ruta y por dependencia externa en formato de
+# texto de Prometheus (/metrics). Cada proceso acumula en memoria (un lock y
+# unas sumas por observación) y cada METRICS_FLUSH_INTERVAL segundos deja una
+# copia en SQLite local; /metrics suma las copias de todos los workers del
+# nodo y guarda el texto generado METRICS_CACHE_TTL segundos, así un scrape
+# frecuente no compite con las peticiones. La copia la guarda un hilo por
+# proceso (no solo el fin de cada petición): lo que cuentan el outbox, los
+# eventos de Stripe, los SMS o los timeouts del bulkhead en segundo plano
+# llega a /metrics aunque el worker no reciba tráfico, y al salir el proceso
+# se guarda lo pendiente.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# nombre -> (tipo, ayuda)
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Duración de las peticiones HTTP por ruta"),
+    "http_requests_in_flight": ("gauge", "Peticiones HTTP en curso por ruta"),
+    "dependency_call_duration_seconds": ("histogram", "Duración de las llamadas a servicios externos"),
+    "dependency_errors_total": ("counter", "Llamadas a servicios externos que terminaron en error"),
+    "dependency_timeouts_total": ("counter", "Llamadas abandonadas por timeout del bulkhead"),
+    "dependency_rejections_total": ("counter", "Llamadas rechazadas por el bulkhead sin ejecutarse"),
+    "dependency_in_flight": ("gauge", "Llamadas a servicios externos en curso"),
+    "chat_time_to_first_token_seconds": ("histogram", "Tiempo hasta el primer fragmento de /api/chat en streaming"),
+    "rate_limited_total": ("counter", "Peticiones rechazadas con 429 por el rate limit"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    pid INTEGER PRIMARY KEY,
+    snapshot TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (nombre, etiquetas) -> [conteo por bucket..., +Inf, suma]
+        self._values = {}      # (nombre, etiquetas) -> valor (counters y gauges)
+        self._flushed_at = 0.0
+        self._pid = os.getpid()
+
+    def _check_pid(self) -> None:
+        # Tras el fork cada worker empieza de cero (lo heredado es del master)
+        if self._pid != os.getpid():
+            self._histograms.clear()
+            self._values.clear()
+            self._flushed_at = 0.0
+            self._pid = os.getpid()
+
+    def observe(self, name: str, labels: tuple, value: float) -> None:
+        with self._lock:
+            self._check_pid()
+            series = self._histograms.get((name, labels))
+            if series is None:
+                series = self._histograms[(name, labels)] = [0] * (len(BUCKETS) + 1) + [0.0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(BUCKETS)] += 1
+            series[-1] += value
+
+    def add(self, name: str, labels: tuple, amount: float = 1) -> None:
+        with self._lock:
+            self._check_pid()
+            key = (name, labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._check_pid()
+            return {
+                "histograms": [[name, list(labels), list(series)] for (name, labels), series in self._histograms.items()],
+                "values": [[name, list(labels), value] for (name, labels), value in self._values.items()],
+            }
+
+    def flush(self) -> None:
+        """Guarda la copia de este proceso para que /metrics la sume con las demás."""
+        _db().execute(
+            "INSERT OR REPLACE INTO metrics (pid, snapshot, updated_at) VALUES (?, ?, ?)",
+            (os.getpid(), json.dumps(self.snapshot()), time.time())
+        )
+        self._flushed_at = time.monotonic()
+
+    def maybe_flush(self) -> None:
+        if time.monotonic() - self._flushed_at >= config.METRICS_FLUSH_INTERVAL:
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception("Error guardando métricas")
+
+
+registry = Registry()
+
+
+def _db():
+    return local_store.connect("metrics", _SCHEMA)
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(config.METRICS_FLUSH_INTERVAL)
+        registry.maybe_flush()
+
+
+def _flush_at_exit() -> None:
+    try:
+        registry.flush()
+    except Exception:
+        pass
+
+
+def _start() -> None:
+    atexit.register(_flush_at_exit)
+    threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def ensure_started() -> None:
+    """Arranca el guardado periódico de las métricas del proceso actual (una vez por pid)."""
+    once_per_process("metrics", _start)
+
+
+# --- Dependencias externas ----------------------------------------------------
+
+def start_call(dependency: str) -> float:
+    registry.add("dependency_in_flight", (("dependency", dependency),), 1)
+    return time.perf_counter()
+
+
+def end_call(dependency: str, operation: str, started: float, error: Optional[BaseException] = None) -> None:
+    registry.add("dependency_in_flight", (("dependency", dependency),), -1)
+    labels = (("dependency", dependency), ("operation", operation))
+    if error is not None:
+        registry.add("dependency_errors_total", labels + (("error", type(error).__name__),))
+    outcome = "ok" if error is None else "error"
+    registry.observe("dependency_call_duration_seconds", labels + (("outcome", outcome),), time.perf_counter() - started)
+
+
+@contextmanager
+def track(dependency: str, operation: str):
+    """Mide una llamada a un servicio externo (latencia, errores y llamadas en curso)."""
+    started = start_call(dependency)
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        end_call(dependency, operation, started, error)
+
+
+def operation_name(fn) -> str:
+    # stripe.Customer.create -> "Customer.create", get_vonage().sms.send -> "Sms.send"
+    return getattr(fn, "__qualname__", None) or getattr(fn, "__name__", None) or type(fn).__name__
+
+
+# --- Peticiones HTTP ------------------------------------------------------------
+
+def init_app(app) -> None:
+    """Registra la medición de cada petición (duración por ruta, método y estado)."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        g.metrics_started = time.perf_counter()
+        registry.add("http_requests_in_flight", (("route", g.metrics_route),), 1)
+
+    @app.after_request
+    def _record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    # teardown_request se ejecuta siempre (también con excepciones) y, con
+    # stream_with_context, cuando termina de enviarse la respuesta.
+    @app.teardown_request
+    def _observe_request(exc=None):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        route = g.pop("metrics_route")
+        status = g.pop("metrics_status", 500 if exc else 200)
+        registry.add("http_requests_in_flight", (("route", route),), -1)
+        labels = (("route", route), ("method", request.method), ("status", str(status)))
+        registry.observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+        registry.maybe_flush()
+
+
+# --- Exposición -------------------------------------------------------------------
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+# Fila con los counters e histogramas acumulados de los workers que ya
+# terminaron (gunicorn los recicla); así los totales del nodo nunca bajan y
+# rate() no ve reinicios falsos. Los gauges de un worker muerto se descartan.
+_RETIRED_PID = 0
+
+
+def _merge(histograms: dict, values: dict, snapshot: dict, gauges: bool = True) -> None:
+    for name, labels, series in snapshot["histograms"]:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        total = histograms.get(key)
+        histograms[key] = series if total is None else [a + b for a, b in zip(total, series)]
+    for name, labels, value in snapshot["values"]:
+        if not gauges and METRICS.get(name, ("counter",))[0] == "gauge":
+            continue
+        key = (name, tuple(tuple(pair) for pair in labels))
+        values[key] = values.get(key, 0) + value
+
+
+def _to_snapshot(histograms: dict, values: dict) -> dict:
+    return {
+        "histograms": [[name, list(labels), series] for (name, labels), series in histograms.items()],
+        "values": [[name, list(labels), value] for (name, labels), value in values.items()],
+    }
+
+
+def _retire(pid: int) -> None:
+    # En una transacción: dos workers que recogen a la vez no suman dos veces
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        dead = conn.execute("SELECT snapshot FROM metrics WHERE pid = ?", (pid,)).fetchone()
+        if dead is not None:
+            histograms, values = {}, {}
+            retired = conn.execute("SELECT snapshot FROM metrics WHERE pid = ?", (_RETIRED_PID,)).fetchone()
+            if retired is not None:
+                _merge(histograms, values, json.loads(retired["snapshot"]))
+            _merge(histograms, values, json.loads(dead["snapshot"]), gauges=False)
+            conn.execute(
+                "INSERT OR REPLACE INTO metrics (pid, snapshot, updated_at) VALUES (?, ?, ?)",
+                (_RETIRED_PID, json.dumps(_to_snapshot(histograms, values)), time.time())
+            )
+            conn.execute("DELETE FROM metrics WHERE pid = ?", (pid,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def collect() -> tuple:
+    """Suma las copias de todos los workers vivos del nodo (la propia, al momento) y lo acumulado de los ya terminados."""
+    registry.flush()
+    for row in _db().execute("SELECT pid FROM metrics WHERE pid != ?", (_RETIRED_PID,)).fetchall():
+        if row["pid"] != os.getpid() and not _pid_alive(row["pid"]):
+            _retire(row["pid"])
+    histograms, values = {}, {}
+    for row in _db().execute("SELECT snapshot FROM metrics").fetchall():
+        _merge(histograms, values, json.loads(row["snapshot"]))
+    return histograms, values
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render() -> str:
+    histograms, values = collect()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "histogram":
+            for (series_name, labels), series in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, series):
+                    cumulative += count
+                    le = _labels(labels, 'le="%s"' % bound)
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                cumulative += series[len(BUCKETS)]
+                le = _labels(labels, 'le="+Inf"')
+                lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_format(series[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        else:
+            for (series_name, labels), value in sorted(values.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_labels(labels)} {_format(value)}")
+    return "\n".join(lines) + "\n"
+
+
+_rendered = {"text": None, "at": 0.0}
+_render_lock = threading.Lock()
+
+
+def exposition() -> str:
+    """Texto de /metrics; se regenera como mucho una vez cada METRICS_CACHE_TTL segundos."""
+    with _render_lock:
+        if _rendered["text"] is None or time.monotonic() - _rendered["at"] >= config.METRICS_CACHE_TTL:
+            _rendered["text"] = render()
+            _rendered["at"] = time.monotonic()
+        return _rendered["text"]
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Any, List, Optional
 # Modelo de entrada phone-info
 class PhoneNumberInput(BaseModel):
     code:str
@@ -13,13 +13,23 @@ class PhoneNumberOut(BaseModel):
     country: str
     operator: str
 
+# Modelo de entrada phone-info/batch
+class PhoneNumberBatchInput(BaseModel):
+    # Cada elemento se valida por separado en la ruta (un error no invalida el lote)
+    items: List[Any]
+
+# Modelo de salida phone-info/batch
+class PhoneNumberBatchOut(BaseModel):
+    results: List[PhoneNumberOut]
+
 # Modelo de entrada send-sms
 class SendSmsInput(BaseModel):
     code:str
     phone_number: str
     code_country:str
     message:str
-    credits:int
+    # Obsoleto: los créditos se leen del servidor; se acepta por compatibilidad
+    credits:Optional[int] = None
 
 # Modelo de salida send-sms
 class SendSmsOut(BaseModel):
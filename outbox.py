@@ -0,0 +1,282 @@
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from bulkhead import BulkheadRejected, bulkheads
+from clients import get_resend
+from concurrency import is_shutdown_error, once_per_process, per_process_executor
+import config
+import local_store
+from logger import get_logger
+
+log = get_logger(__name__)
+
+# Cola persistente de correos salientes. send_email solo encola el mensaje
+# (una escritura local en SQLite) y un despachador en segundo plano lo envía
+# por Resend con reintentos y backoff exponencial, agrupando varios
+# mensajes en una sola llamada a la API batch cuando hay más de uno.
+# Como la cola vive en disco, un reinicio del worker no pierde correos.
+#
+# Cada envío lleva una idempotency key de Resend derivada del id del outbox
+# ("outbox-<id>", o la del lote), así reintentar un envío que expiró pero sí
+# salió no duplica el correo. Un lote que falla sin saber si salió se
+# reintenta entero con la misma clave (batch_key); si Resend lo rechaza
+# (4xx, p. ej. un payload inválido) no se envió nada y se manda uno a uno
+# para que solo falle el mensaje malo.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    last_error TEXT,
+    batch_key TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+# Un envío que lleva más que esto en 'sending' se da por perdido (worker caído).
+_STALE_CLAIM_SECONDS = 120
+# Los correos enviados se conservan este tiempo antes de purgarlos (sin el
+# payload, que se borra al enviarse: el HTML lleva la contraseña generada).
+_SENT_RETENTION_SECONDS = 7 * 24 * 3600
+# Los fallidos definitivos se conservan con payload para poder revisarlos
+# durante este tiempo y después se eliminan.
+_FAILED_RETENTION_SECONDS = 3 * 24 * 3600
+
+_wakeup = threading.Event()
+_slots = threading.BoundedSemaphore(max(1, config.OUTBOX_WORKERS))
+_executor = None
+
+_stats_lock = threading.Lock()
+_latencies = deque(maxlen=1000)
+_counters = {"sent": 0, "retried": 0, "failed": 0, "batches": 0}
+
+
+def _db():
+    return local_store.connect("outbox", _SCHEMA)
+
+
+def enqueue(params: dict) -> int:
+    """Encola un correo (parámetros de resend.Emails.send) y devuelve su id."""
+    now = time.time()
+    cursor = _db().execute(
+        "INSERT INTO outbox (payload, next_attempt_at, created_at) VALUES (?, ?, ?)",
+        (json.dumps(params), now, now)
+    )
+    ensure_started()
+    _wakeup.set()
+    return cursor.lastrowid
+
+
+def _claim(limit: int) -> list:
+    # Reclama de forma atómica los mensajes vencidos; varios procesos pueden
+    # compartir la misma cola sin enviar dos veces el mismo correo.
+    now = time.time()
+    claim_id = uuid.uuid4().hex
+    conn = _db()
+    conn.execute(
+        """UPDATE outbox SET status = 'sending', claimed_by = ?, claimed_at = ?
+           WHERE id IN (
+               SELECT id FROM outbox
+               WHERE (status = 'pending' AND next_attempt_at <= ?)
+                  OR (status = 'sending' AND claimed_at < ?)
+               ORDER BY id LIMIT ?)""",
+        (claim_id, now, now, now - _STALE_CLAIM_SECONDS, limit)
+    )
+    # Un lote pendiente de reintento se reclama completo: se reenvía tal cual
+    # con su misma idempotency key
+    conn.execute(
+        """UPDATE outbox SET status = 'sending', claimed_by = ?, claimed_at = ?
+           WHERE status = 'pending' AND batch_key IN (
+               SELECT batch_key FROM outbox WHERE claimed_by = ? AND batch_key IS NOT NULL)""",
+        (claim_id, now, claim_id)
+    )
+    return conn.execute("SELECT id, payload, attempts, batch_key FROM outbox WHERE claimed_by = ? ORDER BY id",
+                        (claim_id,)).fetchall()
+
+
+def _rejected(error: Exception) -> bool:
+    # Resend no envió nada: error de validación local (ValueError) o respuesta 4xx
+    if isinstance(error, (ValueError, TypeError)):
+        return True
+    try:
+        return 400 <= int(getattr(error, "code", None)) < 500
+    except (TypeError, ValueError):
+        return False
+
+
+def _send_one(row) -> None:
+    start = time.perf_counter()
+    try:
+        bulkheads["resend"].call(get_resend().Emails.send, json.loads(row["payload"]),
+                                 {"idempotency_key": f"outbox-{row['id']}"})
+    except BulkheadRejected as e:
+        # Resend saturado o con el circuito abierto: no se llegó a intentar,
+        # así que no cuenta como intento; se reprograma para cuando se libere.
+        log.info("Envío de correos aplazado", extra={"count": 1, "reason": e.reason})
+        _mark_deferred([row], max(1.0, e.retry_after), str(e))
+        return
+    except Exception as e:
+        log.warning("Error enviando el correo", extra={"outbox_id": row["id"], "error": str(e)})
+        _mark_failed([row], str(e))
+        return
+    _mark_sent([row], time.perf_counter() - start)
+
+
+def _send_batch(rows: list, batch_key: str) -> None:
+    start = time.perf_counter()
+    try:
+        payloads = [json.loads(row["payload"]) for row in rows]
+        bulkheads["resend"].call(get_resend().Batch.send, payloads, {"idempotency_key": batch_key})
+    except BulkheadRejected as e:
+        log.info("Envío de correos aplazado", extra={"count": len(rows), "reason": e.reason})
+        _mark_deferred(rows, max(1.0, e.retry_after), str(e))
+        return
+    except Exception as e:
+        if not _rejected(e):
+            # Puede que el lote saliera: se reintenta entero con la misma clave
+            log.warning("Error enviando correos", extra={"count": len(rows), "error": str(e)})
+            _mark_failed(rows, str(e), batch_key)
+            return
+        log.info("Lote rechazado por Resend, se envía uno a uno", extra={"count": len(rows), "error": str(e)})
+        _db().executemany("UPDATE outbox SET batch_key = NULL WHERE id = ?", [(row["id"],) for row in rows])
+        for row in rows:
+            _send_one(row)
+        return
+    _mark_sent(rows, time.perf_counter() - start)
+
+
+def _send(rows: list) -> None:
+    try:
+        batches: dict = {}
+        for row in rows:
+            batches.setdefault(row["batch_key"], []).append(row)
+        fresh = batches.pop(None, [])
+        for batch_key, batch in batches.items():
+            _send_batch(batch, batch_key)
+        if len(fresh) == 1:
+            _send_one(fresh[0])
+        elif fresh:
+            _send_batch(fresh, f"outbox-batch-{fresh[0]['id']}-{fresh[-1]['id']}-{len(fresh)}")
+    finally:
+        _slots.release()
+        _wakeup.set()
+
+
+def _mark_sent(rows: list, latency: float) -> None:
+    now = time.time()
+    _db().executemany(
+        "UPDATE outbox SET status = 'sent', sent_at = ?, attempts = attempts + 1, last_error = NULL, payload = NULL, "
+        "batch_key = NULL WHERE id = ?",
+        [(now, row["id"]) for row in rows]
+    )
+    with _stats_lock:
+        _counters["sent"] += len(rows)
+        _counters["batches"] += 1
+        _latencies.append(latency)
+
+
+def _mark_failed(rows: list, error: str, batch_key: str = None) -> None:
+    now = time.time()
+    updates = []
+    for row in rows:
+        attempts = row["attempts"] + 1
+        if attempts >= config.OUTBOX_MAX_ATTEMPTS:
+            updates.append(("failed", attempts, now, error, batch_key, row["id"]))
+        else:
+            delay = min(config.OUTBOX_BACKOFF_MAX, config.OUTBOX_BACKOFF_BASE ** attempts)
+            updates.append(("pending", attempts, now + delay, error, batch_key, row["id"]))
+    _db().executemany(
+        "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, batch_key = ?, "
+        "claimed_by = NULL WHERE id = ?",
+        updates
+    )
+    with _stats_lock:
+        for status, *_ in updates:
+            _counters["failed" if status == "failed" else "retried"] += 1
+
+
+def _mark_deferred(rows: list, delay: float, error: str) -> None:
+    _db().executemany(
+        "UPDATE outbox SET status = 'pending', next_attempt_at = ?, last_error = ?, claimed_by = NULL WHERE id = ?",
+        [(time.time() + delay, error, row["id"]) for row in rows]
+    )
+
+
+def _purge_sent() -> None:
+    now = time.time()
+    conn = _db()
+    conn.execute("DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?", (now - _SENT_RETENTION_SECONDS,))
+    conn.execute("DELETE FROM outbox WHERE status = 'failed' AND next_attempt_at < ?", (now - _FAILED_RETENTION_SECONDS,))
+
+
+def _dispatch_once() -> None:
+    # Solo se reclama trabajo cuando hay un hilo de envío libre. El hueco
+    # se devuelve si no hay nada que enviar o si falla el reclamo o el
+    # submit (p. ej. "database is locked"); si no, se perdería para siempre.
+    # Lo ya reclamado vuelve a la cola al vencer _STALE_CLAIM_SECONDS.
+    while _slots.acquire(blocking=False):
+        try:
+            rows = _claim(config.OUTBOX_BATCH_SIZE)
+            if rows:
+                _executor.submit(_send, rows)
+        except BaseException:
+            _slots.release()
+            raise
+        if not rows:
+            _slots.release()
+            break
+
+
+def _dispatch_loop():
+    last_purge = 0.0
+    while True:
+        _wakeup.wait(config.OUTBOX_POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            if time.monotonic() - last_purge > 600:
+                _purge_sent()
+                last_purge = time.monotonic()
+            _dispatch_once()
+        except Exception as e:
+            if is_shutdown_error(e):
+                # El proceso termina: lo reclamado vuelve a la cola al caducar el reclamo
+                return
+            log.exception("Error en el despachador del outbox")
+
+
+def _start() -> None:
+    global _executor, _slots
+    _slots = threading.BoundedSemaphore(max(1, config.OUTBOX_WORKERS))
+    _executor = per_process_executor("outbox", config.OUTBOX_WORKERS)
+    threading.Thread(target=_dispatch_loop, name="outbox-dispatcher", daemon=True).start()
+
+
+def ensure_started() -> None:
+    """Arranca el despachador del proceso actual (una vez por pid, tras un fork también)."""
+    once_per_process("outbox", _start)
+    _wakeup.set()
+
+
+def stats() -> dict:
+    """Profundidad de la cola y latencia de envío."""
+    rows = _db().execute("SELECT status, COUNT(*) AS total FROM outbox GROUP BY status").fetchall()
+    by_status = {row["status"]: row["total"] for row in rows}
+    with _stats_lock:
+        latencies = sorted(_latencies)
+        counters = dict(_counters)
+    return {
+        "depth": by_status.get("pending", 0) + by_status.get("sending", 0),
+        "by_status": by_status,
+        **counters,
+        "send_latency_avg_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "send_latency_p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2) if latencies else 0.0,
+    }
@@ -0,0 +1,240 @@
+import hashlib
+import threading
+import time
+import uuid
+from typing import Optional
+from bulkhead import bulkheads
+from cache import SharedTTLCache
+from clients import get_stripe
+from concurrency import once_per_process
+from service import get_user_email, insert_pending_order
+import config
+import local_store
+from logger import get_logger
+
+log = get_logger(__name__)
+
+# Checkout con idempotencia y reutilización de clientes de Stripe.
+#
+# - La idempotency key llega en la cabecera Idempotency-Key (si falta se usa
+#   el paymentMethodId, que el frontend genera una vez por envío). Un doble
+#   clic o un reintento del cliente devuelve la respuesta ya guardada sin
+#   llamar a Stripe, y las llamadas a Stripe llevan claves derivadas de ella
+#   para que un reintento concurrente no cree otro cliente ni otro intent.
+#   Respuesta y claves van ligadas también al paymentMethodId: quien solo
+#   conoce el email y la clave de otro no obtiene su clientSecret ni su cliente.
+# - El id de cliente de Stripe se guarda por email, pero solo se reutiliza
+#   (y solo se guarda) si el email es el de la sesión autenticada (JWT): los
+#   checkouts repetidos de un usuario solo crean el PaymentIntent (una llamada
+#   en lugar de dos). En un checkout anónimo el email no está verificado y se
+#   crea siempre un cliente nuevo; nunca se devuelve el customerId de otro.
+# - El pedido pendiente se guarda en una cola local en SQLite (una escritura
+#   local, deduplicada por payment_intent) y un hilo por proceso lo inserta
+#   en Supabase con reintentos sin límite. Como la cola vive en disco, un
+#   reinicio del worker no pierde pedidos. Si el webhook
+#   payment_intent.succeeded llega antes, inserta él el pedido de la cola
+#   (flush_pending_order) o lo reintenta (webhook_events).
+
+# Respuestas de checkout por (email, idempotency key), compartidas entre workers
+checkout_responses = SharedTTLCache("checkout", maxsize=config.CHECKOUT_CACHE_SIZE, ttl=config.CHECKOUT_IDEMPOTENCY_TTL)
+# Email -> id de cliente de Stripe
+stripe_customers = SharedTTLCache("stripe_customers", maxsize=config.STRIPE_CUSTOMER_CACHE_SIZE,
+                                  ttl=config.STRIPE_CUSTOMER_CACHE_TTL)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_orders (
+    payment_intent TEXT PRIMARY KEY,
+    name TEXT,
+    email TEXT,
+    locale TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    created_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS pending_orders_due ON pending_orders (next_attempt_at);
+"""
+
+# Un pedido que lleva más que esto reclamado se da por perdido (worker caído).
+_STALE_CLAIM_SECONDS = 120
+
+_wakeup = threading.Event()
+
+
+def _db():
+    return local_store.connect("pending_orders", _SCHEMA)
+
+
+def _stripe_key(email: str, idempotency_key: str, payment_method_id: str, step: str) -> str:
+    # Las claves de Stripe son por cuenta: se acotan al email y al método de
+    # pago para que dos clientes con la misma clave no compartan resultado.
+    digest = hashlib.sha256(f"{email}|{payment_method_id}|{idempotency_key}".encode()).hexdigest()[:32]
+    return f"checkout-{digest}-{step}"
+
+
+# --- Cola local de pedidos pendientes ----------------------------------------------
+
+def _queue_pending_order(name: str, email: str, locale: str, payment_intent_id: str) -> None:
+    now = time.time()
+    _db().execute(
+        "INSERT OR IGNORE INTO pending_orders (payment_intent, name, email, locale, next_attempt_at, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (payment_intent_id, name, email, locale, now, now)
+    )
+    ensure_started()
+    _wakeup.set()
+
+
+def _claim(limit: int, payment_intent_id: Optional[str] = None) -> list:
+    # Reclamo atómico: varios procesos comparten la cola sin insertar dos
+    # veces. Con payment_intent_id (webhook) se reclama ese pedido aunque
+    # esté esperando su próximo reintento.
+    now = time.time()
+    claim_id = uuid.uuid4().hex
+    conn = _db()
+    if payment_intent_id:
+        conn.execute(
+            """UPDATE pending_orders SET claimed_by = ?, claimed_at = ?
+               WHERE payment_intent = ? AND (claimed_by IS NULL OR claimed_at < ?)""",
+            (claim_id, now, payment_intent_id, now - _STALE_CLAIM_SECONDS)
+        )
+    else:
+        conn.execute(
+            """UPDATE pending_orders SET claimed_by = ?, claimed_at = ?
+               WHERE payment_intent IN (
+                   SELECT payment_intent FROM pending_orders
+                   WHERE (claimed_by IS NULL AND next_attempt_at <= ?) OR claimed_at < ?
+                   ORDER BY created_at LIMIT ?)""",
+            (claim_id, now, now, now - _STALE_CLAIM_SECONDS, limit)
+        )
+    return conn.execute("SELECT * FROM pending_orders WHERE claimed_by = ?", (claim_id,)).fetchall()
+
+
+def _save(row) -> bool:
+    payment_intent_id = row["payment_intent"]
+    try:
+        insert_pending_order(row["name"], row["email"], row["locale"], payment_intent_id)
+    except Exception as e:
+        attempts = row["attempts"] + 1
+        delay = min(config.CHECKOUT_ORDER_BACKOFF_MAX, 2 ** attempts)
+        _db().execute(
+            "UPDATE pending_orders SET attempts = ?, next_attempt_at = ?, last_error = ?, claimed_by = NULL "
+            "WHERE payment_intent = ?",
+            (attempts, time.time() + delay, str(e), payment_intent_id)
+        )
+        # Se sigue reintentando siempre; a partir de unos cuantos fallos se avisa como error
+        level = log.error if attempts >= config.CHECKOUT_ORDER_ALERT_ATTEMPTS else log.warning
+        level("Error guardando el pedido pendiente", extra={"payment_intent": payment_intent_id,
+                                                           "attempt": attempts, "error": str(e)})
+        return False
+    _db().execute("DELETE FROM pending_orders WHERE payment_intent = ?", (payment_intent_id,))
+    return True
+
+
+def flush_pending_order(payment_intent_id: str) -> bool:
+    """Inserta ya el pedido de la cola local (webhook). False si no está en la cola o falla."""
+    rows = _claim(1, payment_intent_id)
+    return bool(rows) and _save(rows[0])
+
+
+def _drain_loop():
+    while True:
+        _wakeup.wait(config.CHECKOUT_ORDER_POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            for row in _claim(50):
+                _save(row)
+        except Exception as e:
+            log.exception("Error en la cola de pedidos pendientes")
+
+
+def _start() -> None:
+    threading.Thread(target=_drain_loop, name="pending-orders", daemon=True).start()
+
+
+def ensure_started() -> None:
+    """Arranca el hilo que vacía la cola del proceso actual (una vez por pid)."""
+    once_per_process("pending-orders", _start)
+    _wakeup.set()
+
+
+# --- Checkout -----------------------------------------------------------------------
+
+def _create_customer(name: str, email: str, payment_method_id: str, idempotency_key: str, verified: bool) -> str:
+    # 🧾 Crear cliente
+    customer = bulkheads["stripe"].call(get_stripe().Customer.create,
+        name=name,
+        email=email,
+        payment_method=payment_method_id,
+        invoice_settings={"default_payment_method": payment_method_id},
+        idempotency_key=_stripe_key(email, idempotency_key, payment_method_id, "customer"),
+    )
+    if verified:
+        stripe_customers.set(email.lower(), customer.id)
+    return customer.id
+
+
+def _create_payment_intent(customer_id: str, email: str, payment_method_id: str, idempotency_key: str,
+                           reused: bool):
+    # Con un cliente existente el método de pago nuevo queda asociado al
+    # confirmar el pago y la suscripción (webhook) lo usa como predeterminado.
+    options = {"setup_future_usage": "off_session"} if reused else {}
+    # 💳 Crear PaymentIntent (solo se confirma en frontend)
+    return bulkheads["stripe"].call(get_stripe().PaymentIntent.create,
+        amount=50,  # 💰 Pago inicial (por ejemplo, verificación)
+        currency="eur",
+        customer=customer_id,
+        payment_method=payment_method_id,
+        confirmation_method="automatic",
+        idempotency_key=_stripe_key(email, idempotency_key, payment_method_id, f"intent-{customer_id}"),
+        **options
+    )
+
+
+def start_checkout(name: str, email: str, payment_method_id: str, idempotency_key: Optional[str] = None,
+                   locale: str = "es", user_id: Optional[str] = None) -> dict:
+    """Crea (o reutiliza) el cliente y el PaymentIntent; devuelve {clientSecret, customerId}.
+
+    user_id es la identidad del JWT si la petición viene autenticada; el
+    cliente de Stripe solo se reutiliza si email es el de ese usuario.
+    """
+    idempotency_key = idempotency_key or payment_method_id
+    cache_key = [email.lower(), idempotency_key, payment_method_id] if email else None
+    if cache_key:
+        cached = checkout_responses.get(cache_key)
+        if cached is not None:
+            return cached
+
+    verified = bool(email and user_id) and (get_user_email(user_id) or "").lower() == email.lower()
+    customer_id = stripe_customers.get(email.lower()) if verified else None
+    if customer_id is None:
+        customer_id = _create_customer(name, email, payment_method_id, idempotency_key, verified)
+        reused = False
+    else:
+        reused = True
+
+    try:
+        payment_intent = _create_payment_intent(customer_id, email, payment_method_id, idempotency_key, reused)
+    except Exception as e:
+        if not reused or getattr(e, "code", None) != "resource_missing":
+            raise
+        # El cliente cacheado ya no existe en Stripe: se crea de nuevo
+        stripe_customers.delete(email.lower())
+        customer_id = _create_customer(name, email, payment_method_id, idempotency_key, verified)
+        payment_intent = _create_payment_intent(customer_id, email, payment_method_id, idempotency_key, False)
+
+    # Pedido pendiente a la cola local; se inserta en Supabase en segundo plano
+    _queue_pending_order(name, email, locale, payment_intent.id)
+
+    result = {"clientSecret": payment_intent.client_secret, "customerId": customer_id}
+    if cache_key:
+        checkout_responses.set(cache_key, result)
+    return result
+
+
+def stats() -> dict:
+    queued = _db().execute("SELECT COUNT(*) AS total, MAX(attempts) AS attempts FROM pending_orders").fetchone()
+    return {"responses": checkout_responses.stats(), "customers": stripe_customers.stats(),
+            "pending_orders": {"queued": queued["total"], "max_attempts": queued["attempts"] or 0}}
@@ -0,0 +1,74 @@
+import re
+import phonenumbers
+from phonenumbers import carrier, geocoder
+from cache import TTLCache
+import config
+
+
+# Cache de respuestas de /api/phone-info por (número E.164 normalizado, idioma).
+phone_cache = TTLCache(maxsize=config.PHONE_CACHE_SIZE, ttl=config.PHONE_CACHE_TTL)
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_number(code: str, phone_number: str) -> str:
+    """Normaliza prefijo + número a la forma +<dígitos> sin parsear metadatos."""
+    return "+" + _NON_DIGITS.sub("", f"{code}{phone_number}")
+
+
+# Resuelve país y operador de un número. El resultado ya serializado se
+# guarda en cache, así las consultas repetidas no recorren los metadatos
+# de phonenumbers ni vuelven a construir el modelo de salida.
+# Los errores de parseo (NumberParseException) se propagan sin cachear.
+def lookup_phone_info(code: str, phone_number: str, code_lang: str) -> dict:
+    # geocoder distingue mayúsculas ("DE" no da nombre de país): se normaliza
+    # una vez y el mismo valor sirve de clave y de idioma de la consulta
+    code_lang = code_lang.lower()
+    key = (normalize_number(code, phone_number), code_lang)
+    cached = phone_cache.get(key)
+    if cached is not None:
+        return cached
+    result = _resolve(code, phone_number, code_lang)
+    phone_cache.set(key, result)
+    return result
+
+
+def _resolve(code: str, phone_number: str, code_lang: str) -> dict:
+    # Procesamos el número telefónico con phonenumbers
+    parsed_number = phonenumbers.parse(f"{code}{phone_number}")
+
+    # Obtenemos el país y operador en el idioma solicitado
+    country = geocoder.description_for_number(parsed_number, code_lang)
+    operator = carrier.name_for_number(parsed_number, code_lang)
+    return {"status": True, "description": "Exitoso", "country": country, "operator": operator}
+
+
+# Resuelve un lote de números (code, phone_number, code_lang).
+# Devuelve un resultado por elemento en el mismo orden; los errores de un
+# elemento se reportan en su propio resultado sin afectar al resto.
+# Los fallos de cache se agrupan por (prefijo de país, idioma) para que los
+# metadatos de phonenumbers de cada región/idioma se carguen una sola vez.
+def lookup_phone_info_batch(items: list) -> list:
+    results: list = [None] * len(items)
+    groups: dict = {}
+
+    for index, (code, phone_number, code_lang) in enumerate(items):
+        key = (normalize_number(code, phone_number), code_lang.lower())
+        cached = phone_cache.get(key)
+        if cached is not None:
+            results[index] = cached
+            continue
+        group = (_NON_DIGITS.sub("", code), key[1])
+        groups.setdefault(group, {}).setdefault(key, []).append(index)
+
+    for group in groups.values():
+        for key, indexes in group.items():
+            code, phone_number, _ = items[indexes[0]]
+            try:
+                result = _resolve(code, phone_number, key[1])
+                phone_cache.set(key, result)
+            except phonenumbers.phonenumberutil.NumberParseException as e:
+                result = {"status": False, "description": str(e), "country": "", "operator": ""}
+            for index in indexes:
+                results[index] = result
+    return results
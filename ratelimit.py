@@ -0,0 +1,247 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional
+import config
+import local_store
+import metrics
+from logger import get_logger
+
+log = get_logger(__name__)
+
+# Limitación de peticiones con token buckets compartidos por todos los
+# workers del nodo (SQLite local en modo WAL). Cada ruta limitada tiene uno o
+# varios ámbitos: por IP ("ip"), por usuario ("user": el email del cuerpo o la
+# identidad del JWT) y por API key ("key"). La comprobación se hace en un
+# before_request, antes de tocar Supabase, Gemini o Resend, y si algún bucket
+# está vacío se responde 429 con Retry-After sin consumir de los demás.
+#
+# Formato de los límites: "ámbito=capacidad/segundos,...": cada bucket admite
+# ráfagas de `capacidad` peticiones y se rellena a capacidad/segundos por
+# segundo. Se ajustan por ruta con RATE_LIMIT_<NOMBRE> (vacío = sin límite).
+#
+# El límite por IP es el que frena a un cliente concreto: el email del cuerpo
+# lo elige quien llama (puede ir cambiándolo) y la API key es una sola
+# compartida por todos los clientes, así que "key" es un tope global de la
+# ruta y no se usa por defecto (un abusador lo agotaría para todos).
+# La IP es remote_addr; detrás de proxies hay que indicar cuántos con
+# RATE_LIMIT_PROXY_HOPS para tomarla de X-Forwarded-For.
+
+
+SCOPES = {"key", "ip", "user"}
+
+
+class Limit(NamedTuple):
+    scope: str
+    capacity: float
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+
+def parse_limits(spec: str) -> List[Limit]:
+    # "ip=20/60,user=5/60" -> [Limit("ip", 20, 60), Limit("user", 5, 60)]
+    limits = []
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        scope, value = (part.strip() for part in item.split("=", 1))
+        capacity, _, period = value.partition("/")
+        if scope not in SCOPES:
+            raise ValueError(f"Ámbito de rate limit desconocido: {scope}")
+        limits.append(Limit(scope, float(capacity), float(period or 1)))
+    return limits
+
+
+# ruta -> (nombre para RATE_LIMIT_<NOMBRE>, límites por defecto)
+ROUTES = {
+    "/api/login": ("login", "ip=20/60,user=5/60"),
+    "/api/reset-psw": ("reset_psw", "ip=10/60,user=3/600"),
+    "/api/phone-info": ("phone_info", "ip=300/60"),
+    "/api/chat": ("chat", "ip=20/60"),
+}
+
+
+class RateLimited(Exception):
+    def __init__(self, route: str, scope: str, retry_after: float):
+        super().__init__(f"Límite de peticiones superado en {route} ({scope})")
+        self.route = route
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS buckets (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        full_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at);
+    """
+    # Cada cuántas peticiones admitidas se borran los buckets ya llenos
+    # (equivalen a no tener fila)
+    _PRUNE_EVERY = 256
+
+    def __init__(self, name: str = "ratelimit"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._hits = 0
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    def _db(self) -> sqlite3.Connection:
+        return local_store.connect(self.name, self._SCHEMA)
+
+    def hit(self, route: str, buckets: list, cost: float = 1) -> None:
+        """Consume `cost` de cada bucket [(limit, identidad)] o lanza RateLimited sin consumir de ninguno."""
+        if not buckets:
+            return
+        now = time.time()
+        conn = self._db()
+        # Lectura y escritura en una transacción de escritura: entre workers
+        # no se pueden gastar dos veces los mismos tokens.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            states = []
+            denied = None
+            for limit, identity in buckets:
+                key = f"{route}|{limit.scope}|{identity}"
+                row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = limit.capacity if row is None else min(limit.capacity, row["tokens"] + (now - row["updated_at"]) * limit.rate)
+                if tokens < cost:
+                    wait = (cost - tokens) / limit.rate
+                    if denied is None or wait > denied[1]:
+                        denied = (limit.scope, wait)
+                states.append((key, limit, tokens))
+            if denied is None:
+                for key, limit, tokens in states:
+                    left = tokens - cost
+                    conn.execute(
+                        "INSERT OR REPLACE INTO buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)",
+                        (key, left, now, now + (limit.capacity - left) / limit.rate)
+                    )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            if denied is not None:
+                self.limited += 1
+            else:
+                self.allowed += 1
+                self._hits += 1
+            prune = self._hits % self._PRUNE_EVERY == 0 and denied is None
+        if denied is not None:
+            raise RateLimited(route, *denied)
+        if prune:
+            conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+
+    def reset(self) -> None:
+        self._db().execute("DELETE FROM buckets")
+
+    def stats(self) -> dict:
+        """Contadores del proceso actual y buckets activos en el nodo."""
+        with self._lock:
+            counters = {"allowed": self.allowed, "limited": self.limited, "errors": self.errors}
+        counters["buckets"] = self._db().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+        return counters
+
+
+limiter = RateLimiter()
+
+
+def _from_config() -> dict:
+    rules = {}
+    for route, (name, default) in ROUTES.items():
+        limits = parse_limits(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+        if limits:
+            rules[route] = limits
+    return rules
+
+
+# --- Identidades de la petición ---------------------------------------------------
+
+def _digest(value: str) -> str:
+    # Las API keys y los emails no se guardan en claro en el almacén local
+    return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+
+def _client_ip(request) -> Optional[str]:
+    # Con RATE_LIMIT_PROXY_HOPS=N la IP del cliente es la entrada que añadió
+    # el proxy de confianza más externo (la N-ésima desde el final); las
+    # anteriores las pone el cliente y no se usan. Si la cabecera tiene menos
+    # entradas la petición no pasó por todos los proxies y se usa remote_addr.
+    hops = config.RATE_LIMIT_PROXY_HOPS
+    if hops > 0:
+        addresses = [address.strip() for address in request.headers.get("X-Forwarded-For", "").split(",") if address.strip()]
+        if len(addresses) >= hops:
+            return addresses[-hops]
+    return request.remote_addr
+
+
+def _user(request) -> Optional[str]:
+    body = request.get_json(silent=True)
+    if isinstance(body, dict) and isinstance(body.get("email"), str):
+        return body["email"].strip().lower()
+    if request.headers.get("Authorization"):
+        from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+        try:
+            verify_jwt_in_request(optional=True)
+            return get_jwt_identity()
+        except Exception:
+            return None
+    return None
+
+
+def _identity(scope: str, request) -> Optional[str]:
+    if scope == "ip":
+        return _client_ip(request)
+    if scope == "key":
+        api_key = request.headers.get("X-API-KEY")
+        return _digest(api_key) if api_key else None
+    user = _user(request)
+    return _digest(user) if user else None
+
+
+def init_app(app) -> None:
+    """Aplica los límites de ROUTES antes de ejecutar la vista (429 con Retry-After)."""
+    from flask import request
+    from responses import json_response
+
+    rules = _from_config()
+
+    @app.before_request
+    def _rate_limit():
+        if not config.RATE_LIMIT_ENABLED or request.method == "OPTIONS" or request.url_rule is None:
+            return None
+        route = request.url_rule.rule
+        limits = rules.get(route)
+        if not limits:
+            return None
+        buckets = []
+        for limit in limits:
+            identity = _identity(limit.scope, request)
+            if identity is not None:
+                buckets.append((limit, identity))
+        try:
+            limiter.hit(route, buckets)
+        except RateLimited as e:
+            metrics.registry.add("rate_limited_total", (("route", route), ("scope", e.scope)))
+            response = json_response({"error": "Demasiadas solicitudes, inténtalo más tarde", "scope": e.scope}, 429)
+            response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+            return response
+        except sqlite3.Error:
+            # Si el almacén local falla se deja pasar la petición (el límite
+            # protege de abusos, no debe tumbar el servicio)
+            with limiter._lock:
+                limiter.errors += 1
+            log.warning("Rate limit no disponible", exc_info=True)
+        return None
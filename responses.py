@@ -0,0 +1,74 @@
+import gzip
+import json
+from datetime import date, time
+from decimal import Decimal
+from uuid import UUID
+from flask import Response, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from pydantic import BaseModel
+import config
+
+# Serialización JSON de las respuestas en una sola pasada directa a bytes:
+# los modelos Pydantic con su serializador nativo (model_dump_json) y el
+# resto (filas de PostgREST, dicts) con orjson si está instalado. Evita el
+# ciclo model_dump() -> jsonify y json.loads(model_dump_json()) -> jsonify.
+# Los cuerpos grandes se comprimen con gzip si el cliente lo acepta.
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional; sin él se usa json de la librería estándar
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+
+
+def dumps(value) -> bytes:
+    """Serializa a bytes UTF-8 en una sola pasada."""
+    if isinstance(value, BaseModel):
+        return value.model_dump_json().encode()
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+loads = orjson.loads if orjson is not None else json.loads
+
+
+def _finish(body: bytes, status: int, mimetype: str = "application/json") -> Response:
+    response = Response(body, status=status, mimetype=mimetype)
+    if len(body) >= config.JSON_GZIP_MIN_BYTES:
+        response.vary.add("Accept-Encoding")
+        if has_request_context() and "gzip" in request.accept_encodings:
+            response.set_data(gzip.compress(body, compresslevel=config.JSON_GZIP_LEVEL))
+            response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+def json_response(payload, status: int = 200) -> Response:
+    """Respuesta JSON de un modelo Pydantic, dict o lista (equivale a jsonify(...), status)."""
+    return _finish(dumps(payload), status)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask sobre dumps/loads (jsonify, request.json, flask.json)."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs:
+            # indent, sort_keys...: formato especial, se usa el proveedor estándar
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s) if not kwargs else super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return _finish(dumps(obj), 200, self.mimetype)
@@ -1,26 +1,27 @@
 from datetime import datetime
+import base64
 import json
 import os
 from typing import Optional
-from jinja2 import Environment, FileSystemLoader
-import resend
-from db import supabase, get_client
+from db import execute, supabase_context
+from email_templates import render_email
+import outbox
+from cache import SharedTTLCache
+from unsubscribes import IndexNotReady, unsubscribe_index
 import config
+from logger import get_logger
 
+log = get_logger(__name__)
 
-templates = {
-    "en": "emailtemplate_en.html",
-    "es": "emailtemplate_es.html",
-    "fr": "emailtemplate_fr.html",
-    "pt": "emailtemplate_pt.html",
-    "de": "emailtemplate_de.html"
-}
+# Créditos por id de usuario, compartidos entre los workers del nodo.
+credits_cache = SharedTTLCache("credits", maxsize=config.CREDITS_CACHE_SIZE, ttl=config.CREDITS_CACHE_TTL)
 
 #Crea un usuario nuevo o actualiza si ya existe (webhook).
 #Retorna un diccionario con {status: bool, code: int, message: str}.
-def create_user(customer_name, customer_email, jwt_token):
-    client_supabase = get_client(jwt_token)
-    user_uuid = client_supabase.auth.get_user().user.id
+def create_user(customer_name, customer_email):
+    ctx = supabase_context()
+    client_supabase = ctx.client
+    user_uuid = ctx.user_uuid
 
     try:
         # Validar parámetros
@@ -46,148 +47,228 @@ def create_user(customer_name, customer_email, jwt_token):
 
         return {"status": True, "code": 200, "message": "Usuario creado exitosamente"}
     except Exception as e:
-        print(f"[create_user] Error: {e}")
+        log.exception("Error creando el usuario")
         return {"status": False, "code": 500, "message": "Error interno del servidor"}
 
 #Inserta el usuario nuevo en la BD.
 def insert_client(client_supabase, name:str, email: str, password: str, user_uuid: str) -> Optional[int]:
     timestamp = datetime.now()
-    insert_res = client_supabase.table("Users").insert({
+    insert_res = execute(client_supabase.table("Users").insert({
             "name": name,
             "email": email,
             "password": password,
             "verification_email": False,
             "created_at": timestamp.isoformat(),
             "user_uuid": user_uuid
-        }).execute()
+        }), "Users.insert")
     return insert_res.data[0]['id'] if insert_res.data else None
 
 #Actualiza el usuario nuevo en la BD.
 def update_client(client_supabase, email: str, password: str) -> Optional[int]:
     timestamp = datetime.now()
-    update_res = client_supabase.table("Users").update({"password": password}).eq("email", email).execute()
+    update_res = execute(client_supabase.table("Users").update({"password": password}).eq("email", email), "Users.update")
     return update_res.data[0]['id'] if update_res.data else None
 
-#Envia el email.
+#Encola el email; el envío por Resend lo hace el outbox en segundo plano.
 def send_email(name: str, email: str, password: str, lang: str='es'):
     htmlContent = build_template(name, email, password, lang)
     try:
         # Preparar parámetros para Resend
-        params: resend.Emails.SendParams = {
+        params = {
             "from": f"{os.environ.get('FROM_NAME')} <{os.environ.get('FROM_EMAIL')}>",
             "to": [email],
             "subject": os.environ.get("SUBJECT_MAIL_RESEND"),
             "html": htmlContent,
         }
 
-        # Enviar email
-        email_response = resend.Emails.send(params)
-        print("Correo enviado")
+        # Encolar email
+        outbox_id = outbox.enqueue(params)
+        log.info("Correo encolado", extra={"outbox_id": outbox_id})
 
     except Exception as e:
-       print(f"[send_email] Error: {e}")
-
-#Inserta ordenes pendientes en BD (checkout)
-def insert_pending_order(name:str, email:str, locale:str, payment_id:str, jwt_token:str):
-    client_supabase = get_client(jwt_token)
-    user_uuid = client_supabase.auth.get_user().user.id
-    client_supabase.table("Pending_orders") \
+       log.exception("Error encolando el correo")
+
+#Inserta ordenes pendientes en BD (checkout). Es idempotente por payment_intent:
+#la cola local de payments.py puede reintentar una inserción que ya se hizo.
+def insert_pending_order(name:str, email:str, locale:str, payment_id:str):
+    ctx = supabase_context()
+    existing = execute(ctx.client.table("Pending_orders").select("id").eq("payment_intent", payment_id).limit(1),
+                       "Pending_orders.select")
+    if existing.data:
+        return
+    execute(ctx.client.table("Pending_orders") \
             .insert({
                 "name": name,
                 "locale":locale,
                 "email": email,
                 "payment_intent": payment_id,
-                "user_uuid": user_uuid
-            }).execute()
+                "user_uuid": ctx.user_uuid
+            }), "Pending_orders.insert")
 
 #Actualiza ordenes pendientes en BD (webhook)
-def mark_order_as_paid(payment_id:str, jwt_token:str):
-    client_supabase = get_client(jwt_token)
-    user_id = client_supabase.auth.get_user().user.id
-    response_base = client_supabase.table("Pending_orders").select("*").eq("payment_intent",payment_id).execute()
+def mark_order_as_paid(payment_id:str):
+    client_supabase = supabase_context().client
+    response_base = execute(client_supabase.table("Pending_orders").select("*").eq("payment_intent",payment_id), "Pending_orders.select")
 
     if len(response_base.data) > 0:
         # ✅ actualizar
         order = response_base.data[0]
         order_id = response_base.data[0]["id"]
-        client_supabase.table("Pending_orders") \
+        execute(client_supabase.table("Pending_orders") \
             .update({"success": True}) \
-            .eq("id", order_id) \
-            .execute()
-        print(f"[INFO] Orden {order_id} marcada como pagada.")
+            .eq("id", order_id), "Pending_orders.update")
+        log.info("Orden marcada como pagada", extra={"order_id": order_id})
         return order
     else:
-        print(f"[WARN] No se encontró ninguna orden pendiente con payment_intent={payment_id}")
+        log.warning("No hay orden pendiente", extra={"payment_intent": payment_id})
         return None
 
 def user_exists_by_email(client_supabase, email):
     # Realiza la consulta para verificar si el correo electrónico ya existe
-    response = client_supabase.table("Users").select("id").eq("email", email).limit(1).execute()
+    response = execute(client_supabase.table("Users").select("id").eq("email", email).limit(1), "Users.select")
     return response.data[0] if response.data else None
 
-def exist_user(jwt_token, email, password):
+def get_user_email(id_user) -> Optional[str]:
+    client_supabase = supabase_context().client
+    response = execute(client_supabase.table("Users").select("email").eq("id", int(id_user)).limit(1), "Users.select")
+    return response.data[0]["email"] if response.data else None
+
+def exist_user(email, password):
     # Realiza la consulta para verificar si el correo electrónico ya existe
-    client_supabase = get_client(jwt_token)
-    response = client_supabase.table("Users").select("id").eq("email", email).eq("password",password).execute()
+    client_supabase = supabase_context().client
+    response = execute(client_supabase.table("Users").select("id").eq("email", email).eq("password",password), "Users.select")
     return response
 
-def get_locations_request(id_user, jwt_token:str):
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+#Valida el cursor antes de que llegue al filtro or_; cualquier cursor mal
+#formado lanza ValueError (la ruta responde 400).
+def decode_cursor(cursor: str) -> tuple:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    value = json.loads(raw)
+    if not (isinstance(value, list) and len(value) == 2 and isinstance(value[0], str)
+            and isinstance(value[1], int) and not isinstance(value[1], bool)):
+        raise ValueError("Cursor inválido")
+    created_at, row_id = value
+    datetime.fromisoformat(created_at)
+    return created_at, row_id
+
+#Página del historial del usuario ordenada por (created_at, id) descendente.
+#Paginación por cursor (keyset): cada página filtra a partir de la última
+#fila de la anterior, así el costo no crece con la profundidad.
+#Retorna (filas, cursor_siguiente); cursor_siguiente es None en la última página.
+def get_locations_request(id_user, limit: int, cursor: Optional[str] = None):
+    # Un cursor inválido es un error del cliente (ValueError -> 400), no se registra
+    keyset = decode_cursor(cursor) if cursor else None
     # First get the location requests for this user
     try:
-        client_supabase = get_client(jwt_token)
-        location_requests =  client_supabase.table("LocationRequests").select("status, smsstatus, codephone, phonenumber, codecountry, created_at, " + "Locations(latitude, longitude, captured_at, city)").eq("user_id", id_user).order("created_at", desc=True).execute()
-        return location_requests
+        client_supabase = supabase_context().client
+        query = client_supabase.table("LocationRequests").select("id, status, smsstatus, codephone, phonenumber, codecountry, created_at, " + "Locations(latitude, longitude, captured_at, city)").eq("user_id", id_user)
+        if keyset:
+            created_at, row_id = keyset
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{row_id})')
+        # Se pide una fila de más para saber si hay página siguiente
+        response = execute(query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1), "LocationRequests.select")
+        rows = response.data
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
     except Exception as e:
-        print(f"[getLocationsRequest] Error: {e}")
-
-def insert_location_request(jwt_token, message_uuid, smsstatus, created_at, code, phone_number, code_country, id_user):
+        log.exception("Error leyendo el historial")
+        raise
+
+#Recorre el historial página a página sin cargarlo entero en memoria,
+#desde el principio o a partir de `cursor`.
+def iter_locations_request(id_user, page_size: int, cursor: Optional[str] = None):
+    while True:
+        rows, cursor = get_locations_request(id_user, page_size, cursor)
+        yield from rows
+        if cursor is None:
+            return
+
+def insert_location_request(message_uuid, smsstatus, created_at, code, phone_number, code_country, id_user):
     # First get the location requests for this user
     try:
-        client_supabase = get_client(jwt_token)
-        location_requests =  client_supabase.table("LocationRequests").insert({"message_uuid":str(message_uuid), "status":False,"smsstatus": smsstatus, "created_at": created_at,"codephone":code,"phonenumber": phone_number, "codecountry": code_country, "user_id": id_user}).execute()
+        client_supabase = supabase_context().client
+        location_requests =  execute(client_supabase.table("LocationRequests").insert({"message_uuid":str(message_uuid), "status":False,"smsstatus": smsstatus, "created_at": created_at,"codephone":code,"phonenumber": phone_number, "codecountry": code_country, "user_id": id_user}), "LocationRequests.insert")
         return location_requests
     except Exception as e:
-        print(f"[insertLocationRequest] Error: {e}")
-
-def insert_unsubscribe(jwt_token, email):
-    # First get the location requests for this user
+        log.exception("Error registrando la solicitud")
+
+#Actualiza el estado del SMS; con `expected` solo si sigue en ese estado
+#(evita pisar un recibo de entrega que llegó antes). Retorna las filas
+#actualizadas (vacío si el estado ya era otro).
+def update_sms_status(message_uuid, smsstatus: int, expected: Optional[int] = None) -> list:
+    client_supabase = supabase_context().client
+    query = client_supabase.table("LocationRequests").update({"smsstatus": smsstatus}).eq("message_uuid", str(message_uuid))
+    if expected is not None:
+        query = query.eq("smsstatus", expected)
+    return execute(query, "LocationRequests.update").data or []
+
+#Registra la baja; si el email ya estaba dado de baja no se duplica la fila
+#(índice único sobre email, ver sql/unsubscribe.sql).
+def insert_unsubscribe(email):
     try:
-        client_supabase = get_client(jwt_token)
-        user_uuid = client_supabase.auth.get_user().user.id
-        unsubscribe =  client_supabase.table("Unsubscribe").insert({"email":email,"user_uuid":user_uuid}).execute()
+        ctx = supabase_context()
+        unsubscribe =  execute(ctx.client.table("Unsubscribe").upsert({"email":email,"user_uuid":ctx.user_uuid}, on_conflict="email", ignore_duplicates=True), "Unsubscribe.upsert")
+        unsubscribe_index.add(email)
         return unsubscribe
     except Exception as e:
-        print(f"[insertUnsubscribe] Error: {e}")
+        log.exception("Error registrando la baja")
 
+#Indica si el email está dado de baja. Se responde con el conjunto local
+#sincronizado en segundo plano (unsubscribes.py); hasta su primera carga se
+#hace una consulta filtrada por email en lugar de descargar toda la tabla.
 def unsubscribe_exists_by_email(client_supabase, email):
-    # First get the location requests for this user
     try:
-        unsubscribe =  client_supabase.table("Unsubscribe").select({"email":email}).execute()
+        return unsubscribe_index.contains(email)
+    except IndexNotReady:
+        pass
+    try:
+        unsubscribe =  execute(client_supabase.table("Unsubscribe").select("id").eq("email", email.lower()).limit(1), "Unsubscribe.select")
         return unsubscribe.data[0] if unsubscribe.data else None
     except Exception as e:
-        print(f"[existUnsubscribe] Error: {e}")
-
-def update_credits(jwt_token, credits: int, id_user:int) -> Optional[int]:
-    client_supabase = get_client(jwt_token)
-    update_res = client_supabase.table("Users").update({"credits": credits}).eq("id", id_user).execute()
-    return update_res.data[0]['id'] if update_res.data else None
-
-def get_credits(jwt_token, id_user:int) -> Optional[int]:
-    client_supabase = get_client(jwt_token)
-    update_res = client_supabase.table("Users").select("credits").eq("id", id_user).execute()
-    return update_res.data[0]['credits'] if update_res.data else None
+        log.exception("Error consultando la baja")
+
+#Créditos del usuario (read-through: solo consulta la BD si no están en cache).
+def get_credits(id_user:int) -> Optional[int]:
+    cached = credits_cache.get(str(id_user))
+    if cached is not None:
+        return cached
+    client_supabase = supabase_context().client
+    update_res = execute(client_supabase.table("Users").select("credits").eq("id", id_user), "Users.select")
+    credits = update_res.data[0]['credits'] if update_res.data else None
+    if credits is not None:
+        credits_cache.set(str(id_user), credits)
+    return credits
+
+#Descuenta un crédito de forma atómica en la BD (ver sql/credits.sql).
+#Retorna el saldo nuevo, o None si no había créditos suficientes.
+def consume_credit(id_user:int) -> Optional[int]:
+    client_supabase = supabase_context().client
+    response = execute(client_supabase.rpc("consume_credit", {"p_user_id": int(id_user)}), "rpc.consume_credit")
+    credits = response.data
+    if credits is None:
+        # Sin saldo: la cache podía estar desfasada
+        credits_cache.set(str(id_user), 0)
+    else:
+        credits_cache.set(str(id_user), credits)
+    return credits
+
+#Devuelve créditos de forma atómica (p. ej. si el envío falló).
+def refund_credits(id_user:int, amount: int = 1) -> Optional[int]:
+    client_supabase = supabase_context().client
+    response = execute(client_supabase.rpc("add_credits", {"p_user_id": int(id_user), "p_amount": amount}), "rpc.add_credits")
+    if response.data is None:
+        credits_cache.delete(str(id_user))
+    else:
+        credits_cache.set(str(id_user), response.data)
+    return response.data
 
 def build_template(name: str, email: str, password: str, lang:str) -> str:
-    env = Environment(loader=FileSystemLoader('templates'))
-
-    template_name = templates.get(lang.lower(), "emailtemplate_es.html")
-    template = env.get_template(template_name)
-    return template.render({"name": name, "email": email, "password": password})
-
-def exist_location(message_uuid):
-    # Realiza la consulta para verificar si ya hay registrada una ubicacion
-    response = supabase.table("Locations").select("id").eq("location_request_id", message_uuid).execute()
-    return len(response.data) > 0
+    # Plantillas precompiladas al arrancar (email_templates.py)
+    return render_email(name, email, password, lang)
 
 def generate_password(length: int = 12) -> str:
     """Genera una contraseña aleatoria segura."""
@@ -198,16 +279,20 @@ def generate_password(length: int = 12) -> str:
 #Actualiza el usuario nuevo en la BD.
 def update_psw(client_supabase, email: str) -> Optional[int]:
     customer_password = generate_password()
-    update_res = client_supabase.table("Users").update({"password": customer_password}).eq("email", email).execute()
+    update_res = execute(client_supabase.table("Users").update({"password": customer_password}).eq("email", email), "Users.update")
     # Enviar correo de confirmación
     customer_name = update_res.data[0]['name'].lower()
     send_email(customer_name, email, customer_password)
 
-def update_locations(client_supabase, message_uuid, latitude,longitude, country, timestamp) -> Optional[int]:
-    if exist_location(message_uuid):
-        locationUp = client_supabase.table("Locations").update({"latitude": latitude, "longitude": longitude, "city": country ,"captured_at": timestamp}).eq('location_message_uuid',message_uuid).execute()
-    else:
-        location = client_supabase.table("Locations").insert({"location_message_uuid": message_uuid, "latitude": latitude, "longitude": longitude, "city": country ,"captured_at": timestamp}).execute()
-             
-
-
+#Guarda la ubicación y marca la solicitud como completada en un solo
+#viaje a la BD (función save_location, ver sql/save_location.sql).
+#Retorna False si no existe la solicitud.
+def upsert_location(client_supabase, message_uuid, latitude, longitude, country, timestamp) -> bool:
+    response = execute(client_supabase.rpc("save_location", {
+        "p_message_uuid": message_uuid,
+        "p_latitude": latitude,
+        "p_longitude": longitude,
+        "p_city": country,
+        "p_captured_at": timestamp
+    }), "rpc.save_location")
+    return bool(response.data)
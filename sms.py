@@ -0,0 +1,307 @@
+import os
+import threading
+import time
+import uuid
+from bulkhead import BulkheadRejected, CallTimeout, bulkheads
+from concurrency import is_shutdown_error, once_per_process, per_process_executor
+from clients import get_vonage
+from service import refund_credits, update_sms_status
+import config
+import local_store
+from logger import get_logger
+
+log = get_logger(__name__)
+
+# Envío de SMS fuera del hilo de la petición. /api/send-sms reserva el
+# crédito, registra la solicitud con smsstatus=SMS_QUEUED y deja el envío en
+# una cola local en SQLite (como el outbox de correos); un despachador en
+# segundo plano llama a Vonage y actualiza el estado. Como la cola vive en
+# disco, un reinicio del worker no pierde el SMS ni deja el crédito retenido.
+#
+# El crédito se devuelve una sola vez y solo si el SMS no salió: cada cambio
+# de estado que lo devuelve es condicional sobre el estado anterior en
+# LocationRequests (QUEUED o SENT), así un recibo y el despachador no pueden
+# devolverlo los dos.
+# - Vonage acepta el SMS: SENT. Si después el recibo de entrega (DLR) dice
+#   failed/rejected/expired, pasa a REJECTED y se devuelve el crédito.
+# - Vonage lo rechaza: REJECTED y se devuelve el crédito.
+# - Error sin respuesta de Vonage: se reintenta con backoff; agotados los
+#   intentos, ERROR y se devuelve el crédito.
+# - Timeout (o un envío que quedó a medias al caer el worker): puede que el
+#   SMS saliera, así que no se reenvía ni se devuelve el crédito; se espera
+#   el recibo de entrega, y si no llega en SMS_RECEIPT_TIMEOUT se da por no
+#   enviado (ERROR) y se devuelve.
+# El resultado se guarda en la cola antes de escribirlo en Supabase: si esa
+# escritura falla se reintenta hasta aplicarlo (la fila sigue en 'resolving').
+
+# Valores de LocationRequests.smsstatus
+SMS_REJECTED = 0
+SMS_SENT = 1
+SMS_ERROR = 2
+SMS_QUEUED = 3
+
+# Estados del recibo de entrega de Vonage -> smsstatus
+DLR_STATUS = {
+    "delivered": SMS_SENT,
+    "accepted": SMS_SENT,
+    "buffered": SMS_SENT,
+    "failed": SMS_REJECTED,
+    "rejected": SMS_REJECTED,
+    "expired": SMS_REJECTED,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sms_queue (
+    message_uuid TEXT PRIMARY KEY,
+    code TEXT NOT NULL,
+    phone_number TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    created_at REAL NOT NULL,
+    last_error TEXT,
+    result INTEGER
+);
+CREATE INDEX IF NOT EXISTS sms_queue_due ON sms_queue (status, next_attempt_at);
+"""
+
+# Un envío que lleva más que esto en 'sending' se da por interrumpido (worker
+# caído); como no se sabe si llegó a Vonage pasa a esperar el recibo.
+_STALE_CLAIM_SECONDS = 120
+# Cada cuánto se reintenta escribir en Supabase un resultado pendiente
+_RESOLVE_RETRY_SECONDS = 30
+
+_wakeup = threading.Event()
+_slots = threading.BoundedSemaphore(max(1, config.SMS_WORKERS))
+_executor = None
+
+
+def _db():
+    return local_store.connect("sms", _SCHEMA)
+
+
+def build_message(message_uuid: str, code: str, phone_number: str):
+    from vonage_sms import SmsMessage
+
+    code_number = code.replace("+", "")
+    linkApp = f"{os.environ.get('DOMAIN_LOCALIZATION')}?uuid={message_uuid}"
+    options = {"callback": config.VONAGE_DLR_URL} if config.VONAGE_DLR_URL else {}
+    return SmsMessage(
+        to=f"{code_number}{phone_number}",
+        from_=os.environ.get("BRAND_NAME_VONAGE") or ".",
+        text=f"Localiza tu teléfono aquí: {linkApp}",
+        # client_ref vuelve en el recibo de entrega y enlaza con la solicitud
+        client_ref=message_uuid,
+        **options
+    )
+
+
+def enqueue(message_uuid: str, code: str, phone_number: str) -> None:
+    """Encola el envío del SMS de una solicitud ya registrada con SMS_QUEUED."""
+    now = time.time()
+    _db().execute(
+        "INSERT OR IGNORE INTO sms_queue (message_uuid, code, phone_number, next_attempt_at, created_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (message_uuid, code, phone_number, now, now)
+    )
+    ensure_started()
+    _wakeup.set()
+
+
+# --- Cambios de estado ---------------------------------------------------------------
+
+def _finish(message_uuid: str, smsstatus: int) -> bool:
+    """Pasa la solicitud de QUEUED o SENT a un estado final sin envío y devuelve el crédito.
+
+    Devuelve False si la solicitud ya estaba en otro estado (otro camino ya la resolvió).
+    """
+    for expected in (SMS_QUEUED, SMS_SENT):
+        rows = update_sms_status(message_uuid, smsstatus, expected=expected)
+        if rows:
+            refund_credits(rows[0]["user_id"])
+            return True
+    return False
+
+
+def _apply(message_uuid: str, smsstatus: int) -> None:
+    if smsstatus == SMS_SENT:
+        update_sms_status(message_uuid, SMS_SENT, expected=SMS_QUEUED)
+    elif _finish(message_uuid, smsstatus) and smsstatus == SMS_ERROR:
+        log.warning("SMS no enviado, se devuelve el crédito", extra={"message_uuid": message_uuid})
+
+
+def _resolve(message_uuid: str, smsstatus: int) -> None:
+    # Primero el resultado a la cola local, después a Supabase
+    _db().execute(
+        "UPDATE sms_queue SET status = 'resolving', result = ?, next_attempt_at = ?, claimed_by = NULL "
+        "WHERE message_uuid = ?",
+        (smsstatus, time.time() + _RESOLVE_RETRY_SECONDS, message_uuid)
+    )
+    _apply(message_uuid, smsstatus)
+    _db().execute("DELETE FROM sms_queue WHERE message_uuid = ?", (message_uuid,))
+
+
+def _await_receipt(message_uuid: str, error: str) -> None:
+    _db().execute(
+        "UPDATE sms_queue SET status = 'awaiting_receipt', next_attempt_at = ?, last_error = ?, claimed_by = NULL "
+        "WHERE message_uuid = ?",
+        (time.time() + config.SMS_RECEIPT_TIMEOUT, error, message_uuid)
+    )
+
+
+# --- Despachador ---------------------------------------------------------------------
+
+def _claim() -> list:
+    # Reclamo atómico de un envío vencido; varios procesos comparten la cola.
+    now = time.time()
+    claim_id = uuid.uuid4().hex
+    conn = _db()
+    # Los envíos interrumpidos no se repiten: pueden haber salido
+    conn.execute(
+        "UPDATE sms_queue SET status = 'awaiting_receipt', next_attempt_at = ?, claimed_by = NULL "
+        "WHERE status = 'sending' AND claimed_at < ?",
+        (now + config.SMS_RECEIPT_TIMEOUT, now - _STALE_CLAIM_SECONDS)
+    )
+    conn.execute(
+        """UPDATE sms_queue SET status = 'sending', claimed_by = ?, claimed_at = ?
+           WHERE message_uuid IN (
+               SELECT message_uuid FROM sms_queue
+               WHERE status = 'pending' AND next_attempt_at <= ?
+               ORDER BY created_at LIMIT 1)""",
+        (claim_id, now, now)
+    )
+    return conn.execute("SELECT * FROM sms_queue WHERE claimed_by = ?", (claim_id,)).fetchall()
+
+
+def _send(row) -> None:
+    message_uuid = row["message_uuid"]
+    try:
+        response_sms = bulkheads["vonage"].call(get_vonage().sms.send,
+                                                build_message(message_uuid, row["code"], row["phone_number"]))
+    except BulkheadRejected as e:
+        # Vonage saturado o con el circuito abierto: no se intentó, no cuenta
+        log.info("Envío de SMS aplazado", extra={"message_uuid": message_uuid, "reason": e.reason})
+        _db().execute(
+            "UPDATE sms_queue SET status = 'pending', next_attempt_at = ?, claimed_by = NULL WHERE message_uuid = ?",
+            (time.time() + max(1.0, e.retry_after), message_uuid)
+        )
+        return
+    except (CallTimeout, TimeoutError) as e:
+        log.warning("Timeout enviando el SMS, se espera el recibo de entrega",
+                    extra={"message_uuid": message_uuid, "error": str(e)})
+        _await_receipt(message_uuid, str(e))
+        return
+    except Exception as e:
+        attempts = row["attempts"] + 1
+        log.warning("Error enviando el SMS", extra={"message_uuid": message_uuid, "attempt": attempts, "error": str(e)})
+        if attempts < config.SMS_MAX_ATTEMPTS:
+            _db().execute(
+                "UPDATE sms_queue SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ?, "
+                "claimed_by = NULL WHERE message_uuid = ?",
+                (attempts, time.time() + min(config.SMS_BACKOFF_MAX, 2 ** attempts), str(e), message_uuid)
+            )
+            return
+        _resolve(message_uuid, SMS_ERROR)
+        return
+
+    msg = response_sms.messages[0] if getattr(response_sms, "messages", None) else None
+    if msg is not None and msg.status == "0":
+        _resolve(message_uuid, SMS_SENT)
+    else:
+        log.warning("Vonage rechazó el SMS", extra={"message_uuid": message_uuid,
+                                                    "error": getattr(msg, "error_text", None)})
+        _resolve(message_uuid, SMS_REJECTED)
+
+
+def _run(row) -> None:
+    try:
+        _send(row)
+    except Exception:
+        # Si falló guardar el resultado en Supabase, _resolve_pending lo reintenta
+        log.exception("Error actualizando el estado del SMS", extra={"message_uuid": row["message_uuid"]})
+    finally:
+        _slots.release()
+        _wakeup.set()
+
+
+def _resolve_pending() -> None:
+    # Resultados que no se pudieron escribir en Supabase y envíos sin recibo
+    # de entrega tras SMS_RECEIPT_TIMEOUT (se dan por no enviados)
+    rows = _db().execute(
+        "SELECT message_uuid, status, result FROM sms_queue "
+        "WHERE status IN ('resolving', 'awaiting_receipt') AND next_attempt_at <= ?",
+        (time.time(),)
+    ).fetchall()
+    for row in rows:
+        try:
+            _resolve(row["message_uuid"], row["result"] if row["status"] == "resolving" else SMS_ERROR)
+        except Exception as e:
+            log.warning("No se pudo resolver el SMS", extra={"message_uuid": row["message_uuid"], "error": str(e)})
+
+
+def _dispatch_once() -> None:
+    # Igual que el outbox: el hueco se devuelve si no hay trabajo o si falla
+    # el reclamo o el submit.
+    while _slots.acquire(blocking=False):
+        try:
+            rows = _claim()
+            if rows:
+                _executor.submit(_run, rows[0])
+        except BaseException:
+            _slots.release()
+            raise
+        if not rows:
+            _slots.release()
+            break
+
+
+def _dispatch_loop():
+    last_resolve = 0.0
+    while True:
+        _wakeup.wait(config.SMS_POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            if time.monotonic() - last_resolve > _RESOLVE_RETRY_SECONDS:
+                _resolve_pending()
+                last_resolve = time.monotonic()
+            _dispatch_once()
+        except Exception as e:
+            if is_shutdown_error(e):
+                return
+            log.exception("Error en el despachador de SMS")
+
+
+def _start() -> None:
+    global _executor, _slots
+    _slots = threading.BoundedSemaphore(max(1, config.SMS_WORKERS))
+    _executor = per_process_executor("sms", config.SMS_WORKERS)
+    threading.Thread(target=_dispatch_loop, name="sms-dispatcher", daemon=True).start()
+
+
+def ensure_started() -> None:
+    """Arranca el despachador de SMS del proceso actual (una vez por pid)."""
+    once_per_process("sms", _start)
+    _wakeup.set()
+
+
+def stats() -> dict:
+    rows = _db().execute("SELECT status, COUNT(*) AS total FROM sms_queue GROUP BY status").fetchall()
+    return {row["status"]: row["total"] for row in rows}
+
+
+# --- Recibos de entrega --------------------------------------------------------------
+
+def handle_delivery_receipt(params: dict) -> bool:
+    """Aplica un recibo de entrega de Vonage. Devuelve False si no se reconoce."""
+    message_uuid = params.get("client-ref") or params.get("client_ref")
+    smsstatus = DLR_STATUS.get((params.get("status") or "").lower())
+    if not message_uuid or smsstatus is None:
+        return False
+    if smsstatus == SMS_SENT:
+        # Resuelve un envío que expiró sin respuesta; un SMS ya devuelto no se vuelve a cobrar
+        update_sms_status(message_uuid, SMS_SENT, expected=SMS_QUEUED)
+    else:
+        _finish(message_uuid, smsstatus)
+    return True
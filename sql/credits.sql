@@ -0,0 +1,29 @@
+-- Operaciones atómicas sobre los créditos de "Users".
+-- Evitan el patrón leer-modificar-escribir desde la API, que pierde
+-- actualizaciones cuando llegan varios envíos de SMS a la vez.
+
+-- Descuenta un crédito solo si queda alguno. Devuelve el saldo nuevo o
+-- null si el usuario no tiene créditos suficientes.
+create or replace function public.consume_credit(p_user_id bigint)
+returns integer
+language sql
+security invoker
+as $$
+    update public."Users"
+       set credits = credits - 1
+     where id = p_user_id
+       and credits > 0
+ returning credits;
+$$;
+
+-- Devuelve créditos (p. ej. si el envío del SMS falla). Devuelve el saldo nuevo.
+create or replace function public.add_credits(p_user_id bigint, p_amount integer)
+returns integer
+language sql
+security invoker
+as $$
+    update public."Users"
+       set credits = credits + p_amount
+     where id = p_user_id
+ returning credits;
+$$;
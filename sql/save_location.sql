@@ -0,0 +1,63 @@
+-- Guarda la ubicación de una solicitud en un solo viaje de ida y vuelta.
+-- Marca la solicitud como completada y hace upsert en "Locations" sobre
+-- location_message_uuid. Devuelve false si la solicitud no existe.
+-- Se ejecuta con los permisos de quien llama (RLS sigue aplicando).
+
+-- Antes de crear el índice único se eliminan los duplicados existentes:
+-- el antiguo update_locations comprobaba la existencia sobre la columna
+-- equivocada y siempre insertaba, así que puede haber varias filas por
+-- location_message_uuid. Se conserva la de captured_at más reciente (a
+-- igualdad, la última escrita). El bloqueo evita que entren duplicados
+-- nuevos entre la limpieza y la creación del índice.
+begin;
+
+lock table public."Locations" in share row exclusive mode;
+
+delete from public."Locations" l
+ using (
+    select ctid,
+           row_number() over (
+               partition by location_message_uuid
+               order by captured_at desc nulls last, ctid desc
+           ) as position
+      from public."Locations"
+     where location_message_uuid is not null
+ ) ranked
+ where l.ctid = ranked.ctid
+   and ranked.position > 1;
+
+create unique index if not exists "Locations_location_message_uuid_key"
+    on public."Locations" (location_message_uuid);
+
+commit;
+
+create or replace function public.save_location(
+    p_message_uuid uuid,
+    p_latitude double precision,
+    p_longitude double precision,
+    p_city text,
+    p_captured_at timestamptz
+) returns boolean
+language plpgsql
+security invoker
+as $$
+begin
+    update public."LocationRequests"
+       set status = true
+     where message_uuid = p_message_uuid;
+
+    if not found then
+        return false;
+    end if;
+
+    insert into public."Locations" (location_message_uuid, latitude, longitude, city, captured_at)
+    values (p_message_uuid, p_latitude, p_longitude, p_city, p_captured_at)
+    on conflict (location_message_uuid) do update
+        set latitude = excluded.latitude,
+            longitude = excluded.longitude,
+            city = excluded.city,
+            captured_at = excluded.captured_at;
+
+    return true;
+end;
+$$;
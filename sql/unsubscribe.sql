@@ -0,0 +1,24 @@
+-- Índices para las consultas de bajas:
+--  * email único: la comprobación puntual de /api/unsubscribe y el upsert
+--    de insert_unsubscribe (on conflict (email) do nothing). Sin él, una
+--    baja que el conjunto local aún no ve (la sincronización incremental
+--    por id puede saltarse una fila que se confirma tarde) se insertaba
+--    de nuevo.
+--  * sincronización incremental por id del conjunto local (unsubscribes.py),
+--    que usa la clave primaria
+
+-- Antes de crear el índice único se eliminan los duplicados existentes
+-- (se conserva la primera baja de cada email). El bloqueo evita que entren
+-- duplicados nuevos entre la limpieza y la creación del índice.
+begin;
+
+lock table public."Unsubscribe" in share row exclusive mode;
+
+delete from public."Unsubscribe" u
+ using public."Unsubscribe" earlier
+ where u.email = earlier.email
+   and u.id > earlier.id;
+
+create unique index if not exists "Unsubscribe_email_key" on public."Unsubscribe" (email);
+
+commit;
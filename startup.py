@@ -0,0 +1,64 @@
+import re
+import subprocess
+import sys
+import time
+
+from clients import get_genai, get_resend, get_stripe, get_vonage
+from logger import get_logger
+
+log = get_logger(__name__)
+
+
+# Precalienta un worker: inicia sesión en Supabase y crea los clientes SDK.
+# Pensado para el hook `post_fork` de gunicorn (ver gunicorn.conf.py); los
+# errores se informan pero no impiden arrancar, ya que todo es perezoso.
+def warmup() -> dict:
+    from db import refresh_if_needed
+
+    timings = {}
+    for name, step in (("supabase", refresh_if_needed), ("stripe", get_stripe),
+                       ("resend", get_resend), ("genai", get_genai),
+                       ("vonage", get_vonage)):
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            log.warning("Error en el precalentamiento", extra={"client": name, "error": str(e)})
+        timings[name] = round((time.perf_counter() - start) * 1000, 2)
+    return timings
+
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+# Ejecuta `python -X importtime -c "import <module>"` en un proceso aparte y
+# devuelve el tiempo total y los módulos con mayor tiempo acumulado.
+def import_time_report(module: str = "app", top: int = 20) -> dict:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append({
+                "module": name,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+                "depth": (len(indent) - 1) // 2,
+            })
+
+    entries.sort(key=lambda e: e["cumulative_ms"], reverse=True)
+    return {
+        "module": module,
+        "returncode": proc.returncode,
+        "wall_ms": round(wall_ms, 2),
+        "import_ms": round(sum(e["self_ms"] for e in entries), 2),
+        "top": entries[:top],
+        "error": proc.stderr.strip().splitlines()[-1] if proc.returncode else None,
+    }
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+
+# Los módulos de la app leen config al importarse: el entorno de pruebas se
+# fija aquí, antes de que ningún test los importe.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+os.environ.setdefault("LOCAL_DATA_DIR", tempfile.mkdtemp(prefix="tests-"))
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ.setdefault("SECRET_API", "test-api-key")
+os.environ.setdefault("SECRET_JWT", "test-jwt-secret-" + "x" * 32)
+os.environ.setdefault("VONAGE_DLR_TOKEN", "test-dlr-token")
+
+import threading  # noqa: E402
+import pytest  # noqa: E402
+
+
+class RecordingExecutor:
+    """Sustituto de ThreadPoolExecutor que solo anota lo enviado."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+
+
+@pytest.fixture
+def executor():
+    return RecordingExecutor()
+
+
+@pytest.fixture(scope="session")
+def fake_services():
+    """Conecta los servicios falsos de benchmarks/fakes.py (sin latencia) y devuelve la BD en memoria.
+
+    Una sola BD para toda la sesión: los clientes del pool de db quedan ligados
+    a ella. Cada test siembra sus propios usuarios.
+    """
+    import fakes
+    fakes.configure(latency={name: 0 for name in fakes.SERVICES})
+    return fakes.install()
+
+
+@pytest.fixture(scope="session")
+def client(fake_services):
+    from app import app
+    return app.test_client()
+
+
+@pytest.fixture(scope="session")
+def auth_header(client):
+    """Cabecera Authorization con un JWT válido para el id de usuario dado."""
+    from app import app
+    from flask_jwt_extended import create_access_token
+
+    def make(user_id) -> dict:
+        with app.app_context():
+            return {"Authorization": f"Bearer {create_access_token(identity=str(user_id))}"}
+    return make
+
+
+@pytest.fixture
+def slots():
+    return threading.BoundedSemaphore(2)
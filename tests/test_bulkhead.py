@@ -0,0 +1,86 @@
+import time
+from types import SimpleNamespace
+import pytest
+import chatbot
+from bulkhead import Bulkhead, CallTimeout, CircuitOpen
+
+
+def _bulkhead(**kwargs) -> Bulkhead:
+    options = dict(max_concurrent=4, max_queue=0, queue_timeout=0, call_timeout=None,
+                   failure_threshold=1, reset_timeout=0.05)
+    options.update(kwargs)
+    return Bulkhead("test", **options)
+
+
+def test_slow_success_does_not_close_open_circuit():
+    bulkhead = _bulkhead()
+    slow = bulkhead.acquire()  # llamada lenta que empieza con el circuito cerrado
+    bulkhead.release(bulkhead.acquire(), RuntimeError("caída"))
+    assert bulkhead.state == "open"
+
+    bulkhead.release(slow)  # termina bien la llamada lenta
+    assert bulkhead.state == "open"
+    with pytest.raises(CircuitOpen):
+        bulkhead.acquire()
+
+    # Pasado reset_timeout, la llamada de prueba sí lo cierra
+    time.sleep(0.06)
+    trial = bulkhead.acquire()
+    assert bulkhead.state == "half_open"
+    bulkhead.release(trial)
+    assert bulkhead.state == "closed"
+
+
+def test_only_the_trial_call_ends_the_half_open_state():
+    bulkhead = _bulkhead()
+    slow_ok, slow_failing = bulkhead.acquire(), bulkhead.acquire()
+    bulkhead.release(bulkhead.acquire(), RuntimeError("caída"))
+    time.sleep(0.06)
+    trial = bulkhead.acquire()
+    assert trial.trial and not slow_ok.trial
+
+    # Las llamadas anteriores terminan mientras la de prueba sigue en curso
+    bulkhead.release(slow_ok)
+    bulkhead.release(slow_failing, RuntimeError("caída"))
+    assert bulkhead.state == "half_open"
+    with pytest.raises(CircuitOpen):
+        bulkhead.acquire()
+
+    bulkhead.release(trial, RuntimeError("caída"))
+    assert bulkhead.state == "open"
+
+
+def test_expired_permit_is_released_once():
+    bulkhead = _bulkhead(max_concurrent=1, failure_threshold=5)
+    permit = bulkhead.acquire()
+    bulkhead.expire_after(permit, 0.01, "stream").join()
+    assert (bulkhead.in_flight, bulkhead.timeouts, permit.released) == (0, 1, True)
+
+    bulkhead.release(permit)  # el dueño cierra después: no libera dos veces
+    assert bulkhead.in_flight == 0
+    bulkhead.release(bulkhead.acquire())
+
+
+def test_stalled_stream_gives_back_its_gemini_permit(monkeypatch):
+    gemini = _bulkhead(max_concurrent=1, failure_threshold=5)
+    monkeypatch.setitem(chatbot.bulkheads, "gemini", gemini)
+    monkeypatch.setattr(chatbot.config, "CHAT_STREAM_TIMEOUT", 0.05)
+
+    def stream(**kwargs):
+        yield SimpleNamespace(text="Hola ")
+        time.sleep(0.1)  # Gemini (o el cliente) se atasca
+        yield SimpleNamespace(text="mundo")
+
+    monkeypatch.setattr(chatbot, "get_genai", lambda: SimpleNamespace(
+        models=SimpleNamespace(generate_content_stream=stream)))
+    chunks = chatbot.stream_answer("mensaje que se atasca")
+    received = []
+    with pytest.raises(CallTimeout):
+        for text in chunks:
+            received.append(text)
+    assert received == ["Hola "]
+    assert (gemini.in_flight, gemini.timeouts) == (0, 1)
+
+    chunks.close()
+    assert gemini.in_flight == 0
+    assert chatbot.chat_cache.get(chatbot.cache_key("mensaje que se atasca")) is None
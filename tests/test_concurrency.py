@@ -0,0 +1,25 @@
+import logging
+from concurrency import branch, run_parallel
+
+
+def test_branches_use_the_pool_and_keep_the_request_id(client, caplog):
+    import db
+    from flask import g
+    from app import app
+
+    def read(tag):
+        db.get_client()
+        logging.getLogger("quickgeo.tests").warning(tag)
+        return g.get("request_id"), db.pool.stats()["in_use"]
+
+    checkouts = db.pool.stats()["checkouts"]
+    with caplog.at_level(logging.WARNING, logger="quickgeo.tests"):
+        with app.test_request_context("/api/unsubscribe", headers={"X-Request-ID": "req-123"}):
+            app.preprocess_request()
+            results = run_parallel(branch(read, "a"), branch(read, "b"))
+
+    assert [request_id for request_id, _ in results] == ["req-123", "req-123"]
+    assert all(in_use >= 1 for _, in_use in results)
+    assert db.pool.stats()["checkouts"] == checkouts + 2
+    assert db.pool.stats()["in_use"] == 0
+    assert [getattr(record, "request_id", None) for record in caplog.records] == ["req-123", "req-123"]
@@ -0,0 +1,64 @@
+import sqlite3
+import threading
+import pytest
+import outbox
+import webhook_events
+
+# El despachador del outbox y el procesador de eventos de Stripe reservan un
+# hueco del pool antes de reclamar trabajo: si reclamar o encolar falla, el
+# hueco se tiene que devolver o el proceso deja de despachar.
+DISPATCHERS = [(outbox, "_dispatch_once"), (webhook_events, "_process_once")]
+
+
+@pytest.mark.parametrize("module, dispatch", DISPATCHERS)
+def test_failed_claim_releases_slot(module, dispatch, slots, executor, monkeypatch):
+    monkeypatch.setattr(module, "_slots", slots)
+    monkeypatch.setattr(module, "_executor", executor)
+
+    def locked(limit):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(module, "_claim", locked)
+    for _ in range(3):
+        with pytest.raises(sqlite3.OperationalError):
+            getattr(module, dispatch)()
+
+    # Con los dos huecos libres se sigue reclamando al recuperarse SQLite
+    batches = [[{"id": 1}], [{"id": 2}], []]
+    monkeypatch.setattr(module, "_claim", lambda limit: batches.pop(0))
+    getattr(module, dispatch)()
+    assert len(executor.submitted) == 2
+
+
+@pytest.mark.parametrize("module, dispatch", DISPATCHERS)
+def test_failed_submit_releases_slot(module, dispatch, monkeypatch):
+    class Broken:
+        def submit(self, fn, *args):
+            raise RuntimeError("cannot schedule new futures after shutdown")
+
+    slot = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(module, "_slots", slot)
+    monkeypatch.setattr(module, "_executor", Broken())
+    monkeypatch.setattr(module, "_claim", lambda limit: [{"id": 1}])
+    with pytest.raises(RuntimeError):
+        getattr(module, dispatch)()
+    assert slot.acquire(blocking=False)
+
+
+@pytest.mark.parametrize("module, loop", [(outbox, "_dispatch_loop"), (webhook_events, "_process_loop")])
+def test_loop_exits_quietly_once_the_pool_is_shut_down(module, loop, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    pool = ThreadPoolExecutor(1)
+    pool.shutdown()
+    monkeypatch.setattr(module, "_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(module, "_executor", pool)
+    monkeypatch.setattr(module, "_claim", lambda limit: [{"id": 1}])
+    errors = []
+    monkeypatch.setattr(module.log, "exception", lambda *args, **kwargs: errors.append(args))
+    # Sin esperar al evento real, que también escucha el hilo de la app si ya arrancó
+    monkeypatch.setattr(module, "_wakeup", type("Ready", (), {"wait": lambda self, t: True, "clear": lambda self: None})())
+    thread = threading.Thread(target=getattr(module, loop), daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive() and errors == []
@@ -0,0 +1,54 @@
+import base64
+import json
+import pytest
+from service import decode_cursor, encode_cursor
+
+
+def _cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trip():
+    row = {"created_at": "2024-03-01T10:00:00", "id": 42}
+    assert decode_cursor(encode_cursor(row)) == ("2024-03-01T10:00:00", 42)
+
+
+@pytest.mark.parametrize("cursor", [
+    "%%%",                                      # no es base64
+    base64.urlsafe_b64encode(b"{").decode(),    # no es JSON
+    _cursor({"created_at": "2024-03-01"}),      # no es una lista
+    _cursor(["2024-03-01T10:00:00"]),           # falta el id
+    _cursor(["2024-03-01T10:00:00", "42"]),     # id no entero
+    _cursor(["2024-03-01T10:00:00", True]),     # bool no vale como id
+    _cursor(["ayer", 42]),                      # fecha no ISO
+    _cursor(['2024-03-01",id.gt.0', 42]),       # intento de inyectar en el filtro
+])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def _history(client, headers, **params):
+    response = client.get("/api/location-requests", query_string=params, headers=headers)
+    assert response.status_code == 200
+    return response
+
+
+def test_ndjson_pages_from_the_cursor(client, fake_services, auth_header):
+    user = fake_services.seed(users=1, requests_per_user=7)["users"][0]
+    headers = auth_header(user["id"])
+    first = _history(client, headers, limit=3).get_json()["details"]
+    rest = _history(client, headers, limit=3, cursor=first["next_cursor"]).get_json()["details"]["history"]
+
+    lines = [json.loads(line) for line in _history(client, headers, limit=3, format="ndjson",
+                                                     cursor=first["next_cursor"]).data.splitlines()]
+    assert "credits" in lines[0]
+    assert [row["id"] for row in lines[1:]][:3] == [row["id"] for row in rest]
+    assert len(lines) - 1 == 7 - 3
+
+
+def test_ndjson_rejects_a_malformed_cursor(client, fake_services, auth_header):
+    user = fake_services.seed(users=1, requests_per_user=1)["users"][0]
+    response = client.get("/api/location-requests", query_string={"format": "ndjson", "cursor": "%%%"},
+                          headers=auth_header(user["id"]))
+    assert response.status_code == 400
@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+import time
+import metrics
+
+DEAD_PID = 4_000_000  # por encima de pid_max: nunca está vivo
+ROUTE = "/tests/dead-worker"  # etiqueta propia: otros tests también generan métricas
+
+
+def _dead_worker(requests: int) -> None:
+    labels = [["route", ROUTE], ["method", "POST"], ["status", "200"]]
+    series = [requests] + [0] * len(metrics.BUCKETS) + [0.001 * requests]
+    snapshot = {
+        "histograms": [["http_request_duration_seconds", labels, series]],
+        "values": [["dependency_errors_total", [["dependency", ROUTE]], requests],
+                   ["http_requests_in_flight", [["route", ROUTE]], 3]],
+    }
+    metrics._db().execute("INSERT OR REPLACE INTO metrics (pid, snapshot, updated_at) VALUES (?, ?, ?)",
+                          (DEAD_PID, json.dumps(snapshot), time.time()))
+
+
+def _totals():
+    histograms, values = metrics.collect()
+    ours = lambda name, labels: ROUTE in dict(labels).values()
+    requests = sum(series[0] for (name, labels), series in histograms.items()
+                   if name == "http_request_duration_seconds" and ours(name, labels))
+    errors = sum(v for (name, labels), v in values.items() if name == "dependency_errors_total" and ours(name, labels))
+    in_flight = sum(v for (name, labels), v in values.items() if name == "http_requests_in_flight" and ours(name, labels))
+    return requests, errors, in_flight
+
+
+def test_dead_worker_counters_are_kept():
+    _dead_worker(5)
+    # El worker ya no existe: sus counters siguen en el total, su gauge no
+    assert _totals() == (5, 5, 0)
+    assert _totals() == (5, 5, 0)
+    # Un segundo worker reciclado (mismo pid reutilizado) se suma a lo anterior
+    _dead_worker(2)
+    metrics.collect()
+    assert _totals() == (7, 7, 0)
+
+
+def _stored(pid: int) -> list:
+    row = metrics._db().execute("SELECT snapshot FROM metrics WHERE pid = ?", (pid,)).fetchone()
+    return json.loads(row["snapshot"])["values"] if row else []
+
+
+def test_background_counts_are_flushed_without_requests(monkeypatch):
+    monkeypatch.setattr(metrics.config, "METRICS_FLUSH_INTERVAL", 0.01)
+    # Un trabajo en segundo plano cuenta un timeout; no hay ninguna petición
+    labels = (("dependency", ROUTE), ("operation", "background"))
+    metrics.registry.add("dependency_timeouts_total", labels)
+    threading.Thread(target=metrics._flush_loop, daemon=True).start()
+    expected = ["dependency_timeouts_total", [list(pair) for pair in labels], 1]
+    deadline = time.monotonic() + 2
+    while expected not in _stored(os.getpid()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert expected in _stored(os.getpid())
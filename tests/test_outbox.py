@@ -0,0 +1,105 @@
+import threading
+from types import SimpleNamespace
+import pytest
+import outbox
+from bulkhead import BulkheadFull
+
+
+class InvalidPayload(Exception):
+    code = 422
+
+
+class Resend:
+    """Resend falso: anota cada llamada con su idempotency key."""
+
+    def __init__(self, batch_error=None, bad_recipient=None):
+        self.calls = []
+        self.batch_error = batch_error
+        self.bad_recipient = bad_recipient
+        self.Emails = SimpleNamespace(send=self._send)
+        self.Batch = SimpleNamespace(send=self._batch)
+
+    def _send(self, params, options):
+        self.calls.append(("send", [params["to"]], options["idempotency_key"]))
+        if params["to"] == self.bad_recipient:
+            raise InvalidPayload("invalid `to` field")
+
+    def _batch(self, payloads, options):
+        self.calls.append(("batch", [params["to"] for params in payloads], options["idempotency_key"]))
+        if self.batch_error:
+            raise self.batch_error
+
+
+@pytest.fixture(autouse=True)
+def queue(monkeypatch):
+    # Si otro test ya arrancó el despachador, que no reclame los mensajes de estos
+    monkeypatch.setattr(outbox, "_dispatch_once", lambda: None)
+    outbox._db().execute("DELETE FROM outbox")
+    monkeypatch.setattr(outbox, "_slots", threading.BoundedSemaphore(8))
+    monkeypatch.setattr(outbox, "ensure_started", lambda: None)
+
+
+def _enqueue(*recipients) -> list:
+    return [outbox.enqueue({"to": to, "html": "contraseña"}) for to in recipients]
+
+
+def _send_due(resend, monkeypatch) -> None:
+    monkeypatch.setattr(outbox, "get_resend", lambda: resend)
+    outbox._db().execute("UPDATE outbox SET next_attempt_at = 0 WHERE status = 'pending'")
+    outbox._slots.acquire()
+    outbox._send(outbox._claim(10))
+
+
+def _rows() -> dict:
+    rows = outbox._db().execute("SELECT id, status, attempts, payload, batch_key FROM outbox").fetchall()
+    return {row["id"]: row for row in rows}
+
+
+def test_sent_rows_drop_payload_and_rejections_do_not_count(monkeypatch):
+    sent_id, = _enqueue("a@example.com")
+    resend = Resend()
+    _send_due(resend, monkeypatch)
+    assert resend.calls == [("send", ["a@example.com"], f"outbox-{sent_id}")]
+    assert (_rows()[sent_id]["status"], _rows()[sent_id]["payload"]) == ("sent", None)
+
+    def full(*args, **kwargs):
+        raise BulkheadFull("resend", "full", 5)
+
+    rejected_id, = _enqueue("b@example.com")
+    monkeypatch.setattr(outbox.bulkheads["resend"], "call", full)
+    _send_due(resend, monkeypatch)
+    row = _rows()[rejected_id]
+    assert (row["status"], row["attempts"]) == ("pending", 0)
+    assert row["payload"] is not None
+
+
+def test_rejected_batch_falls_back_to_single_sends(monkeypatch):
+    good, bad = _enqueue("a@example.com", "not-an-email")
+    resend = Resend(batch_error=InvalidPayload("invalid `to` field"), bad_recipient="not-an-email")
+    _send_due(resend, monkeypatch)
+    assert [call[0] for call in resend.calls] == ["batch", "send", "send"]
+    rows = _rows()
+    assert rows[good]["status"] == "sent"
+    assert (rows[bad]["status"], rows[bad]["attempts"], rows[bad]["batch_key"]) == ("pending", 1, None)
+
+    # El mensaje malo se reintenta solo, sin arrastrar al resto
+    resend.calls.clear()
+    _send_due(resend, monkeypatch)
+    assert resend.calls == [("send", ["not-an-email"], f"outbox-{bad}")]
+
+
+def test_ambiguous_batch_failure_retries_the_same_batch_and_key(monkeypatch):
+    first, second = _enqueue("a@example.com", "b@example.com")
+    resend = Resend(batch_error=TimeoutError("read timeout"))
+    _send_due(resend, monkeypatch)
+    (_, recipients, key), = resend.calls
+    assert {row["batch_key"] for row in _rows().values()} == {key}
+
+    # Aunque el reclamo solo alcance a uno, el lote se reenvía completo con la misma clave
+    resend.batch_error = None
+    outbox._db().execute("UPDATE outbox SET next_attempt_at = 0")
+    monkeypatch.setattr(outbox, "get_resend", lambda: resend)
+    outbox._slots.acquire()
+    outbox._send(outbox._claim(1))
+    assert resend.calls[1] == ("batch", recipients, key)
+    assert {row["status"] for row in _rows().values()} == {"sent"}
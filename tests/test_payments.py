@@ -0,0 +1,69 @@
+import pytest
+import payments
+from clients import get_stripe
+
+
+@pytest.fixture(autouse=True)
+def stripe_calls(monkeypatch, fake_services):
+    payments.checkout_responses.clear()
+    payments.stripe_customers.clear()
+    monkeypatch.setattr(payments, "_queue_pending_order", lambda *args: None)
+    calls = []
+    stripe = get_stripe()
+    for resource in ("Customer", "PaymentIntent"):
+        create = getattr(stripe, resource).create
+
+        def counted(resource=resource, create=create, **kwargs):
+            calls.append(resource)
+            return create(**kwargs)
+        monkeypatch.setattr(getattr(stripe, resource), "create", counted)
+    return calls
+
+
+def _checkout(client, email, payment_method, key=None, headers=None):
+    headers = dict(headers or {})
+    if key:
+        headers["Idempotency-Key"] = key
+    response = client.post("/api/checkout", headers=headers,
+                           json={"paymentMethodId": payment_method, "name": "Ana", "email": email})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_retry_returns_the_stored_response_without_calling_stripe(client, stripe_calls):
+    first = _checkout(client, "retry@example.com", "pm_1", key="k1")
+    assert _checkout(client, "retry@example.com", "pm_1", key="k1") == first
+    assert stripe_calls == ["Customer", "PaymentIntent"]
+
+    # Con la misma clave pero otro método de pago no se entrega la respuesta guardada
+    other = _checkout(client, "retry@example.com", "pm_2", key="k1")
+    assert other["clientSecret"] != first["clientSecret"]
+    assert other["customerId"] != first["customerId"]
+
+
+def test_anonymous_checkout_never_reuses_a_customer(client, stripe_calls):
+    first = _checkout(client, "victim@example.com", "pm_a")
+    second = _checkout(client, "victim@example.com", "pm_b")
+    assert first["customerId"] != second["customerId"]
+    assert payments.stripe_customers.get("victim@example.com") is None
+
+
+def test_authenticated_checkout_reuses_the_session_customer(client, fake_services, auth_header, stripe_calls):
+    user = fake_services.seed(users=1, requests_per_user=0, orders=0)["users"][0]
+    headers = auth_header(user["id"])
+    first = _checkout(client, user["email"].upper(), "pm_a", headers=headers)
+    second = _checkout(client, user["email"], "pm_b", headers=headers)
+    assert first["customerId"] == second["customerId"]
+    assert stripe_calls == ["Customer", "PaymentIntent", "PaymentIntent"]
+
+    # Un anónimo con el mismo email no recibe el cliente de ese usuario
+    assert _checkout(client, user["email"], "pm_c")["customerId"] != first["customerId"]
+
+
+def test_session_email_must_match_to_reuse(client, fake_services, auth_header):
+    owner, other = fake_services.seed(users=2, requests_per_user=0, orders=0)["users"]
+    with fake_services.lock:
+        owner["email"] = "owner@example.com"
+    owned = _checkout(client, "owner@example.com", "pm_b", headers=auth_header(owner["id"]))
+    assert _checkout(client, "owner@example.com", "pm_c", headers=auth_header(other["id"]))["customerId"] != owned["customerId"]
+    assert _checkout(client, "owner@example.com", "pm_d", headers=auth_header(owner["id"]))["customerId"] == owned["customerId"]
@@ -0,0 +1,26 @@
+import phone_info
+
+
+def test_language_case_does_not_change_the_cached_answer():
+    phone_info.phone_cache.clear()
+    upper = phone_info.lookup_phone_info("+49", "151 23456789", "DE")
+    assert upper["country"] == "Deutschland"
+    hits = phone_info.phone_cache.hits
+    assert phone_info.lookup_phone_info("+49", "15123456789", "de") is upper
+    assert phone_info.phone_cache.hits == hits + 1
+
+
+def test_batch_groups_misses_and_reports_errors_per_item():
+    phone_info.phone_cache.clear()
+    cached = phone_info.lookup_phone_info("+34", "600000000", "es")
+    results = phone_info.lookup_phone_info_batch([
+        ("+34", "600 000 000", "ES"),
+        ("+49", "15123456789", "DE"),
+        ("+49", "151-23456789", "de"),
+        ("+", "abc", "es"),
+    ])
+    assert results[0] is cached
+    assert results[1]["country"] == "Deutschland"
+    assert results[2] is results[1]
+    assert results[3]["status"] is False
+    assert phone_info.phone_cache.get(("+4915123456789", "de")) is results[1]
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+import pytest
+import ratelimit
+from ratelimit import Limit, RateLimited, RateLimiter
+
+
+@pytest.fixture
+def limiter():
+    limiter = RateLimiter("ratelimit-tests")
+    limiter.reset()
+    return limiter
+
+
+def test_a_denied_hit_consumes_from_no_bucket(limiter):
+    ip, user = Limit("ip", 3, 60), Limit("user", 1, 60)
+    limiter.hit("/r", [(ip, "1.2.3.4"), (user, "a")])
+    with pytest.raises(RateLimited) as denied:
+        limiter.hit("/r", [(ip, "1.2.3.4"), (user, "a")])
+    assert denied.value.scope == "user"
+    assert 50 < denied.value.retry_after <= 60
+
+    # El bucket "ip" sigue con 2 fichas: el rechazo no gastó ninguna
+    limiter.hit("/r", [(ip, "1.2.3.4"), (user, "b")])
+    limiter.hit("/r", [(ip, "1.2.3.4"), (user, "c")])
+    with pytest.raises(RateLimited) as denied:
+        limiter.hit("/r", [(ip, "1.2.3.4"), (user, "d")])
+    assert denied.value.scope == "ip"
+    assert (limiter.allowed, limiter.limited) == (3, 2)
+
+
+def test_buckets_refill_at_their_rate(limiter, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "time", lambda: clock[0])
+    limit = Limit("ip", 2, 10)
+    limiter.hit("/r", [(limit, "x")])
+    limiter.hit("/r", [(limit, "x")])
+    with pytest.raises(RateLimited):
+        limiter.hit("/r", [(limit, "x")])
+    clock[0] += 5  # una ficha cada 5 s
+    limiter.hit("/r", [(limit, "x")])
+    with pytest.raises(RateLimited):
+        limiter.hit("/r", [(limit, "x")])
+
+
+def _request(remote_addr, forwarded=None):
+    headers = {"X-Forwarded-For": forwarded} if forwarded else {}
+    return SimpleNamespace(remote_addr=remote_addr, headers=headers)
+
+
+@pytest.mark.parametrize("hops, forwarded, expected", [
+    (0, None, "10.0.0.1"),
+    (0, "6.6.6.6", "10.0.0.1"),                    # sin proxies la cabecera la pone el cliente
+    (1, "6.6.6.6, 203.0.113.7", "203.0.113.7"),    # la añadida por nuestro proxy
+    (2, "6.6.6.6, 203.0.113.7, 10.1.1.1", "203.0.113.7"),
+    (2, "203.0.113.7", "10.0.0.1"),                # no pasó por todos los proxies
+])
+def test_client_ip(monkeypatch, hops, forwarded, expected):
+    monkeypatch.setattr(ratelimit.config, "RATE_LIMIT_PROXY_HOPS", hops)
+    assert ratelimit._client_ip(_request("10.0.0.1", forwarded)) == expected
+
+
+def test_login_is_limited_per_ip_even_with_rotating_emails(client, fake_services):
+    ratelimit.limiter.reset()
+
+    def login(n, address):
+        return client.post("/api/login", json={"email": f"rota{n}@example.com", "password": "x"},
+                           environ_base={"REMOTE_ADDR": address})
+
+    statuses = [login(n, "198.51.100.1").status_code for n in range(21)]
+    assert 429 not in statuses[:20]
+    assert statuses[20] == 429
+    assert login(21, "198.51.100.1").get_json()["scope"] == "ip"
+    assert login(22, "198.51.100.2").status_code != 429
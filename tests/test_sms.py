@@ -0,0 +1,162 @@
+import threading
+import uuid
+from types import SimpleNamespace
+import pytest
+import sms
+from bulkhead import CallTimeout
+
+DLR_TOKEN = "test-dlr-token"
+resolve_pending = sms._resolve_pending
+
+
+class Vonage:
+    """Vonage falso: responde con el status dado o lanza la excepción dada."""
+
+    def __init__(self, status="0", error=None):
+        self.status = status
+        self.error = error
+        self.sent = []
+        self.sms = SimpleNamespace(send=self._send)
+
+    def _send(self, message):
+        self.sent.append(message.client_ref)
+        if self.error:
+            raise self.error
+        return SimpleNamespace(messages=[SimpleNamespace(status=self.status, error_text="Throttled")])
+
+
+@pytest.fixture(autouse=True)
+def queue(monkeypatch, fake_services):
+    # Si otro test ya arrancó el despachador, que no reclame los SMS de estos
+    monkeypatch.setattr(sms, "_dispatch_once", lambda: None)
+    monkeypatch.setattr(sms, "_resolve_pending", lambda: None)
+    sms._db().execute("DELETE FROM sms_queue")
+    monkeypatch.setattr(sms, "_slots", threading.BoundedSemaphore(4))
+    monkeypatch.setattr(sms, "ensure_started", lambda: None)
+    monkeypatch.setattr(sms.config, "VONAGE_DLR_TOKEN", DLR_TOKEN)
+
+
+@pytest.fixture
+def request_sms(fake_services):
+    """Solicitud registrada con SMS_QUEUED y el crédito ya consumido (credits=0)."""
+    def make() -> tuple:
+        user = fake_services.seed(users=1, requests_per_user=0, credits=0, orders=0)["users"][0]
+        message_uuid = str(uuid.uuid4())
+        with fake_services.lock:
+            fake_services.insert("LocationRequests", {
+                "message_uuid": message_uuid, "status": False, "smsstatus": sms.SMS_QUEUED,
+                "created_at": "2024-01-01T10:00:00", "codephone": "+34", "phonenumber": "600000000",
+                "codecountry": "ES", "user_id": str(user["id"]),
+            })
+        sms.enqueue(message_uuid, "+34", "600000000")
+        return user, message_uuid
+    return make
+
+
+def _send_due(vonage, monkeypatch) -> None:
+    monkeypatch.setattr(sms, "get_vonage", lambda: vonage)
+    sms._db().execute("UPDATE sms_queue SET next_attempt_at = 0 WHERE status = 'pending'")
+    for row in sms._claim():
+        sms._slots.acquire()
+        sms._run(row)
+
+
+def _state(fake_services, user, message_uuid) -> tuple:
+    request = next(r for r in fake_services.tables["LocationRequests"] if r["message_uuid"] == message_uuid)
+    return request["smsstatus"], user["credits"]
+
+
+def _queued() -> dict:
+    rows = sms._db().execute("SELECT message_uuid, status FROM sms_queue").fetchall()
+    return {row["message_uuid"]: row["status"] for row in rows}
+
+
+def _receipt(client, message_uuid, status, token=DLR_TOKEN):
+    return client.post("/webhook/vonage-dlr", query_string={"token": token},
+                       json={"client-ref": message_uuid, "status": status})
+
+
+def test_rejected_by_vonage_refunds_once(monkeypatch, fake_services, request_sms, client):
+    user, message_uuid = request_sms()
+    _send_due(Vonage(status="1"), monkeypatch)
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_REJECTED, 1)
+    assert message_uuid not in _queued()
+
+    # Un recibo fallido posterior no vuelve a devolver el crédito
+    assert _receipt(client, message_uuid, "failed").status_code == 204
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_REJECTED, 1)
+
+
+def test_failed_receipt_refunds_an_accepted_sms(monkeypatch, fake_services, request_sms, client):
+    user, message_uuid = request_sms()
+    _send_due(Vonage(), monkeypatch)
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_SENT, 0)
+
+    assert _receipt(client, message_uuid, "delivered").status_code == 204
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_SENT, 0)
+    assert _receipt(client, message_uuid, "failed").status_code == 204
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_REJECTED, 1)
+    assert _receipt(client, message_uuid, "expired").status_code == 204
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_REJECTED, 1)
+
+
+def test_timeout_waits_for_the_receipt_without_refunding(monkeypatch, fake_services, request_sms, client):
+    user, message_uuid = request_sms()
+    vonage = Vonage(error=CallTimeout("vonage: timeout"))
+    _send_due(vonage, monkeypatch)
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_QUEUED, 0)
+    assert _queued()[message_uuid] == "awaiting_receipt"
+
+    # No se reenvía: puede que el SMS saliera
+    _send_due(vonage, monkeypatch)
+    assert vonage.sent == [message_uuid]
+
+    assert _receipt(client, message_uuid, "delivered").status_code == 204
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_SENT, 0)
+
+
+def test_timeout_without_receipt_expires_and_refunds(monkeypatch, fake_services, request_sms):
+    user, message_uuid = request_sms()
+    _send_due(Vonage(error=CallTimeout("vonage: timeout")), monkeypatch)
+    sms._db().execute("UPDATE sms_queue SET next_attempt_at = 0")
+    resolve_pending()
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_ERROR, 1)
+    assert message_uuid not in _queued()
+
+
+def test_errors_retry_then_give_up_with_a_refund(monkeypatch, fake_services, request_sms):
+    monkeypatch.setattr(sms.config, "SMS_MAX_ATTEMPTS", 2)
+    user, message_uuid = request_sms()
+    vonage = Vonage(error=ConnectionError("reset"))
+    _send_due(vonage, monkeypatch)
+    assert (_queued()[message_uuid], _state(fake_services, user, message_uuid)) == ("pending", (sms.SMS_QUEUED, 0))
+    _send_due(vonage, monkeypatch)
+    assert vonage.sent == [message_uuid, message_uuid]
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_ERROR, 1)
+
+
+def test_result_is_kept_until_supabase_accepts_it(monkeypatch, fake_services, request_sms):
+    user, message_uuid = request_sms()
+    update_sms_status = sms.update_sms_status
+
+    def down(*args, **kwargs):
+        raise ConnectionError("supabase caído")
+
+    monkeypatch.setattr(sms, "update_sms_status", down)
+    _send_due(Vonage(status="1"), monkeypatch)
+    assert _queued()[message_uuid] == "resolving"
+
+    monkeypatch.setattr(sms, "update_sms_status", update_sms_status)
+    sms._db().execute("UPDATE sms_queue SET next_attempt_at = 0")
+    resolve_pending()
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_REJECTED, 1)
+
+
+@pytest.mark.parametrize("token", [None, "", "otro"])
+def test_receipt_requires_the_token(client, fake_services, request_sms, token):
+    user, message_uuid = request_sms()
+    query = {} if token is None else {"token": token}
+    response = client.post("/webhook/vonage-dlr", query_string=query,
+                           json={"client-ref": message_uuid, "status": "failed"})
+    assert response.status_code == 403
+    assert _state(fake_services, user, message_uuid) == (sms.SMS_QUEUED, 0)
@@ -0,0 +1,9 @@
+def test_repeated_unsubscribe_keeps_one_row(client, fake_services):
+    from app import app
+    from service import insert_unsubscribe
+
+    with app.app_context():
+        insert_unsubscribe("baja@example.com")
+        insert_unsubscribe("baja@example.com")
+    rows = [row for row in fake_services.tables["Unsubscribe"] if row["email"] == "baja@example.com"]
+    assert len(rows) == 1
@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrency import once_per_process
+from db import execute, get_client
+import config
+from logger import get_logger
+
+log = get_logger(__name__)
+
+# Conjunto en memoria de los emails dados de baja. Se sincroniza de forma
+# incremental (filas con id mayor al último visto), así el caso común
+# "no está dado de baja" se responde sin consultar la BD y el costo no crece
+# con el tamaño de la tabla Unsubscribe. Cada cierto tiempo se recarga
+# completo para reflejar bajas eliminadas y las filas que la sincronización
+# incremental se salta (un id menor confirmado después de otro mayor); hasta
+# entonces una baja puede no verse aquí, pero insert_unsubscribe no la
+# duplica (índice único sobre email). La sincronización corre en un hilo
+# por proceso (como la renovación del token en db.py): ninguna petición
+# espera a que se descargue la tabla, solo lee el conjunto.
+
+_PAGE_SIZE = 1000
+
+
+class IndexNotReady(Exception):
+    """El conjunto aún no está cargado en este proceso (o lleva demasiado sin sincronizarse)."""
+
+
+class UnsubscribeIndex:
+    def __init__(self, sync_interval: float, full_resync_interval: float):
+        self.sync_interval = sync_interval
+        self.full_resync_interval = full_resync_interval
+        self._emails = set()
+        self._last_id = 0
+        self._synced_at = None
+        self._full_synced_at = None
+        self._wakeup = threading.Event()
+        self.syncs = 0
+        self.rows_loaded = 0
+
+    def _fetch_since(self, client_supabase, last_id: int) -> list:
+        query = client_supabase.table("Unsubscribe").select("id, email").gt("id", last_id).order("id").limit(_PAGE_SIZE)
+        response = execute(query, "Unsubscribe.sync")
+        return response.data or []
+
+    def sync(self, client_supabase, full: bool = False) -> None:
+        """Trae las bajas nuevas desde el último id (o todas si full=True)."""
+        emails = set() if full else self._emails
+        last_id = 0 if full else self._last_id
+        while True:
+            rows = self._fetch_since(client_supabase, last_id)
+            for row in rows:
+                emails.add(row["email"].lower())
+                last_id = max(last_id, row["id"])
+            self.rows_loaded += len(rows)
+            if len(rows) < _PAGE_SIZE:
+                break
+        now = time.monotonic()
+        self._emails = emails
+        self._last_id = last_id
+        self._synced_at = now
+        if full:
+            self._full_synced_at = now
+        self.syncs += 1
+
+    def _sync_loop(self) -> None:
+        while True:
+            try:
+                now = time.monotonic()
+                full = self._full_synced_at is None or now - self._full_synced_at >= self.full_resync_interval
+                self.sync(get_client(), full=full)
+            except Exception as e:
+                log.exception("Error sincronizando las bajas")
+            self._wakeup.wait(self.sync_interval)
+            self._wakeup.clear()
+
+    def _start(self) -> None:
+        # Lo heredado del master no vale tras el fork: se carga de nuevo
+        self._synced_at = self._full_synced_at = None
+        threading.Thread(target=self._sync_loop, name="unsubscribes-sync", daemon=True).start()
+
+    def ensure_started(self) -> None:
+        """Arranca el hilo de sincronización del proceso actual (una vez por pid)."""
+        once_per_process("unsubscribes-sync", self._start)
+
+    def contains(self, email: str) -> bool:
+        """Consulta el conjunto local; lanza IndexNotReady hasta la primera carga o si está desfasado."""
+        self.ensure_started()
+        # Si las sincronizaciones fallan durante mucho tiempo no se confía en el conjunto
+        if self._full_synced_at is None or time.monotonic() - self._synced_at >= self.full_resync_interval:
+            raise IndexNotReady()
+        return email.lower() in self._emails
+
+    def add(self, email: str) -> None:
+        """Registra una baja recién insertada por este proceso."""
+        self._emails.add(email.lower())
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._emails),
+            "last_id": self._last_id,
+            "syncs": self.syncs,
+            "rows_loaded": self.rows_loaded,
+            "age_s": round(time.monotonic() - self._synced_at, 1) if self._synced_at is not None else None,
+        }
+
+
+unsubscribe_index = UnsubscribeIndex(config.UNSUBSCRIBE_SYNC_INTERVAL, config.UNSUBSCRIBE_FULL_RESYNC_INTERVAL)
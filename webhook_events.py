@@ -0,0 +1,243 @@
+import json
+import os
+import threading
+import time
+import uuid
+from bulkhead import bulkheads
+from clients import get_stripe
+from concurrency import is_shutdown_error, once_per_process, per_process_executor
+from payments import flush_pending_order
+from service import create_user, mark_order_as_paid
+import config
+import local_store
+from logger import get_logger
+
+log = get_logger(__name__)
+
+# Pipeline de eventos de Stripe. /webhook solo verifica la firma y guarda el
+# evento (deduplicado por event.id); un procesador en segundo plano ejecuta
+# después la suscripción, la orden y el usuario. Cada paso completado queda
+# registrado en `steps`, así un reintento retoma desde el paso que falló y
+# no repite los anteriores.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stripe_events (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    steps TEXT NOT NULL DEFAULT '{}',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    received_at REAL NOT NULL,
+    processed_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS stripe_events_due ON stripe_events (status, next_attempt_at);
+"""
+
+_STALE_CLAIM_SECONDS = 300
+
+_wakeup = threading.Event()
+_slots = threading.BoundedSemaphore(max(1, config.WEBHOOK_WORKERS))
+_executor = None
+
+
+def _db():
+    return local_store.connect("stripe_events", _SCHEMA)
+
+
+def record(event, payload: bytes) -> bool:
+    """Guarda el evento verificado. Devuelve False si ya se había recibido (reintento de Stripe)."""
+    now = time.time()
+    cursor = _db().execute(
+        "INSERT OR IGNORE INTO stripe_events (id, type, payload, next_attempt_at, received_at) VALUES (?, ?, ?, ?, ?)",
+        (event["id"], event["type"], payload.decode("utf-8"), now, now)
+    )
+    if cursor.rowcount:
+        ensure_started()
+        _wakeup.set()
+    return cursor.rowcount > 0
+
+
+def _handle_payment_succeeded(event_id: str, event: dict, steps: dict) -> None:
+    payment_intent = event["data"]["object"]
+    payment_id = payment_intent["id"]
+    customer_id = payment_intent.get("customer")
+
+    # 🔑 Crear suscripción; la idempotency key evita duplicarla si el
+    # proceso cae entre la llamada a Stripe y el registro del paso.
+    if "subscription" not in steps:
+        # Con un cliente reutilizado (payments.py) el método de pago del
+        # checkout no es el predeterminado del cliente: se indica aquí.
+        options = {"default_payment_method": payment_intent["payment_method"]} if payment_intent.get("payment_method") else {}
+        subscription = bulkheads["stripe"].call(
+            get_stripe().Subscription.create,
+            customer=customer_id,
+            items=[{"price": os.environ.get("PRICE_ID_STRIPE")}],
+            trial_period_days=1,
+            expand=["latest_invoice.payment_intent"],
+            idempotency_key=f"{event_id}-subscription",
+            **options
+        )
+        log.info("Suscripción creada", extra={"event_id": event_id, "subscription": subscription.id})
+        _save_steps(event_id, steps, subscription=subscription.id)
+
+    if "order" not in steps:
+        order = mark_order_as_paid(payment_id)
+        # El checkout pudo dejar el pedido aún en la cola local (payments.py)
+        if not order and flush_pending_order(payment_id):
+            order = mark_order_as_paid(payment_id)
+        if not order:
+            raise LookupError(f"No hay orden pendiente para payment_intent={payment_id}")
+        _save_steps(event_id, steps, order={"name": order["name"], "email": order["email"]})
+
+    if "user" not in steps:
+        result = create_user(steps["order"]["name"], steps["order"]["email"])
+        if not result["status"]:
+            raise RuntimeError(result["message"])
+        _save_steps(event_id, steps, user=result["message"])
+
+
+HANDLERS = {
+    "payment_intent.succeeded": _handle_payment_succeeded,
+}
+
+
+def _save_steps(event_id: str, steps: dict, **done) -> None:
+    steps.update(done)
+    _db().execute("UPDATE stripe_events SET steps = ? WHERE id = ?", (json.dumps(steps), event_id))
+
+
+def _claim(limit: int) -> list:
+    now = time.time()
+    claim_id = uuid.uuid4().hex
+    conn = _db()
+    conn.execute(
+        """UPDATE stripe_events SET status = 'processing', claimed_by = ?, claimed_at = ?
+           WHERE id IN (
+               SELECT id FROM stripe_events
+               WHERE (status = 'pending' AND next_attempt_at <= ?)
+                  OR (status = 'processing' AND claimed_at < ?)
+               ORDER BY received_at LIMIT ?)""",
+        (claim_id, now, now, now - _STALE_CLAIM_SECONDS, limit)
+    )
+    return conn.execute("SELECT * FROM stripe_events WHERE claimed_by = ?", (claim_id,)).fetchall()
+
+
+def process(row) -> str:
+    """Procesa un evento reclamado y devuelve su estado final."""
+    event_id = row["id"]
+    handler = HANDLERS.get(row["type"])
+    conn = _db()
+    if handler is None:
+        conn.execute("UPDATE stripe_events SET status = 'ignored', processed_at = ? WHERE id = ?", (time.time(), event_id))
+        return "ignored"
+    try:
+        handler(event_id, json.loads(row["payload"]), json.loads(row["steps"]))
+        conn.execute(
+            "UPDATE stripe_events SET status = 'done', attempts = attempts + 1, processed_at = ?, last_error = NULL WHERE id = ?",
+            (time.time(), event_id)
+        )
+        return "done"
+    except Exception as e:
+        log.warning("Error procesando el evento de Stripe", extra={"event_id": event_id, "error": str(e)})
+        attempts = row["attempts"] + 1
+        status = "failed" if attempts >= config.WEBHOOK_MAX_ATTEMPTS else "pending"
+        delay = min(config.WEBHOOK_BACKOFF_MAX, config.WEBHOOK_BACKOFF_BASE ** attempts)
+        conn.execute(
+            "UPDATE stripe_events SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, claimed_by = NULL WHERE id = ?",
+            (status, attempts, time.time() + delay, str(e), event_id)
+        )
+        return status
+
+
+def _run(row) -> None:
+    try:
+        process(row)
+    finally:
+        _slots.release()
+        _wakeup.set()
+
+
+def _process_once() -> None:
+    # El hueco se devuelve si no hay eventos o si falla el reclamo o el
+    # submit; el evento ya reclamado vuelve a la cola al vencer el reclamo.
+    while _slots.acquire(blocking=False):
+        try:
+            rows = _claim(1)
+            if rows:
+                _executor.submit(_run, rows[0])
+        except BaseException:
+            _slots.release()
+            raise
+        if not rows:
+            _slots.release()
+            break
+
+
+def _process_loop():
+    while True:
+        _wakeup.wait(config.WEBHOOK_POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            _process_once()
+        except Exception as e:
+            if is_shutdown_error(e):
+                # El proceso termina: los eventos reclamados se recuperan al caducar el reclamo
+                return
+            log.exception("Error en el procesador de eventos de Stripe")
+
+
+def _start() -> None:
+    global _executor, _slots
+    _slots = threading.BoundedSemaphore(max(1, config.WEBHOOK_WORKERS))
+    _executor = per_process_executor("stripe-events", config.WEBHOOK_WORKERS)
+    threading.Thread(target=_process_loop, name="stripe-events-processor", daemon=True).start()
+
+
+def ensure_started() -> None:
+    """Arranca el procesador del proceso actual (una vez por pid)."""
+    once_per_process("stripe-events", _start)
+    _wakeup.set()
+
+
+def list_events(status: str = None, limit: int = 50) -> list:
+    query = "SELECT id, type, status, attempts, received_at, processed_at, last_error FROM stripe_events"
+    params: tuple = ()
+    if status:
+        query += " WHERE status = ?"
+        params = (status,)
+    query += " ORDER BY received_at DESC LIMIT ?"
+    return [dict(row) for row in _db().execute(query, params + (limit,)).fetchall()]
+
+
+def get_event(event_id: str):
+    row = _db().execute("SELECT * FROM stripe_events WHERE id = ?", (event_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def replay(event_id: str, reset_steps: bool = False, claim: bool = False) -> bool:
+    """Vuelve a poner un evento en cola; con reset_steps repite también los pasos ya hechos.
+
+    Con claim=True el evento queda reclamado por quien llama (para procesarlo
+    en el momento con process) y los workers no lo toman en paralelo.
+    """
+    now = time.time()
+    if claim:
+        query = "UPDATE stripe_events SET status = 'processing', attempts = 0, next_attempt_at = ?, claimed_by = ?, claimed_at = ?"
+        params: tuple = (now, uuid.uuid4().hex, now)
+    else:
+        query = "UPDATE stripe_events SET status = 'pending', attempts = 0, next_attempt_at = ?, claimed_by = NULL"
+        params = (now,)
+    if reset_steps:
+        query += ", steps = '{}'"
+    cursor = _db().execute(query + " WHERE id = ?", params + (event_id,))
+    return cursor.rowcount > 0
+
+
+def stats() -> dict:
+    rows = _db().execute("SELECT status, COUNT(*) AS total FROM stripe_events GROUP BY status").fetchall()
+    return {row["status"]: row["total"] for row in rows}